@@ -9,4 +9,4 @@ set -e
 #mkdir -p output logs
 
 ## run
-Rscript blues.R #| tee logs/blues.txt
+python3 -u blues.py #| tee logs/blues.txt
@@ -47,6 +47,10 @@ do
             python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=G --D --svd --lag_features #| tee "logs/g_model_D_svd_cv${cv}_fold${fold}_seed${seed}_lag_features.txt"
             python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=G --D --E --svd --lag_features #| tee "logs/g_model_D_E_svd_cv${cv}_fold${fold}_seed${seed}_lag_features.txt"
             echo '[G] D model ok'
+
+            python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=GBLUP --A #| tee "logs/gblup_A_cv${cv}_fold${fold}_seed${seed}.txt"
+            python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=GBLUP --D #| tee "logs/gblup_D_cv${cv}_fold${fold}_seed${seed}.txt"
+            echo '[GBLUP] A and D models ok'
         done
     done
     echo " "
@@ -28,6 +28,10 @@ do
 
             python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=GxE --D --svd --lag_features #| tee "logs/gxe_model_D_svd_cv${cv}_fold${fold}_seed${seed}_lag_features.txt"
             echo '[GxE] D model ok'
+
+            python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=KGxE --A --eigen_cache=eigen_cache #| tee "logs/kgxe_A_cv${cv}_fold${fold}_seed${seed}.txt"
+            python3 -u run_g_or_gxe_model.py --cv=${cv} --fold=${fold} --seed=${seed} --model=KGxE --D --eigen_cache=eigen_cache #| tee "logs/kgxe_D_cv${cv}_fold${fold}_seed${seed}.txt"
+            echo '[KGxE] A and D kernel models ok'
         done
     done
     echo " "
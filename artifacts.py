@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store of the intermediate files of the pipeline.
+
+Files are kept once, as read-only blobs named by the hash of their content
+(``objects/ab/cdef...``), and working directories get hard links to them, so a file produced
+in several places (reruns, other working directories, identical outputs of different tasks)
+takes the disk space of one copy. ``manifest.json`` maps file names to hashes and
+``actions.json`` maps the digest of a task (command, code and input hashes) to the hashes of
+its outputs, so ``run_local.py`` restores the outputs of a task that ran before, in any
+working directory sharing the store, by linking them instead of running it again.
+
+Example:
+    python3 artifacts.py stats --store output/.store
+    python3 artifacts.py gc --store output/.store
+"""
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+
+
+def file_digest(path: Path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+class ArtifactStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        self.actions_path = self.root / "actions.json"
+        self.manifest = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+        self.actions = json.loads(self.actions_path.read_text()) if self.actions_path.exists() else {}
+
+    def blob(self, digest: str):
+        return self.objects / digest[:2] / digest[2:]
+
+    def has(self, digest: str):
+        return self.blob(digest).exists()
+
+    def save(self):
+        _write_json(self.manifest_path, self.manifest)
+        _write_json(self.actions_path, self.actions)
+
+    def put(self, path: Path, digest: str = None):
+        """
+        Add the file at ``path`` and replace it by a link to its blob. A file whose content is
+        already stored only costs a link.
+        """
+        path = Path(path)
+        digest = digest or file_digest(path)
+        blob = self.blob(digest)
+        if not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            tmp = blob.with_suffix(f".{os.getpid()}.tmp")
+            try:
+                os.link(path, tmp)
+            except OSError:  # other file system
+                shutil.copyfile(path, tmp)
+            os.chmod(tmp, 0o444)  # links share the blob, nothing may write to it in place
+            os.replace(tmp, blob)
+        if not (path.exists() and os.path.samefile(path, blob)):
+            self.link(digest, path)
+        self.manifest[path.name] = digest
+        return digest
+
+    def link(self, digest: str, dest: Path):
+        """Materialize the blob ``digest`` at ``dest``."""
+        dest = Path(dest)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+        try:
+            os.link(self.blob(digest), tmp)
+        except OSError:
+            shutil.copyfile(self.blob(digest), tmp)
+        os.replace(tmp, dest)
+
+    def record(self, action: str, outputs: dict):
+        """Outputs (name -> hash) of the task with digest ``action``."""
+        self.actions[action] = outputs
+
+    def lookup(self, action: str):
+        """Outputs of an earlier run of the task with digest ``action``, if all are still stored."""
+        outputs = self.actions.get(action)
+        if outputs is not None and all(self.has(digest) for digest in outputs.values()):
+            return outputs
+        return None
+
+    def stats(self):
+        blobs = [p for p in self.objects.glob("*/*") if not p.name.endswith(".tmp")]
+        stored = sum(p.stat().st_size for p in blobs)
+        referenced = set(self.manifest.values()) | {d for outputs in self.actions.values() for d in outputs.values()}
+        # disk space the action outputs would take as separate files
+        logical = sum(
+            self.blob(d).stat().st_size
+            for outputs in self.actions.values()
+            for d in outputs.values()
+            if self.has(d)
+        )
+        return {
+            "blobs": len(blobs),
+            "stored_bytes": stored,
+            "action_output_bytes": logical,
+            "actions": len(self.actions),
+            "unreferenced": len({p.parent.name + p.name for p in blobs} - referenced),
+        }
+
+    def gc(self, keep_actions: bool = True):
+        """Delete blobs that neither the manifest nor (if ``keep_actions``) a recorded action references."""
+        referenced = set(self.manifest.values())
+        if keep_actions:
+            referenced |= {d for outputs in self.actions.values() for d in outputs.values()}
+        else:
+            self.actions = {}
+        removed = 0
+        for blob in self.objects.glob("*/*"):
+            if blob.parent.name + blob.name not in referenced:
+                blob.unlink()
+                removed += 1
+        self.save()
+        return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["stats", "gc"])
+    parser.add_argument("--store", type=Path, default=Path("output/.store"))
+    parser.add_argument("--drop_actions", action="store_true", default=False, help="gc: also forget recorded tasks")
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.store)
+    if args.command == "stats":
+        for key, value in store.stats().items():
+            print(f"{key}: {value}")
+    else:
+        print(f"Removed {store.gc(keep_actions=not args.drop_actions)} blobs")
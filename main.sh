@@ -7,7 +7,9 @@ DIR=$(realpath $(dirname $0))
 export PYTHONPATH=`pegasus-config --python`:`pegasus-config --python-externals`
 
 #### Executing Workflow Generator ####
-${DIR}/workflow.py -e condorpool -o $(pwd)/workflow.yml
+# tasks per clustered job (horizontal clustering of the per-task jobs)
+CLUSTER_SIZE=${CLUSTER_SIZE:-10}
+${DIR}/workflow.py -e condorpool -c ${CLUSTER_SIZE} -o $(pwd)/workflow.yml
 
 # cat >> pegasus.properties <<EOF
 # env.JAVA_HOME = /opt/homebrew/opt/openjdk
@@ -19,6 +21,7 @@ pegasus-plan --conf pegasus.properties \
     --sites condorpool \
     --output-sites local \
     --cleanup leaf \
+    --cluster horizontal \
     --force \
     "$@" workflow.yml
 
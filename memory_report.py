@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Memory requests of the ``workflow.py`` tasks from the stage timings logged by ``instrument.py``.
+
+Lines of the timing logs (``run_local.py --timings``, or ``--timings`` of the scripts) are
+mapped to the task family they ran (the task name without cv, fold and seed, from the
+``run_local.py`` task name or else by matching the command line against the stage graph),
+and every family gets the largest peak RSS of its runs times ``--headroom``, rounded up to
+``--step`` MB. The report shows the current request of the family next to it with its
+heaviest stage, and ``--output`` writes the suggestions as the JSON that
+``workflow.py --memory_requests`` applies.
+
+Example:
+    python3 run_local.py --data data/Training_Data --work_dir output --timings output/timings.jsonl
+    python3 memory_report.py output/timings.jsonl --output memory_requests.json
+    python3 workflow.py --memory_requests memory_requests.json
+"""
+import json
+import math
+import argparse
+from pathlib import Path
+from statistics import median
+
+from workflow import stage_graph, task_family
+
+
+INSTRUMENT_FLAGS = ("--timings", "--profile")
+
+
+def read_logs(paths: list):
+    records = []
+    for path in paths:
+        for file in sorted(Path(path).glob("*.jsonl")) if Path(path).is_dir() else [Path(path)]:
+            with open(file) as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def command_key(script: str, argv: list):
+    """Command line of a run without the instrumentation flags, to compare with the stage graph."""
+    args, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in INSTRUMENT_FLAGS:
+            skip = True
+        elif not arg.startswith(tuple(f"{x}=" for x in INSTRUMENT_FLAGS)):
+            args.append(arg)
+    return (script, *args)
+
+
+def families(records: list):
+    """Family and current memory request of each record, None for runs outside the stage graph."""
+    tasks = {task.name: task for stage in stage_graph() for task in stage.tasks}
+    commands = {command_key(task.command[2], task.command[3:]): task for task in tasks.values() if task.command[0] == "python3"}
+    found = []
+    for record in records:
+        task = tasks.get(record.get("task")) or commands.get(command_key(record["script"], record["argv"]))
+        found.append((task_family(task.name), task.memory) if task is not None else (None, None))
+    return found
+
+
+def suggest(peak_mb: float, headroom: float, step: int):
+    return f"{max(step, math.ceil(peak_mb * headroom / step) * step)} MB"
+
+
+def report(records: list, headroom: float, step: int):
+    rows = {}
+    unmatched = 0
+    for record, (family, memory) in zip(records, families(records)):
+        if "peak_rss_mb" not in record:
+            continue
+        if family is None:
+            unmatched += record["stage"] == "total"
+            continue
+        row = rows.setdefault(family, {"memory": memory, "peaks": [], "walls": [], "stages": {}})
+        if record["stage"] == "total":
+            row["peaks"].append(record["peak_rss_mb"])
+            row["walls"].append(record["wall_s"])
+        else:
+            stage = record["stage"]
+            row["stages"][stage] = max(row["stages"].get(stage, 0.0), record["peak_rss_mb"])
+
+    lines = []
+    for family, row in sorted(rows.items()):
+        if not row["peaks"]:
+            continue
+        heaviest = max(row["stages"], key=row["stages"].get) if row["stages"] else ""
+        lines.append({
+            "family": family,
+            "runs": len(row["peaks"]),
+            "wall_s": median(row["walls"]),
+            "peak_rss_mb": max(row["peaks"]),
+            "heaviest_stage": heaviest,
+            "current": row["memory"],
+            "suggested": suggest(max(row["peaks"]), headroom, step),
+        })
+    return lines, unmatched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", type=Path, nargs="+", help="timing logs or directories of *.jsonl logs")
+    parser.add_argument("--headroom", type=float, default=1.25, help="factor over the largest peak RSS")
+    parser.add_argument("--step", type=int, default=512, help="requests are rounded up to multiples of this (MB)")
+    parser.add_argument("--output", type=Path, default=None, help="JSON of the suggestions for workflow.py --memory_requests")
+    args = parser.parse_args()
+
+    lines, unmatched = report(read_logs(args.logs), args.headroom, args.step)
+    print(f"{'task family':<42}{'runs':>6}{'wall (s)':>10}{'peak (MB)':>11}  {'heaviest stage':<16}{'current':>10}{'suggested':>11}")
+    for line in lines:
+        print(
+            f"{line['family']:<42}{line['runs']:>6}{line['wall_s']:>10.1f}{line['peak_rss_mb']:>11.0f}  "
+            f"{line['heaviest_stage']:<16}{line['current']:>10}{line['suggested']:>11}"
+        )
+    if unmatched:
+        print(f"\n{unmatched} runs are not tasks of the stage graph")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({line["family"]: line["suggested"] for line in lines}, indent=1))
+        print("\nWriting:", args.output)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Local executor of the stage graph declared in ``workflow.py``.
+
+Runs the tasks of the stages (one per cv, fold, seed and model variant) on a pool of local
+processes, each task as soon as the tasks producing its inputs are done. A task is skipped
+when the content hashes of its inputs, its command and its code are the ones of its last
+successful run and its outputs are unchanged since. Code hashes follow the local imports of
+a script down to the functions it uses, so editing ``feat_eng_weather`` reruns the dataset
+tasks, and the model tasks only if their datasets changed.
+
+The scripts and the raw data files are symlinked into the working directory, like Pegasus
+stages them, and every task logs to ``logs/<task>.txt`` there. Outputs go to the
+content-addressed store of ``artifacts.py`` and stay in the working directory as links to it:
+identical files are stored once, and a task that ran before with the same digest, in this or
+another working directory sharing the store, gets its outputs linked back instead of rerunning.
+
+Example:
+    python3 run_local.py --data data/Training_Data --work_dir output --jobs 8
+    python3 run_local.py --stages 2-job_datasets.sh 5-job_e.sh --cv 0 --seed 1 --dry_run
+    python3 run_local.py --data data/Training_Data --work_dir output_pruned --store output/.store
+"""
+import os
+import ast
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from artifacts import ArtifactStore, file_digest
+from workflow import CVS, FOLDS, SEEDS, stage_graph, replicas
+
+
+ROOT = Path(__file__).parent.resolve()
+CODE_DIRS = [ROOT / "src", ROOT]
+STATE_FILE = ".run_local_state.json"
+WORKER_SCRIPTS = ("create_datasets.py", "run_e_model.py", "run_g_or_gxe_model.py")  # the runners of worker.py
+
+
+class FileHashes:
+    """Content hashes of files, recomputed only when their size or mtime changed."""
+
+    def __init__(self, cache: dict):
+        self.cache = cache  # name -> [size, mtime_ns, digest]
+
+    def __call__(self, path: Path):
+        stat = path.stat()
+        entry = self.cache.get(str(path))
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = file_digest(path)
+        self.cache[str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def set(self, path: Path, digest: str):
+        stat = path.stat()
+        self.cache[str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+
+
+def find_code(name: str):
+    for directory in CODE_DIRS:
+        if (directory / name).exists():
+            return directory / name
+    return None
+
+
+def python_code(path: Path, names, sources: dict):
+    """
+    Add to ``sources`` the source of ``names`` in the module at ``path`` (the whole module
+    for None), of the module-level definitions they use and, recursively, of what they
+    import from other local modules.
+    """
+    text = path.read_text()
+    tree = ast.parse(text)
+    definitions = {}
+    imports = {}  # local name -> (module, imported name or None for the whole module)
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            for target in node.targets if isinstance(node, ast.Assign) else [node.target]:
+                for name in ast.walk(target):
+                    if isinstance(name, ast.Name):
+                        definitions[name.id] = node
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and find_code(f"{node.module}.py"):
+            for alias in node.names:
+                imports[alias.asname or alias.name] = (node.module, alias.name)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if find_code(f"{alias.name}.py"):
+                    imports[alias.asname or alias.name.split(".")[0]] = (alias.name, None)
+
+    if names is None:
+        sources[path.name, None] = text
+        used = set(imports)
+    else:
+        used = set()
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name in used:
+                continue
+            used.add(name)
+            if name in definitions:
+                sources[path.name, name] = ast.get_source_segment(text, definitions[name])
+                todo.extend(n.id for n in ast.walk(definitions[name]) if isinstance(n, ast.Name))
+
+    for name in sorted(used & set(imports)):
+        module, imported = imports[name]
+        key = (f"{module}.py", imported)
+        if key not in sources and (f"{module}.py", None) not in sources:
+            python_code(find_code(f"{module}.py"), None if imported is None else [imported], sources)
+
+
+def code_digest(scripts: list):
+    """Hash of the code a task runs: whole scripts, and the parts of local modules they use."""
+    sources = {}
+    for script in scripts:
+        path = find_code(script)
+        if path.suffix == ".py":
+            python_code(path, None, sources)
+        else:
+            sources[path.name, None] = path.read_text()
+    h = hashlib.blake2b(digest_size=16)
+    for key in sorted(sources, key=str):
+        h.update(json.dumps([key, sources[key]]).encode())
+    return h.hexdigest()
+
+
+def stage_in(work_dir: Path, data_dir: Path):
+    """Symlink the scripts and the raw data files into the working directory."""
+    files = {p.name: p for d in reversed(CODE_DIRS) for p in d.iterdir() if p.suffix in (".py", ".R", ".sh")}
+    if data_dir is not None:
+        files.update(replicas(data_dir))
+    for name, path in files.items():
+        link = work_dir / name
+        if link.is_symlink() and link.resolve() == path.resolve():
+            continue
+        if link.is_symlink():
+            link.unlink()
+        if not link.exists():
+            link.symlink_to(path.resolve())
+
+
+class Executor:
+    def __init__(self, work_dir: Path, tasks: list, jobs: int, force=False, dry_run=False, store: ArtifactStore = None,
+                 timings: Path = None, worker: str = None):
+        self.work_dir = work_dir
+        self.store = store
+        self.timings = None if timings is None else Path(timings).resolve()
+        self.worker = worker  # socket of worker.py ("" for its default), None to start every script
+        self.tasks = {task.name: task for task in tasks}
+        self.jobs = jobs
+        self.force = force
+        self.dry_run = dry_run
+        self.state_path = work_dir / STATE_FILE
+        self.state = json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+        self.state.setdefault("files", {})
+        self.state.setdefault("tasks", {})
+        self.hashes = FileHashes(self.state["files"])
+        self.code = {}
+
+        producer = {f: task.name for task in tasks for f in task.outputs}
+        self.deps = {
+            task.name: {producer[f] for f in task.inputs if f in producer and producer[f] != task.name}
+            for task in tasks
+        }
+
+    def save_state(self):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state))
+        os.replace(tmp, self.state_path)
+        if self.store is not None:
+            self.store.save()
+
+    def task_digest(self, task):
+        key = tuple(task.code)
+        if key not in self.code:
+            self.code[key] = code_digest(task.code)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(json.dumps([task.command, self.code[key]]).encode())
+        for f in task.inputs:
+            h.update(f"{f}:{self.hashes(self.work_dir / f)}".encode())
+        return h.hexdigest()
+
+    def outdated(self, task, digest):
+        """Why ``task`` has to run, None when it is up to date."""
+        if self.force:
+            return "forced"
+        last = self.state["tasks"].get(task.name)
+        if last is None:
+            return "never ran"
+        if last["digest"] != digest:
+            return "inputs or code changed"
+        for f in task.outputs:
+            path = self.work_dir / f
+            if not path.exists():
+                return f"missing output {f}"
+            if self.hashes(path) != last["outputs"].get(f):
+                return f"output {f} changed"
+        return None
+
+    def restore(self, task, digest):
+        """Link the outputs of an earlier run of ``task`` with the same digest from the store."""
+        outputs = self.store.lookup(digest) if self.store is not None and not self.force else None
+        if outputs is None or set(outputs) != set(task.outputs):
+            return False
+        for f, file_hash in outputs.items():
+            self.store.link(file_hash, self.work_dir / f)
+            self.hashes.set(self.work_dir / f, file_hash)
+        self.state["tasks"][task.name] = {"digest": digest, "outputs": outputs}
+        return True
+
+    def store_outputs(self, task, digest):
+        outputs = {}
+        for f in task.outputs:
+            path = self.work_dir / f
+            outputs[f] = self.hashes(path)
+            if self.store is not None:
+                self.store.put(path, outputs[f])
+                self.hashes.set(path, outputs[f])
+        if self.store is not None:
+            self.store.record(digest, outputs)
+        self.state["tasks"][task.name] = {"digest": digest, "outputs": outputs}
+
+    def execute(self, task):
+        # stored outputs are read-only links to their blobs, the task writes new files
+        for f in task.outputs:
+            (self.work_dir / f).unlink(missing_ok=True)
+        command = [sys.executable if task.command[0] == "python3" else task.command[0], *task.command[1:]]
+        if self.worker is not None and task.command[0] == "python3" and task.command[2] in WORKER_SCRIPTS:
+            socket = ["--socket", self.worker] if self.worker else []
+            command = [sys.executable, "-u", "worker.py", *socket, "run", *task.command[2:]]
+        env = None
+        if self.timings is not None:  # stage timings of the Python scripts (instrument.py)
+            env = {**os.environ, "INSTRUMENT_LOG": str(self.timings), "INSTRUMENT_TASK": task.name}
+        start = time.perf_counter()
+        with open(self.work_dir / "logs" / f"{task.name}.txt", "w") as log:
+            code = subprocess.run(command, cwd=self.work_dir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+        return code, time.perf_counter() - start
+
+    def run(self):
+        (self.work_dir / "logs").mkdir(parents=True, exist_ok=True)
+        pending = dict(self.tasks)
+        running = {}
+        done, failed, ran, skipped, restored = set(), set(), [], [], []
+
+        with ThreadPoolExecutor(self.jobs) as pool:
+            while pending or running:
+                for name, task in list(pending.items()):
+                    deps = self.deps[name]
+                    if deps & failed:
+                        print(f"[blocked] {name}")
+                        failed.add(name)
+                        del pending[name]
+                    elif deps <= done:
+                        del pending[name]
+                        if self.dry_run and deps & set(ran):
+                            print(f"[run] {name}: upstream task runs")
+                            ran.append(name)
+                            done.add(name)
+                            continue
+                        missing = [f for f in task.inputs if not (self.work_dir / f).exists()]
+                        if missing:
+                            print(f"[failed] {name}: missing input {missing[0]}")
+                            failed.add(name)
+                            continue
+                        digest = self.task_digest(task)
+                        reason = self.outdated(task, digest)
+                        if reason is None:
+                            skipped.append(name)
+                            done.add(name)
+                        elif self.dry_run:
+                            print(f"[run] {name}: {reason}")
+                            ran.append(name)
+                            done.add(name)
+                        elif self.restore(task, digest):
+                            print(f"[restored] {name}: {reason}")
+                            restored.append(name)
+                            done.add(name)
+                            self.save_state()
+                        else:
+                            print(f"[start] {name}: {reason}")
+                            running[pool.submit(self.execute, task)] = (task, digest)
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task, digest = running.pop(future)
+                    code, seconds = future.result()
+                    missing = [f for f in task.outputs if not (self.work_dir / f).exists()]
+                    if code != 0 or missing:
+                        reason = f"exit code {code}" if code != 0 else f"missing output {missing[0]}"
+                        print(f"[failed] {task.name}: {reason}, see logs/{task.name}.txt")
+                        self.state["tasks"].pop(task.name, None)
+                        failed.add(task.name)
+                    else:
+                        print(f"[done] {task.name}: {seconds:.1f}s")
+                        self.store_outputs(task, digest)
+                        ran.append(task.name)
+                        done.add(task.name)
+                    self.save_state()
+
+        if not self.dry_run:
+            self.save_state()
+        print(
+            f"\n{len(ran)} {'to run' if self.dry_run else 'ran'}, {len(restored)} restored from the store, "
+            f"{len(skipped)} up to date, {len(failed)} failed"
+        )
+        return failed
+
+
+def select(stages: list, names: list):
+    if names:
+        unknown = set(names) - {stage.name for stage in stages}
+        if unknown:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}")
+        stages = [stage for stage in stages if stage.name in names]
+    return [task for stage in stages for task in stage.tasks]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--data", type=Path, default=None, help="input data directory (data/Training_Data/)")
+    parser.add_argument("-w", "--work_dir", type=Path, default=Path("output"))
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="tasks run at the same time")
+    parser.add_argument("--stages", nargs="+", default=None, help="job scripts to run, e.g. 5-job_e.sh (default: all)")
+    parser.add_argument("--cv", type=int, nargs="+", default=list(CVS))
+    parser.add_argument("--fold", type=int, nargs="+", default=list(FOLDS))
+    parser.add_argument("--seed", type=int, nargs="+", default=list(SEEDS))
+    parser.add_argument("--force", action="store_true", default=False, help="rerun the selected tasks")
+    parser.add_argument("--dry_run", action="store_true", default=False, help="only print what would run")
+    parser.add_argument("--store", type=Path, default=None, help="artifact store, can be shared (default: WORK_DIR/.store)")
+    parser.add_argument("--no_store", action="store_true", default=False, help="keep outputs as plain files")
+    parser.add_argument("--timings", type=Path, default=None, help="JSONL log of the tasks' stage timings and peak RSS")
+    parser.add_argument(
+        "--worker",
+        nargs="?",
+        const="",
+        default=None,
+        help="send the Python model and dataset tasks to worker.py (at this socket, default: its own)",
+    )
+    parser.add_argument(
+        "--feature_store",
+        type=Path,
+        default=None,
+        help="per-Env features of ingest.py for the datasets, and the cache of the Kronecker rows",
+    )
+    args = parser.parse_args()
+
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    stage_in(args.work_dir, args.data)
+    feature_store = None if args.feature_store is None else args.feature_store.resolve()
+    tasks = select(stage_graph(args.cv, args.fold, args.seed, feature_store), args.stages)
+    print(f"{len(tasks)} tasks in {args.work_dir}")
+
+    store = None if args.no_store else ArtifactStore(args.store or args.work_dir / ".store")
+    failed = Executor(args.work_dir, tasks, args.jobs, args.force, args.dry_run, store, args.timings, args.worker).run()
+    sys.exit(1 if failed else 0)
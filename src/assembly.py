@@ -0,0 +1,358 @@
+"""
+Gather-based assembly of the G/GxE design matrices.
+
+Each feature source (kinship, Kronecker, E and lag features) is kept as a
+``Block`` of dense rows addressed by ``Hybrid``, ``Env`` or ``(Env, Hybrid)``
+keys. ``assemble`` maps every target row to a row position in each block and
+fills one preallocated float array, so the design matrix is materialized once
+instead of once per merge/dropna/set_index step.
+"""
+import gc
+import os
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from sklearn.decomposition import TruncatedSVD
+
+from preprocessing import create_field_location
+
+
+KEYS = ["Env", "Hybrid"]
+TARGET = "Yield_Mg_ha"
+CHUNK_ROWS = 4096  # rows gathered per np.take, bounds the temporary buffer
+KINSHIP_CACHE = None  # parsed kinship files by (path, size, mtime), a dict in worker.py so jobs share them
+
+
+class Block:
+    """Dense feature rows addressed by an ``Env``, ``Hybrid`` or ``(Env, Hybrid)`` index.
+
+    ``values`` is either a 2d ndarray or a pyarrow table (read column by column so
+    the full Kronecker never has to be converted to numpy). ``usecols`` optionally
+    selects a subset of the source columns. ``name`` is the source of the block (a
+    kinship, a Kronecker file, ``E``, ``lag`` or ``Field_Location``), which the test
+    design of a saved model is rebuilt from.
+    """
+
+    def __init__(self, index: pd.Index, values, columns: list, usecols=None, name: str = None):
+        assert index.is_unique, "block keys must be unique"
+        self.index = index
+        self.values = values
+        self.columns = list(columns)
+        self.usecols = usecols
+        self.name = name
+
+    @property
+    def width(self):
+        return len(self.columns)
+
+    def positions(self, keys: pd.MultiIndex):
+        """Row position in this block of every (Env, Hybrid) key, -1 if absent."""
+        if isinstance(self.index, pd.MultiIndex):
+            return self.index.get_indexer(keys)
+        return self.index.get_indexer(keys.get_level_values(self.index.name))
+
+    def fill(self, out: np.ndarray, rows: np.ndarray):
+        if isinstance(self.values, np.ndarray):
+            for start in range(0, len(rows), CHUNK_ROWS):
+                chunk = rows[start:start + CHUNK_ROWS]
+                if self.usecols is None:
+                    out[start:start + CHUNK_ROWS] = np.take(self.values, chunk, axis=0)
+                else:
+                    out[start:start + CHUNK_ROWS] = self.values[np.ix_(chunk, self.usecols)]
+        else:
+            usecols = range(self.width) if self.usecols is None else self.usecols
+            for j, col in enumerate(usecols):
+                out[:, j] = self.values.column(col).to_numpy()[rows]
+
+
+class Projection(NamedTuple):
+    """SVD projection of the leading ``columns`` of a design onto ``components``."""
+    columns: list
+    components: np.ndarray
+    explained: np.ndarray = None  # explained variance ratio of every component
+    seconds: float = None  # wall time of the SVD fit
+
+    def transform(self, X: np.ndarray):
+        k = len(self.columns)
+        return np.hstack([X[:, :k] @ self.components.T, X[:, k:]])
+
+
+class Design(NamedTuple):
+    X: np.ndarray
+    y: np.ndarray
+    index: pd.MultiIndex
+    columns: list
+    categories: list = None  # Field_Location levels of the codes
+    projection: Projection = None
+    blocks: list = None  # (name, start, stop) of every block in the assembled columns, before any SVD
+
+
+def strip_hybrid_prefix(s: pd.Series):
+    return s.str.replace(r"^Hybrid", "", regex=True)
+
+
+def read_targets(path):
+    df = pd.read_csv(path)
+    df["Hybrid"] = strip_hybrid_prefix(df["Hybrid"])
+    return df
+
+
+def kinship_table(path):
+    """Hybrid names and values of a kinship file, parsed once per file version with ``KINSHIP_CACHE``."""
+    stat = os.stat(path)
+    key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if KINSHIP_CACHE is not None and key in KINSHIP_CACHE:
+        return KINSHIP_CACHE[key]
+    df = pd.read_csv(path, sep="\t")
+    names = [x[: len(x) // 2].rstrip("_") for x in df.columns]  # fix duplicated column names
+    values = df.to_numpy(dtype=np.float64)
+    del df
+    if KINSHIP_CACHE is not None:
+        for stale in [k for k in KINSHIP_CACHE if k[0] == key[0]]:
+            del KINSHIP_CACHE[stale]
+        values.setflags(write=False)  # shared by every job reading the file
+        KINSHIP_CACHE[key] = (names, values)
+    return names, values
+
+
+def read_kinship(path, kinship: str, individuals: list):
+    """Kinship rows for every genotyped hybrid, columns restricted to ``individuals``."""
+    individuals = set(x.replace("Hybrid", "") if x.startswith("Hybrid") else x for x in individuals)
+    names, values = kinship_table(path)
+    usecols = np.array([i for i, x in enumerate(names) if x in individuals], dtype=np.intp)
+    return Block(
+        pd.Index(names, name="Hybrid"),
+        values,
+        [f"{names[i]}_{kinship}" for i in usecols],
+        usecols=usecols,
+        name=kinship,
+    )
+
+
+def read_kronecker(path, kinship: str):
+    """Kronecker rows keyed by (Env, Hybrid), read lazily from the arrow file."""
+    table = feather.read_table(path, memory_map=True)
+    ids = table.column("id").to_pandas().str.split(":", n=1, expand=True)
+    index = pd.MultiIndex.from_arrays([ids[0], ids[1]], names=KEYS)
+    table = table.drop_columns(["id"])
+    return Block(index, table, [f"{x}_{kinship}" for x in table.column_names], name=kinship)
+
+
+def read_features(path):
+    """Split a ``x{train,val}`` dataset into an E block and a lagged yield block."""
+    df = pd.read_csv(path)
+    df["Hybrid"] = strip_hybrid_prefix(df["Hybrid"])
+    index = pd.MultiIndex.from_frame(df[KEYS])
+    lag_cols = [x for x in df.columns if "yield_lag" in x]
+    e_cols = [x for x in df.columns if x not in KEYS and "_lag" not in x]
+    return (
+        Block(index, df[e_cols].to_numpy(dtype=np.float64), e_cols, name="E"),
+        Block(index, df[lag_cols].to_numpy(dtype=np.float64), lag_cols, name="lag"),
+    )
+
+
+def complete_columns(block: Block):
+    """Names of the feature columns without missing values (``dropna(axis=1)``)."""
+    keep = ~np.isnan(block.values).any(axis=0)
+    return [c for c, k in zip(block.columns, keep) if k]
+
+
+def select_columns(block: Block, columns: list):
+    positions = [block.columns.index(c) for c in columns]
+    return Block(block.index, block.values[:, positions], columns, name=block.name)
+
+
+def field_location_block(envs, categories=None):
+    """Field_Location as categorical codes per Env, NaN for locations unseen in ``categories``."""
+    envs = pd.Index(pd.unique(np.asarray(envs)), name="Env")
+    locations = envs.str.replace("(_).*", "", regex=True)
+    if categories is None:
+        categories = sorted(set(locations))
+    codes = pd.Categorical(locations, categories=categories).codes.astype(np.float64)
+    codes[codes < 0] = np.nan
+    return Block(envs, codes[:, None], ["Field_Location"], name="Field_Location"), categories
+
+
+def assemble(y: pd.DataFrame, blocks: list):
+    """
+    Inner join of the targets with every block, filled into one float array.
+    Rows keep the order of ``y``; rows missing from any block or without a target are dropped.
+    """
+    keys = pd.MultiIndex.from_frame(y[KEYS])
+    target = y[TARGET].to_numpy(dtype=np.float64)
+    positions = [block.positions(keys) for block in blocks]
+    mask = ~np.isnan(target)
+    for pos in positions:
+        mask &= pos >= 0
+
+    X = np.empty((int(mask.sum()), sum(b.width for b in blocks)), dtype=np.float64)
+    start = 0
+    layout = []
+    for block, pos in zip(blocks, positions):
+        block.fill(X[:, start:start + block.width], pos[mask])
+        layout.append((block.name, start, start + block.width))
+        start += block.width
+    columns = [c for b in blocks for c in b.columns]
+    return Design(X, target[mask], keys[mask], columns, blocks=layout)
+
+
+def read_e_fold(cv: int, fold: int, seed: int):
+    """E-model datasets of a fold, indexed by (Env, Hybrid) with Field_Location as a factor."""
+    xtrain = pd.read_csv(f"cv{cv}_xtrain_fold{fold}_seed{seed}.csv")
+    xval = pd.read_csv(f"cv{cv}_xval_fold{fold}_seed{seed}.csv")
+    ytrain = pd.read_csv(f"cv{cv}_ytrain_fold{fold}_seed{seed}.csv").set_index(KEYS)[TARGET]
+    yval = pd.read_csv(f"cv{cv}_yval_fold{fold}_seed{seed}.csv").set_index(KEYS)[TARGET]
+
+    # add factor
+    xtrain = create_field_location(xtrain)
+    xtrain["Field_Location"] = xtrain["Field_Location"].astype("category")
+    xval = create_field_location(xval)
+    xval["Field_Location"] = xval["Field_Location"].astype("category")
+
+    # set index
+    xtrain = xtrain.set_index(KEYS)
+    xval = xval.set_index(KEYS)
+    return xtrain, xval, ytrain, yval
+
+
+def leading_components(design: Design, k: int):
+    """
+    Design on the leading ``k`` SVD components of ``design``, in place of an SVD fitted at rank ``k``
+    (the same components up to sign with arpack, nested approximations with the randomized solver).
+    """
+    projection = design.projection
+    n = len(projection.components)
+    if k == n:
+        return design
+    if k > n:
+        raise Exception(f"The design has {n} SVD components, fewer than {k}.")
+    projection = projection._replace(components=projection.components[:k], explained=projection.explained[:k])
+    return design._replace(
+        X=np.hstack([design.X[:, :k], design.X[:, n:]]),
+        columns=design.columns[:k] + design.columns[n:],
+        projection=projection,
+    )
+
+
+def g_or_gxe_designs(cv: int, fold: int, seed: int, model: str, A=False, D=False, E=False,
+                     lag_features=False, svd=False, n_components=100, low_rank=None, rank=100, landmarks=None,
+                     svd_solver="randomized"):
+    """
+    Training and validation designs of a G or GxE model, and the suffix of its output files.
+    Genomic (and E) columns are replaced by ``n_components`` SVD components if ``svd``, fitted
+    with the ``svd_solver`` algorithm of ``TruncatedSVD`` (randomized or arpack).
+    With ``low_rank`` (G model), the kinship columns are replaced by ``rank`` features of
+    ``low_rank.py`` computed from the kinship columns of ``landmarks`` hybrids.
+    """
+    prefix = f"cv{cv}_"
+    suffix = ""
+
+    # load targets
+    ytrain = read_targets(Path(f"{prefix}ytrain_fold{fold}_seed{seed}.csv"))
+    yval = read_targets(Path(f"{prefix}yval_fold{fold}_seed{seed}.csv"))
+    individuals = ytrain["Hybrid"].unique().tolist() + yval["Hybrid"].unique().tolist()
+    individuals = list(dict.fromkeys(individuals))  # take unique but preserves order (python 3.7+)
+
+    if low_rank is not None and model != "G":
+        raise Exception("Low-rank kinship features are implemented for the G model.")
+
+    def genomic(path, kinship):
+        if low_rank is None:
+            return read_kinship(path, kinship, individuals)
+        from low_rank import read_low_rank  # imports this module
+
+        train_hybrids = ytrain["Hybrid"].unique().tolist()
+        return read_low_rank(low_rank, path, kinship, train_hybrids, individuals, rank, landmarks, seed)
+
+    # load kinships or kroneckers, kept as blocks that are gathered by row index
+    blocks = []
+    if A:
+        print("Using A matrix.")
+        suffix += "_A"
+        if model == "G":
+            blocks.append(genomic("kinship_additive.txt", "A"))
+        else:
+            blocks.append(read_kronecker(Path(f"{prefix}kronecker_additive.arrow"), "additive"))
+    if D:
+        print("Using D matrix.")
+        suffix += "_D"
+        if model == "G":
+            blocks.append(genomic("kinship_dominant.txt", "D"))
+        else:
+            blocks.append(read_kronecker(Path(f"{prefix}kronecker_dominant.arrow"), "dominant"))
+    if low_rank is not None:
+        print(f"Using {low_rank} features of rank {rank}.")
+        suffix += f"_{low_rank}{rank}"
+
+    print("Using fold", fold)
+
+    if len(blocks) == 0:
+        raise Exception("Choose at least one matrix.")
+
+    blocks_train = list(blocks)
+    blocks_val = list(blocks)
+    del blocks
+
+    # include E matrix if requested (without lagged yield features)
+    if E or lag_features:
+        Etrain, lag_train = read_features(Path(f"{prefix}xtrain_fold{fold}_seed{seed}.csv"))
+        Eval, lag_val = read_features(Path(f"{prefix}xval_fold{fold}_seed{seed}.csv"))
+    if E:
+        if model == "G":
+            print("Using E matrix.")
+            suffix += "_E"
+            e_cols = complete_columns(Etrain)
+            blocks_train.append(select_columns(Etrain, e_cols))
+            blocks_val.append(select_columns(Eval, e_cols))
+            del Etrain, Eval
+        else:
+            raise Exception("G+E+GxE is not implemented.")
+    n_no_lags = sum(block.width for block in blocks_train)
+
+    # bind lagged yield features
+    if lag_features:
+        suffix += "_lag_features"
+        blocks_train.append(lag_train)
+        blocks_val.append(lag_val)
+
+    # add factor
+    field_location, categories = field_location_block(ytrain["Env"])
+    blocks_train.append(field_location)
+    blocks_val.append(field_location_block(yval["Env"], categories)[0])
+
+    # one gather per block into a preallocated design matrix
+    xtrain = assemble(ytrain, blocks_train)._replace(categories=categories)
+    xval = assemble(yval, blocks_val)._replace(categories=categories)
+    del blocks_train, blocks_val
+    gc.collect()
+
+    if not svd:
+        print("Using full set of features.")
+        print("# Features:", xtrain.X.shape[1])
+        return xtrain, xval, suffix
+
+    suffix += f"_svd{n_components}comps"
+    print("Using svd.")
+    print("# Components:", n_components)
+    svd = TruncatedSVD(n_components=n_components, algorithm=svd_solver, random_state=seed)
+    print("Null Values: ", np.isnan(xtrain.X[:, :n_no_lags]).sum())
+    start = time.perf_counter()
+    svd.fit(xtrain.X[:, :n_no_lags])  # fit but without lagged yield features
+    seconds = time.perf_counter() - start
+
+    print("Explained variance:", svd.explained_variance_ratio_.sum())
+    print(f"SVD ({svd_solver}): {seconds:.2f}s")
+
+    # transform from the fitted svd and bind lagged yield features and factor
+    projection = Projection(xtrain.columns[:n_no_lags], svd.components_, svd.explained_variance_ratio_, seconds)
+    svd_cols = [f"svd{i}" for i in range(n_components)]
+    columns = svd_cols + xtrain.columns[n_no_lags:]
+    xtrain = xtrain._replace(X=projection.transform(xtrain.X), columns=columns, projection=projection)
+    xval = xval._replace(X=projection.transform(xval.X), columns=columns, projection=projection)
+    del svd
+    gc.collect()
+    return xtrain, xval, suffix
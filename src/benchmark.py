@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Stage benchmarks on synthetic inputs, with a JSON history and a regression check.
+
+Every stage (fold creation, the ``feat_eng_*`` functions, BLUEs, ``create_datasets.py``, the G
+and GxE design assembly, the SVD paths, the model fits and ``avg_rmse``) runs alone in a
+fresh process on the fixture of a size (``synthetic_data.py`` inputs with their BLUEs,
+datasets of cv0 fold0 seed1 and, if small enough, the Kronecker files, built once under
+``--data_dir``). The process loads the stage inputs, resets its peak RSS
+(``/proc/self/clear_refs``) and times the stage only, so the wall time, peak RSS and
+throughput (rows per second) are those of the stage and not of its setup or of other stages.
+
+Results are appended to the ``--history`` file, and each stage is compared with the median
+of its last ``--window`` runs of the same size on the same host: the run fails (exit code 1)
+when the wall time or peak RSS of a stage exceeds that baseline by more than ``--threshold``.
+
+Example:
+    python3 -u benchmark.py --sizes tiny small --history benchmarks.json
+    python3 -u benchmark.py --sizes small --stages lgbm_g svd_g --repeat 3 --threshold 0.25
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import argparse
+import platform
+import subprocess
+import contextlib
+from pathlib import Path
+from statistics import median
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+SRC_PATH = Path(__file__).parent.resolve()
+RESULT_PREFIX = "BENCHMARK "
+CV, FOLD, SEED = 0, 0, 1
+BOOST_ROUNDS = 200  # fixed, so the fits do the same work whatever the defaults
+KRONECKER_CELLS = 5 * 10 ** 7  # larger Kronecker fixtures are not written (GxE designs skipped)
+MIN_SECONDS = 0.05  # wall time differences below this are noise
+MIN_RSS_MB = 10.0
+
+
+# --- Stages ------------------------------------------------------------------
+# A stage is a setup, run in the fixture directory before the measurement, and a run taking
+# its output and returning the number of rows processed.
+
+class Stage(NamedTuple):
+    setup: Callable
+    run: Callable
+
+
+def _trait():
+    from preprocessing import process_metadata, create_field_location, agg_yield
+    meta_cols = ["Env", "weather_station_lat", "weather_station_lon", "treatment_not_standard"]
+    trait = pd.read_csv("1_Training_Trait_Data_2014_2021.csv")
+    trait = trait.merge(process_metadata("2_Training_Meta_Data_2014_2021.csv")[meta_cols], on="Env", how="left")
+    return agg_yield(create_field_location(trait))
+
+
+def _create_folds(trait):
+    from preprocessing import create_folds
+    return len(create_folds(trait, val_year=2021, cv=CV, fillna=False, random_state=SEED))
+
+
+def _feat_eng_weather(weather):
+    from preprocessing import feat_eng_weather
+    feat_eng_weather(weather)
+    return len(weather)
+
+
+def _weather_windows(weather):
+    from weather_windows import read_config, planting_dates, window_features
+    planting = planting_dates(pd.read_csv("1_Training_Trait_Data_2014_2021.csv", usecols=["Env", "Date_Planted"]))
+    window_features(weather, planting, read_config())
+    return len(weather)
+
+
+def _feat_eng_soil(soil):
+    from preprocessing import feat_eng_soil
+    feat_eng_soil(soil)
+    return len(soil)
+
+
+def _feat_eng_target(trait):
+    from preprocessing import feat_eng_target
+    feat_eng_target(trait, ref_year=2022, lag=2)
+    return len(trait)
+
+
+def _blues(df):
+    from blues import compute_blues
+    compute_blues(df, workers=1)
+    return len(df)
+
+
+def _create_datasets(_):
+    sys.argv = ["create_datasets.py", f"--cv={CV}", f"--fold={FOLD}", f"--seed={SEED}"]
+    runpy.run_path(str(SRC_PATH / "create_datasets.py"), run_name="__main__")
+    return len(pd.read_csv(f"cv{CV}_xtrain_fold{FOLD}_seed{SEED}.csv", usecols=["Env"]))
+
+
+def _designs(model):
+    def run(_):
+        from assembly import g_or_gxe_designs
+        xtrain, xval, _ = g_or_gxe_designs(CV, FOLD, SEED, model, A=True, E=model == "G", lag_features=True)
+        return len(xtrain.X) + len(xval.X)
+    return run
+
+
+def _g_design():
+    from assembly import g_or_gxe_designs
+    xtrain, _, _ = g_or_gxe_designs(CV, FOLD, SEED, "G", A=True, E=True, lag_features=True)
+    return xtrain
+
+
+def _svd_g(xtrain):
+    from sklearn.decomposition import TruncatedSVD
+    X = xtrain.X[:, :-1]  # without Field_Location
+    TruncatedSVD(n_components=min(100, X.shape[1] - 1), random_state=SEED).fit_transform(X)
+    return len(X)
+
+
+def _svd_ec(ec):
+    from sklearn.decomposition import TruncatedSVD
+    TruncatedSVD(n_components=min(15, ec.shape[1] - 1), n_iter=20, random_state=SEED).fit_transform(ec)
+    return len(ec)
+
+
+def _e_arrays():
+    from assembly import read_e_fold
+    from lgbm_dataset import frame_to_array
+    xtrain, _, ytrain, _ = read_e_fold(CV, FOLD, SEED)
+    X, categories = frame_to_array(xtrain)
+    return X, ytrain.to_numpy(), xtrain.columns.tolist(), list(categories)
+
+
+def _e_onehot_arrays():
+    from assembly import read_e_fold
+    from lgbm_dataset import frame_to_array, one_hot
+    xtrain, _, ytrain, _ = read_e_fold(CV, FOLD, SEED)
+    xtrain, _ = one_hot(xtrain, "Field_Location")
+    X, _ = frame_to_array(xtrain)
+    return X, ytrain.to_numpy(), xtrain.columns.tolist(), []
+
+
+def _lgbm_e(arrays):
+    from lgbm_dataset import model_params, train
+    X, y, feature_name, categorical = arrays
+    train(X, y, model_params(SEED, 1), feature_name=feature_name, categorical_feature=categorical, num_boost_round=BOOST_ROUNDS)
+    return len(X)
+
+
+def _lgbm_e_compressed(arrays):
+    from lgbm_dataset import model_params, train_compressed
+    X, y, feature_name, _ = arrays  # Field_Location as 0/1 columns, its categorical splits are refused
+    train_compressed(X, y, model_params(SEED, 1), feature_name=feature_name, num_boost_round=BOOST_ROUNDS)
+    return len(X)
+
+
+def _lgbm_g(xtrain):
+    from lgbm_dataset import model_params, train
+    train(xtrain.X, xtrain.y, model_params(SEED, 1), feature_name=xtrain.columns,
+          categorical_feature=["Field_Location"], num_boost_round=BOOST_ROUNDS)
+    return len(xtrain.X)
+
+
+def _gblup(_):
+    from gblup import fit, read_fold
+    ytrain, yval, block, _ = read_fold(CV, FOLD, SEED, A=True)
+    fit(ytrain, block, pd.concat([ytrain, yval])[["Env", "Hybrid"]])
+    return len(ytrain)
+
+
+def _kgxe(_):
+    import kernel_gxe
+    ytrain, _, grid, _ = kernel_gxe.read_grid(CV, FOLD, SEED, A=True)
+    kernel_gxe.fit(grid.phi_e, grid.phi_g, *kernel_gxe.positions(grid, ytrain), ytrain["Yield_Mg_ha"].to_numpy())
+    return len(ytrain)
+
+
+def _df_eval():
+    yval = pd.read_csv(f"cv{CV}_yval_fold{FOLD}_seed{SEED}.csv")
+    df = pd.concat([yval] * max(1, 10 ** 6 // len(yval)), ignore_index=True)
+    rng = np.random.default_rng(SEED)
+    return pd.DataFrame({"Env": df["Env"], "Hybrid": df["Hybrid"], "ytrue": df["Yield_Mg_ha"],
+                         "ypred": df["Yield_Mg_ha"] + rng.normal(0, 1, len(df))})
+
+
+def _avg_rmse(df_eval):
+    from evaluate import avg_rmse
+    avg_rmse(df_eval, verbose=False)
+    return len(df_eval)
+
+
+def _read(path, **kwargs):
+    return lambda: pd.read_csv(path, **kwargs)
+
+
+def _none():
+    return None
+
+
+STAGES = {
+    "create_folds": Stage(_trait, _create_folds),
+    "feat_eng_weather": Stage(_read("4_Training_Weather_Data_2014_2021.csv"), _feat_eng_weather),
+    "weather_windows": Stage(_read("4_Training_Weather_Data_2014_2021.csv"), _weather_windows),
+    "feat_eng_soil": Stage(_read("3_Training_Soil_Data_2015_2021.csv"), _feat_eng_soil),
+    "feat_eng_target": Stage(_trait, _feat_eng_target),
+    "blues": Stage(lambda: __import__("blues").read_trait("1_Training_Trait_Data_2014_2021.csv"), _blues),
+    "create_datasets": Stage(_none, _create_datasets),
+    "g_designs": Stage(_none, _designs("G")),
+    "gxe_designs": Stage(_none, _designs("GxE")),
+    "svd_g": Stage(_g_design, _svd_g),
+    "svd_ec": Stage(_read("6_Training_EC_Data_2014_2021.csv", index_col="Env"), _svd_ec),
+    "lgbm_e": Stage(_e_arrays, _lgbm_e),
+    "lgbm_e_compressed": Stage(_e_onehot_arrays, _lgbm_e_compressed),
+    "lgbm_g": Stage(_g_design, _lgbm_g),
+    "gblup": Stage(_none, _gblup),
+    "kgxe": Stage(_none, _kgxe),
+    "avg_rmse": Stage(_df_eval, _avg_rmse),
+}
+
+
+def _proc_status(key: str):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key):
+                return int(line.split()[1]) / 1024  # kB -> MB
+    return None
+
+
+def measure(name: str):
+    """Run a stage in this process (the fixture directory) and return its measurements."""
+    stage = STAGES[name]
+    if name == "gxe_designs" and not Path(f"cv{CV}_kronecker_additive.arrow").exists():
+        return {"skipped": "no Kronecker fixture at this size"}
+    with contextlib.redirect_stdout(sys.stderr):
+        state = stage.setup()
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # reset the peak RSS to the current RSS
+        except OSError:
+            pass
+        start = time.perf_counter()
+        items = stage.run(state)
+        wall = time.perf_counter() - start
+    peak = _proc_status("VmHWM:")
+    if peak is None:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"wall_s": round(wall, 4), "peak_rss_mb": round(peak, 1), "items": items, "throughput": round(items / wall, 1)}
+
+
+# --- Fixtures ----------------------------------------------------------------
+
+def write_kronecker(kinship: str):
+    """``kronecker.py`` on the datasets of the fixture (cv0), unless the product is too large."""
+    import kronecker
+
+    x = kronecker.env_features(CV)
+    pairs = kronecker.env_hybrids(CV)
+    hybrids, K = kronecker.kinship_block(Path(f"kinship_{kinship}.txt"), pairs["Hybrid"].unique())
+    rows = kronecker.plan(x, hybrids, pairs)
+    n_rows = sum(len(positions) for _, positions in rows)
+    if n_rows * x.shape[1] * len(hybrids) > KRONECKER_CELLS:
+        print(f"Kronecker fixture of {n_rows} x {x.shape[1] * len(hybrids)} is too large, not written")
+        return
+    kronecker.write(Path(f"cv{CV}_kronecker_{kinship}.arrow"), x, hybrids, K, rows)
+
+
+def fixture(data_dir: Path, size: str, seed: int):
+    """Directory with the synthetic inputs of ``size`` and the outputs the stages read, built once."""
+    from synthetic_data import SIZES, generate
+
+    root = Path(data_dir) / f"{size}_seed{seed}"
+    work = root / "work"
+    if (work / ".complete").exists():
+        return work
+    print(f"Building the {size} fixture in {root}")
+    generate(root, SIZES[size], seed)
+    work.mkdir(parents=True, exist_ok=True)
+    for path in [*root.glob("Training_Data/*"), *root.glob("Testing_Data/*"), *root.glob("kinship_*.txt")]:
+        link = work / path.name
+        if not link.exists():
+            link.symlink_to(path.resolve())
+
+    def run(*args):
+        subprocess.run([sys.executable, "-u", *args], cwd=work, check=True, stdout=subprocess.DEVNULL)
+
+    run(str(SRC_PATH / "blues.py"), "--workers=1")
+    run(str(SRC_PATH / "create_datasets.py"), f"--cv={CV}", f"--fold={FOLD}", f"--seed={SEED}")
+    run("-c", f"import sys; sys.path.insert(0, {str(SRC_PATH)!r}); import benchmark; benchmark.write_kronecker('additive')")
+    (work / ".complete").touch()
+    return work
+
+
+def run_stage(work: Path, name: str):
+    """Measure a stage in a fresh process, as it would run alone in the pipeline."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(SRC_PATH), os.environ.get("PYTHONPATH", "")])}
+    proc = subprocess.run(
+        [sys.executable, "-u", str(SRC_PATH / "benchmark.py"), "--stage", name],
+        cwd=work, env=env, capture_output=True, text=True,
+    )
+    lines = [x for x in proc.stdout.splitlines() if x.startswith(RESULT_PREFIX)]
+    if proc.returncode != 0 or not lines:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"}
+    return json.loads(lines[-1][len(RESULT_PREFIX):])
+
+
+# --- History -----------------------------------------------------------------
+
+def read_history(path: Path):
+    return json.loads(Path(path).read_text()) if Path(path).exists() else {"runs": []}
+
+
+def write_history(path: Path, history: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(history, indent=1))
+    os.replace(tmp, path)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_PATH, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def regressions(history: dict, run: dict, threshold: float, window: int):
+    """Stages of ``run`` slower or larger than the median of their previous runs by more than ``threshold``."""
+    found = []
+    previous = [r for r in history["runs"] if r["size"] == run["size"] and r["host"] == run["host"]][-window:]
+    for name, result in run["results"].items():
+        past = [r["results"][name] for r in previous if "wall_s" in r["results"].get(name, {})]
+        if not past or "wall_s" not in result:
+            continue
+        for metric, floor in (("wall_s", MIN_SECONDS), ("peak_rss_mb", MIN_RSS_MB)):
+            baseline = median(r[metric] for r in past)
+            if result[metric] > baseline * (1 + threshold) and result[metric] - baseline > floor:
+                found.append(f"{run['size']}/{name}: {metric} {result[metric]} vs median {baseline:.4g} of {len(past)} runs")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=["tiny"], help="synthetic_data.py presets")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic inputs")
+    parser.add_argument("--data_dir", type=Path, default=Path("benchmark_data"), help="fixtures, built once per size")
+    parser.add_argument("--history", type=Path, default=Path("benchmark_history.json"))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is kept")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed increase over the baseline")
+    parser.add_argument("--window", type=int, default=5, help="previous runs the baseline is the median of")
+    parser.add_argument("--no_record", action="store_true", default=False, help="check without appending to the history")
+    parser.add_argument("--stage", default=None, help=argparse.SUPPRESS)  # child process: measure one stage here
+    args = parser.parse_args()
+
+    if args.stage is not None:
+        print(RESULT_PREFIX + json.dumps(measure(args.stage)))
+        sys.exit(0)
+
+    history = read_history(args.history)
+    found = []
+    for size in args.sizes:
+        work = fixture(args.data_dir, size, args.seed)
+        run = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "host": platform.node(),
+            "size": size,
+            "seed": args.seed,
+            "results": {},
+        }
+        print(f"\n{size}: {'stage':<18}{'wall (s)':>10}{'peak RSS (MB)':>15}{'rows/s':>14}")
+        for name in args.stages:
+            results = [run_stage(work, name) for _ in range(args.repeat)]
+            timed = [r for r in results if "wall_s" in r]
+            result = min(timed, key=lambda r: r["wall_s"]) if timed else results[0]
+            run["results"][name] = result
+            if "wall_s" in result:
+                print(f"{'':<{len(size) + 2}}{name:<18}{result['wall_s']:>10.3f}{result['peak_rss_mb']:>15.1f}{result['throughput']:>14.0f}")
+            else:
+                print(f"{'':<{len(size) + 2}}{name:<18}  {result.get('skipped') or 'failed: ' + result['error']}")
+        found += regressions(history, run, args.threshold, args.window)
+        history["runs"].append(run)
+
+    if not args.no_record:
+        write_history(args.history, history)
+        print("\nWriting:", args.history)
+    if found:
+        print("\nRegressions:")
+        for line in found:
+            print("  " + line)
+        sys.exit(1)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+BLUEs of the hybrids of every environment, the Python counterpart of ``blues.R``.
+
+Fits ``Yield_Mg_ha ~ Hybrid + (1 | Replicate)`` per Env and writes ``blues.csv`` (Env, Hybrid,
+predicted.value) and ``cvs_h2s.csv`` (Env, CV, H2). Envs with a balanced design (every hybrid
+once in every replicate) have the closed-form solution of the two-way ANOVA: the BLUEs are the
+hybrid means and the REML residual variance is the residual mean square, or the pooled one
+when the replicate variance is estimated at zero. They are solved together with group sums
+over the whole table. The other Envs are fitted by REML, profiled over the ratio of the
+replicate and residual variances with the small replicate blocks of the mixed model
+equations, on a process pool.
+
+Example:
+    python3 -u blues.py --workers 8
+    python3 -u blues.py --years 2019
+"""
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize_scalar
+
+
+TRAIT_FILE = "1_Training_Trait_Data_2014_2021.csv"
+LOG_RATIO_BOUNDS = (-20.0, 10.0)  # log(var_replicate / var_residual)
+
+
+def read_trait(path: str, years: list = None):
+    df = pd.read_csv(path, usecols=["Env", "Year", "Hybrid", "Replicate", "Yield_Mg_ha"])
+    if years is not None:
+        df = df[df["Year"].isin(years)]
+    # lmer drops the incomplete rows
+    df = df.dropna(subset=["Yield_Mg_ha", "Replicate"]).drop(columns="Year")
+    df["Replicate"] = df["Replicate"].astype(str)
+    return df.astype({"Env": "category", "Hybrid": "category", "Replicate": "category"})
+
+
+def design(df: pd.DataFrame):
+    """Hybrids, replicates and observations of every Env, and whether its design is balanced."""
+    cells = df.groupby(["Env", "Hybrid", "Replicate"], observed=True).size().rename("count").reset_index()
+    out = cells.groupby("Env", observed=True).agg(
+        hybrids=("Hybrid", "nunique"),
+        replicates=("Replicate", "nunique"),
+        cells=("count", "size"),
+        max_cell=("count", "max"),
+        n=("count", "sum"),
+    )
+    out["balanced"] = (out["cells"] == out["hybrids"] * out["replicates"]) & (out["max_cell"] == 1)
+    # lmer needs more than one replicate, and the residual variance more observations than hybrids
+    out["fitted"] = (out["hybrids"] >= 2) & (out["replicates"] >= 2) & (out["n"] > out["hybrids"])
+    return out
+
+
+def balanced_blues(df: pd.DataFrame):
+    """Closed-form BLUEs and residual variances of balanced Envs, all Envs at once."""
+    env = df["Env"].cat.remove_unused_categories()
+    env_codes = env.cat.codes.to_numpy().astype(np.int64)
+    hybrid_codes, hybrid_keys = pd.factorize(env_codes * len(df["Hybrid"].cat.categories) + df["Hybrid"].cat.codes.to_numpy())
+    rep_codes, _ = pd.factorize(env_codes * len(df["Replicate"].cat.categories) + df["Replicate"].cat.codes.to_numpy())
+    hybrid_env, hybrid = np.divmod(hybrid_keys, len(df["Hybrid"].cat.categories))
+    y = df["Yield_Mg_ha"].to_numpy(dtype=np.float64)
+
+    n_env = np.bincount(env_codes)
+    mean_env = np.bincount(env_codes, y) / n_env
+    mean_hybrid = np.bincount(hybrid_codes, y) / np.bincount(hybrid_codes)
+    mean_rep = np.bincount(rep_codes, y) / np.bincount(rep_codes)
+    h = np.bincount(hybrid_env, minlength=len(n_env))
+    r = n_env // h
+
+    residuals = y - mean_hybrid[hybrid_codes] - mean_rep[rep_codes] + mean_env[env_codes]
+    sse = np.bincount(env_codes, residuals ** 2)
+    ss_rep = np.bincount(env_codes, (mean_rep[rep_codes] - mean_env[env_codes]) ** 2)
+    ms_error = sse / ((h - 1) * (r - 1))
+    ms_rep = ss_rep / (r - 1)  # h * sum over replicates = sum over observations
+    # REML puts the replicate variance at zero when its ANOVA estimate is negative
+    sigma2 = np.where(ms_rep >= ms_error, ms_error, (sse + ss_rep) / (n_env - h))
+
+    blues = pd.DataFrame({
+        "Env": env.cat.categories[hybrid_env],
+        "Hybrid": df["Hybrid"].cat.categories[hybrid],
+        "predicted.value": mean_hybrid,
+    })
+    stats = pd.DataFrame({"Env": env.cat.categories, "sigma2": sigma2, "mean": mean_env})
+    return blues, stats
+
+
+def reml_fit(env: str, hybrid: np.ndarray, replicate: np.ndarray, y: np.ndarray):
+    """
+    REML fit of one Env. With X the hybrid and Z the replicate indicators, the observations have
+    covariance sigma2 * (I + ratio * ZZ'), and every term of the restricted likelihood reduces,
+    through Woodbury's identity and the determinant lemma, to the hybrid x replicate counts and
+    sums: O(hybrids * replicates) per evaluation instead of O(n^3).
+    """
+    hybrids, hybrid_codes = np.unique(hybrid, return_inverse=True)
+    _, rep_codes = np.unique(replicate, return_inverse=True)
+    n, p = len(y), len(hybrids)
+    counts = np.zeros((p, rep_codes.max() + 1))
+    np.add.at(counts, (hybrid_codes, rep_codes), 1)
+    c = counts.sum(axis=1)  # X'X (diagonal)
+    n_rep = counts.sum(axis=0)  # Z'Z (diagonal)
+    sum_hybrid = np.bincount(hybrid_codes, y)  # X'y
+    sum_rep = np.bincount(rep_codes, y)  # Z'y
+    yy = y @ y
+    nc = counts / c[:, None]  # C^-1 N
+
+    def solve(log_ratio):
+        d = 1 / np.exp(log_ratio) + n_rep  # D = I / ratio + Z'Z
+        b = sum_hybrid - counts @ (sum_rep / d)  # X'H^-1 y
+        a = np.diag(d) - counts.T @ nc  # D - N'C^-1 N
+        cb = b / c
+        beta = cb + nc @ np.linalg.solve(a, nc.T @ b)  # (C - N D^-1 N')^-1 b
+        ypy = yy - sum_rep @ (sum_rep / d) - beta @ b
+        logdet = (
+            np.sum(np.log1p(np.exp(log_ratio) * n_rep))  # |H|
+            + np.sum(np.log(c)) + np.linalg.slogdet(a)[1] - np.sum(np.log(d))  # |X'H^-1 X|
+        )
+        return beta, ypy / (n - p), (n - p) * np.log(ypy / (n - p)) + logdet
+
+    best = minimize_scalar(lambda t: solve(t)[2], bounds=LOG_RATIO_BOUNDS, method="bounded")
+    beta, sigma2, _ = solve(best.x)
+    return env, hybrids, beta, sigma2
+
+
+def unbalanced_blues(df: pd.DataFrame, workers: int = None):
+    groups = [
+        (env, group["Hybrid"].to_numpy(dtype=str), group["Replicate"].to_numpy(dtype=str), group["Yield_Mg_ha"].to_numpy())
+        for env, group in df.groupby("Env", observed=True)
+    ]
+    blues, stats = [], []
+    if not groups:
+        return pd.DataFrame(columns=["Env", "Hybrid", "predicted.value"]), pd.DataFrame(columns=["Env", "sigma2", "mean"])
+    with ProcessPoolExecutor(workers) as pool:
+        for (env, hybrids, beta, sigma2), (_, _, _, y) in zip(pool.map(reml_fit, *zip(*groups)), groups):
+            blues.append(pd.DataFrame({"Env": env, "Hybrid": hybrids, "predicted.value": beta}))
+            stats.append({"Env": env, "sigma2": sigma2, "mean": y.mean()})
+    return pd.concat(blues, ignore_index=True), pd.DataFrame(stats)
+
+
+def compute_blues(df: pd.DataFrame, workers: int = None):
+    envs = design(df)
+    skipped = envs.index[~envs["fitted"]]
+    if len(skipped):
+        print(f"Skipping {len(skipped)} environments with insufficient levels for Hybrid or Replicate:", list(skipped))
+    balanced = envs.index[envs["fitted"] & envs["balanced"]]
+    unbalanced = envs.index[envs["fitted"] & ~envs["balanced"]]
+    print(f"{len(balanced)} balanced environments (closed form), {len(unbalanced)} unbalanced (REML)")
+
+    blues_b, stats_b = balanced_blues(df[df["Env"].isin(balanced)])
+    blues_u, stats_u = unbalanced_blues(df[df["Env"].isin(unbalanced)], workers)
+    blues = pd.concat([blues_b, blues_u], ignore_index=True).astype({"Env": str, "Hybrid": str})
+    stats = pd.concat([stats_b, stats_u], ignore_index=True).astype({"Env": str})
+
+    cvs_h2s = pd.DataFrame({
+        "Env": stats["Env"],
+        "CV": np.sqrt(stats["sigma2"]) / stats["mean"],
+        # as in blues.R: Hybrid is a fixed effect, so it has no variance component
+        "H2": 0.0,
+    })
+    return blues.sort_values(["Env", "Hybrid"], ignore_index=True), cvs_h2s.sort_values("Env", ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trait_file", default=TRAIT_FILE)
+    parser.add_argument("--years", type=int, nargs="+", default=None, help="default: all")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes fitting the unbalanced Envs")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = read_trait(args.trait_file, args.years)
+    blues, cvs_h2s = compute_blues(df, args.workers)
+    print(cvs_h2s.to_string(index=False))
+    print(f"BLUEs of {len(blues)} Env x Hybrid in {cvs_h2s.shape[0]} environments, {time.perf_counter() - start:.1f}s")
+
+    blues[["Env", "Hybrid", "predicted.value"]].to_csv("blues.csv", index=False)
+    cvs_h2s.to_csv("cvs_h2s.csv", index=False)
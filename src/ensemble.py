@@ -0,0 +1,181 @@
+"""
+Streaming ensemble of the seed and fold predictions of every model.
+
+Prediction files (or the batches of the Parquet results store written by ``results.py``) are
+read one at a time and reduced into per-model running moments: for every (Env, Hybrid) pair
+the count, the mean of the targets and the mean and sum of squared deviations of the
+predictions, merged file by file with the pairwise update of Chan et al. Envs and Hybrids
+are integer codes of a shared vocabulary and the pairs of a model a sorted int64 array, so
+memory is bounded by the number of unique (Env, Hybrid, model) pairs instead of the
+number of files times their rows, and no table of all predictions is ever concatenated.
+
+Example:
+    python3 -u ensemble.py --input_dir output --output_dir output
+    python3 -u ensemble.py --store output/results --output_dir output
+"""
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from results import FILE_PATTERN, find_files, model_label, read_file, write_csv
+from prefetch import prefetch
+
+
+GROUP = ["kind", "model", "variant", "cv"]
+BATCH_COLUMNS = ["kind", "runner", "variant", "model", "cv", "Env", "Hybrid", "ytrue", "ypred"]
+
+
+class Vocabulary:
+    """Integer code of every distinct string, in order of appearance."""
+
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, column: pa.ChunkedArray):
+        column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+        if not pa.types.is_dictionary(column.type):
+            column = column.dictionary_encode()
+        mapping = np.array([self.codes.setdefault(x, len(self.codes)) for x in column.dictionary.to_pylist()], dtype=np.int64)
+        return mapping[column.indices.to_numpy(zero_copy_only=False)]
+
+    def decode(self, codes: np.ndarray):
+        return np.array(list(self.codes), dtype=object)[codes]
+
+
+class Moments:
+    """Count and running moments of the predictions of every (Env, Hybrid) pair of one model."""
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)  # env code << 32 | hybrid code, sorted
+        self.n = np.empty(0, dtype=np.int64)
+        self.ytrue = np.empty(0)
+        self.mean = np.empty(0)
+        self.m2 = np.empty(0)
+
+    def update(self, keys: np.ndarray, ytrue: np.ndarray, ypred: np.ndarray):
+        # moments of this batch per pair
+        keys, inverse = np.unique(keys, return_inverse=True)
+        nb = np.bincount(inverse)
+        ytrue_b = np.bincount(inverse, ytrue) / nb
+        mean_b = np.bincount(inverse, ypred) / nb
+        m2_b = np.bincount(inverse, (ypred - mean_b[inverse]) ** 2)
+
+        # grow the sorted pair arrays by the pairs not seen yet
+        new = ~np.isin(keys, self.keys, assume_unique=True)
+        if new.any():
+            merged = np.union1d(self.keys, keys[new])
+            old = np.searchsorted(merged, self.keys)
+            for name in ("n", "ytrue", "mean", "m2"):
+                grown = np.zeros(len(merged), dtype=getattr(self, name).dtype)
+                grown[old] = getattr(self, name)
+                setattr(self, name, grown)
+            self.keys = merged
+
+        # pairwise merge of the moments
+        slots = np.searchsorted(self.keys, keys)
+        na = self.n[slots]
+        n = na + nb
+        delta = mean_b - self.mean[slots]
+        self.mean[slots] += delta * nb / n
+        self.m2[slots] += m2_b + delta ** 2 * na * nb / n
+        self.ytrue[slots] += (ytrue_b - self.ytrue[slots]) * nb / n
+        self.n[slots] = n
+
+    def frame(self, envs: Vocabulary, hybrids: Vocabulary):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var = np.where(self.n > 1, self.m2 / (self.n - 1), np.nan)
+        return pd.DataFrame({
+            "Env": envs.decode(self.keys >> 32),
+            "Hybrid": hybrids.decode(self.keys & 0xFFFFFFFF),
+            "n": self.n,
+            "ytrue": self.ytrue,
+            "ypred": self.mean,
+            "ypred_var": var,
+        })
+
+
+class Reducer:
+    """Ensemble moments of every (kind, model, variant, cv), fed one table at a time."""
+
+    def __init__(self):
+        self.envs = Vocabulary()
+        self.hybrids = Vocabulary()
+        self.groups = {}
+        self.rows = 0
+
+    def add(self, group: tuple, table: pa.Table):
+        keys = self.envs.encode(table.column("Env")) << 32 | self.hybrids.encode(table.column("Hybrid"))
+        ytrue = table.column("ytrue").to_numpy()
+        ypred = table.column("ypred").to_numpy()
+        self.groups.setdefault(group, Moments()).update(keys, ytrue, ypred)
+        self.rows += table.num_rows
+
+    def add_file(self, path: Path, table: pa.Table = None):
+        """A prediction file, or its ``table`` if it was read already."""
+        run = FILE_PATTERN.fullmatch(path.name).groupdict()
+        group = (run["kind"], model_label(run["runner"], run["variant"]), run["variant"], int(run["cv"]))
+        self.add(group, read_file(path) if table is None else table)
+
+    def add_batch(self, batch: pa.RecordBatch):
+        """A batch of the results store, which may hold rows of several models."""
+        runs = pd.DataFrame({k: batch.column(k).to_pandas() for k in GROUP}).astype({"cv": int})
+        codes, groups = pd.factorize(pd.MultiIndex.from_frame(runs))
+        table = pa.Table.from_batches([batch])
+        for code, group in enumerate(groups):
+            self.add(tuple(group), table.filter(pa.array(codes == code)))
+
+    def frame(self):
+        frames = []
+        for (kind, model, variant, cv), moments in sorted(self.groups.items()):
+            df = moments.frame(self.envs, self.hybrids)
+            df.insert(0, "kind", kind)
+            df.insert(1, "model", model)
+            df.insert(2, "variant", variant)
+            df.insert(3, "cv", cv)
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True).astype({k: "category" for k in ("kind", "model", "variant")})
+
+
+def reduce_files(paths: list, depth: int = 1):
+    """Moments of the prediction files, each read in the background while the previous is reduced."""
+    reducer = Reducer()
+    for path, table in zip(paths, prefetch(read_file, paths, depth)):
+        reducer.add_file(path, table)
+    return reducer
+
+
+def reduce_store(path: Path, batch_size: int = 1 << 20):
+    reducer = Reducer()
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(columns=BATCH_COLUMNS, batch_size=batch_size):
+        reducer.add_batch(batch)
+    return reducer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--input_dir", type=Path, default=Path("."), help="directory of the oof and pred_train files")
+    source.add_argument("--store", type=Path, default=None, help="results store written by results.py")
+    parser.add_argument("--output_dir", type=Path, default=Path("."))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.store is not None:
+        reducer = reduce_store(args.store)
+        print(f"Read {reducer.rows} rows of {args.store}")
+    else:
+        paths = find_files(args.input_dir)
+        reducer = reduce_files(paths)
+        print(f"Read {len(paths)} files, {reducer.rows} rows")
+
+    df = reducer.frame()
+    print(f"{len(df)} (Env, Hybrid, model) pairs of {len(reducer.groups)} models in {time.perf_counter() - start:.1f}s")
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    print("Writing:", args.output_dir / "ensemble_predictions.csv")
+    write_csv(df, args.output_dir / "ensemble_predictions.csv")
@@ -1,5 +1,4 @@
 import pandas as pd
-from sklearn.metrics import root_mean_squared_error
 
 
 def create_df_eval(xval, yval, ypred):
@@ -12,11 +11,8 @@ def create_df_eval(xval, yval, ypred):
     
 
 def avg_rmse(df_eval, verbose=True):
-    rmse_per_group = (
-        df_eval
-        .groupby('Env')
-        .apply(lambda x: root_mean_squared_error(x['ytrue'], x['ypred']))
-    )
+    squared_error = (df_eval['ytrue'] - df_eval['ypred']) ** 2
+    rmse_per_group = squared_error.groupby(df_eval['Env']).mean().pow(0.5).rename(None)
     avg_rmse_ = sum(rmse_per_group) / len(rmse_per_group)
 
     if verbose:
@@ -26,8 +22,10 @@ def avg_rmse(df_eval, verbose=True):
     return avg_rmse_
 
 
-def feat_imp(model):
-    d = dict(zip(model.feature_name_, model.feature_importances_))
-    d = dict(sorted(d.items(), key=lambda x: -x[1]))
-    df = pd.DataFrame(d.items(), columns=['feature', 'imp'])
-    return df
+def feat_imp(model, importance_type='split'):
+    booster = getattr(model, 'booster_', model)  # LGBMRegressor or Booster
+    df = pd.DataFrame({
+        'feature': booster.feature_name(),
+        'imp': booster.feature_importance(importance_type=importance_type),
+    })
+    return df.sort_values('imp', ascending=False, kind='stable', ignore_index=True)
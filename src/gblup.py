@@ -0,0 +1,143 @@
+"""
+Spectral GBLUP of the hybrids of a fold, the kernel baseline of ``run_g_or_gxe_model.py --model GBLUP``.
+
+Yields are centered by their Env means (fixed effects) and averaged per hybrid, and the
+hybrid means follow ``mu + g + e`` with ``g ~ N(0, var_g K)`` over the kinship of the
+training hybrids and ``e ~ N(0, var_e / n_records)``. Scaling by the square roots of the
+record counts makes the residuals homoscedastic, so one eigendecomposition of the scaled
+kinship diagonalizes the covariance for every ratio ``var_e / var_g``: each REML evaluation
+on the rotated data is O(n). The scaled kinship depends on the record counts of the split,
+so it is decomposed once per split (the counts do not commute with the eigenvectors of the
+unscaled kinship, which therefore cannot be shared across folds and seeds). Genomic values of the validation hybrids are their BLUPs from
+the kinship with the training hybrids; Envs without training records take the mean effect
+of their field location.
+
+Example:
+    python3 -u run_g_or_gxe_model.py --cv 0 --fold 0 --seed 1 --model GBLUP --A
+"""
+import os
+import hashlib
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize_scalar
+
+from assembly import KEYS, TARGET, Block, read_targets, read_kinship
+from preprocessing import create_field_location
+
+
+LOG_DELTA_BOUNDS = (-10.0, 10.0)  # log(var_e / var_g)
+
+
+class GBLUP(NamedTuple):
+    mu: float
+    var_g: float
+    var_e: float
+    env_effects: pd.Series  # training Env means, and field location means for other Envs
+    hybrid_effects: pd.Series  # BLUPs of the training and validation hybrids
+
+    def predict(self, y: pd.DataFrame):
+        return (
+            self.env_effects.reindex(y["Env"]).to_numpy()
+            + self.mu
+            + self.hybrid_effects.reindex(y["Hybrid"]).to_numpy()
+        )
+
+
+def eigendecomposition(K: np.ndarray, cache_dir: Path = None):
+    """Eigenvalues (clipped at 0) and eigenvectors of the symmetric ``K``, cached in ``cache_dir``."""
+    if cache_dir is None:
+        values, vectors = np.linalg.eigh(K)
+        return np.clip(values, 0, None), vectors
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(K.shape).encode())
+    h.update(np.ascontiguousarray(K).tobytes())
+    path = Path(cache_dir) / f"{h.hexdigest()}.npz"
+    if path.exists():
+        with np.load(path) as cached:
+            print("Using cached eigendecomposition:", path)
+            return cached["values"], cached["vectors"]
+
+    values, vectors = np.linalg.eigh(K)
+    values = np.clip(values, 0, None)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(tmp, values=values, vectors=vectors)
+    os.replace(tmp, path)
+    return values, vectors
+
+
+def reml(values: np.ndarray, y_rot: np.ndarray, x_rot: np.ndarray):
+    """
+    REML fit of ``y = x mu + g + e`` rotated by the eigenvectors of the kinship, where the
+    covariance is ``var_g * diag(values + delta)``. Returns mu, var_g, delta and
+    ``V^-1 (y - x mu) * var_g`` in the rotated space.
+    """
+    n = len(values)
+
+    def solve(log_delta):
+        d = values + np.exp(log_delta)
+        xd = x_rot / d
+        xvx = xd @ x_rot
+        mu = (xd @ y_rot) / xvx
+        r = (y_rot - x_rot * mu) / d
+        var_g = r @ (y_rot - x_rot * mu) / (n - 1)
+        return mu, var_g, r, (n - 1) * np.log(var_g) + np.sum(np.log(d)) + np.log(xvx)
+
+    best = minimize_scalar(lambda t: solve(t)[-1], bounds=LOG_DELTA_BOUNDS, method="bounded")
+    mu, var_g, r, _ = solve(best.x)
+    return mu, var_g, np.exp(best.x), r
+
+
+def env_effects(ytrain: pd.DataFrame, envs):
+    """Training Env means, and the mean effect of the field location for Envs without records."""
+    effects = ytrain.groupby("Env")[TARGET].mean()
+    locations = create_field_location(effects.rename_axis("Env").reset_index())
+    location_effects = locations.groupby("Field_Location")[TARGET].mean()
+    missing = pd.DataFrame({"Env": pd.Index(pd.unique(np.asarray(envs, dtype=object))).difference(effects.index)})
+    missing = create_field_location(missing.astype(str))
+    fallback = location_effects.reindex(missing["Field_Location"]).fillna(effects.mean())
+    return pd.concat([effects, pd.Series(fallback.to_numpy(), index=missing["Env"].to_numpy())])
+
+
+def fit(ytrain: pd.DataFrame, kinship: Block, keys: pd.DataFrame):
+    """GBLUP on the training targets, with the effects of the Envs and hybrids of ``keys``."""
+    effects = env_effects(ytrain, keys["Env"])
+    residuals = ytrain[TARGET].to_numpy() - effects.reindex(ytrain["Env"]).to_numpy()
+    by_hybrid = pd.DataFrame({"Hybrid": ytrain["Hybrid"].to_numpy(), "r": residuals}).groupby("Hybrid", sort=False)["r"]
+    means, counts = by_hybrid.mean(), by_hybrid.size()
+
+    train = kinship.index.get_indexer(means.index)
+    w = np.sqrt(counts.to_numpy(dtype=np.float64))
+    K = kinship.values[np.ix_(train, train)] * np.outer(w, w)
+    print("# Training hybrids:", len(train))
+    values, vectors = eigendecomposition(K)
+
+    mu, var_g, delta, r = reml(values, vectors.T @ (w * means.to_numpy()), vectors.T @ w)
+    print(f"REML: mu={mu:.4f}, var_g={var_g:.4f}, var_e={var_g * delta:.4f}, h2={1 / (1 + delta):.3f}")
+
+    hybrids = pd.unique(keys["Hybrid"].to_numpy())
+    targets = kinship.index.get_indexer(hybrids)
+    hybrid_effects = kinship.values[np.ix_(targets, train)] @ (w * (vectors @ r))
+    return GBLUP(mu, var_g, var_g * delta, effects, pd.Series(hybrid_effects, index=hybrids))
+
+
+def read_fold(cv: int, fold: int, seed: int, A=False, D=False):
+    """Targets of a fold with a kinship row, the kinship block and the suffix of the output files."""
+    if A == D:
+        raise Exception("GBLUP uses one kinship, choose --A or --D.")
+    kinship, name, suffix = ("additive", "A", "_A") if A else ("dominant", "D", "_D")
+    print(f"Using {name} matrix.")
+
+    ytrain = read_targets(Path(f"cv{cv}_ytrain_fold{fold}_seed{seed}.csv"))
+    yval = read_targets(Path(f"cv{cv}_yval_fold{fold}_seed{seed}.csv"))
+    individuals = list(dict.fromkeys(ytrain["Hybrid"].tolist() + yval["Hybrid"].tolist()))
+    block = read_kinship(f"kinship_{kinship}.txt", name, individuals)
+
+    # same rows as the assembled designs: genotyped hybrids with a target
+    ytrain = ytrain[ytrain["Hybrid"].isin(block.index) & ytrain[TARGET].notna()].reset_index(drop=True)
+    yval = yval[yval["Hybrid"].isin(block.index) & yval[TARGET].notna()].reset_index(drop=True)
+    return ytrain[KEYS + [TARGET]], yval[KEYS + [TARGET]], block, suffix
@@ -0,0 +1,197 @@
+"""
+Feature-importance store of the E, G and GxE LightGBM fits.
+
+Every fit appends its split and gain importances, tagged with the run (runner, variant, cv,
+fold, seed), as one Parquet file of a store directory, so concurrent runs never write the
+same file; ``compact`` merges them into a single table. Existing ``cv*_feat_imp_*`` CSVs
+(split counts only) can be ingested. The summary gives mean and variance per feature over
+folds and seeds, rank stability (mean rank, its spread, top-k frequency and Kendall's W),
+and a pruning list of features that never split in a model's runs, which
+``create_datasets.py --drop_features`` removes from the datasets.
+
+Example:
+    python3 -u run_e_model.py --cv 0 --fold 0 --seed 1 --feat_imp_store feat_imp
+    python3 -u importance.py ingest --input_dir output --store feat_imp
+    python3 -u importance.py summary --store feat_imp --output_dir output
+"""
+import os
+import re
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from results import model_label
+
+
+FILE_PATTERN = re.compile(
+    r"cv(?P<cv>\d)_feat_imp_(?P<runner>[a-z]+)_model_fold(?P<fold>\d)_seed(?P<seed>\d+)(?P<variant>.*)\.csv"
+)
+RUN = ["runner", "variant", "cv", "fold", "seed"]
+COMPACT_FILE = "compact.parquet"
+
+
+def importance_frame(model):
+    booster = getattr(model, "booster_", model)  # LGBMRegressor or Booster
+    return pd.DataFrame({
+        "feature": booster.feature_name(),
+        "split": booster.feature_importance(importance_type="split").astype(np.int64),
+        "gain": booster.feature_importance(importance_type="gain"),
+    })
+
+
+def _write(df: pd.DataFrame, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def append(store: Path, model, runner: str, cv: int, fold: int, seed: int, variant: str = ""):
+    """Add the importances of one fit to ``store`` (a rerun of the same run replaces them)."""
+    df = importance_frame(model).assign(runner=runner, variant=variant, cv=cv, fold=fold, seed=seed)
+    _write(df, Path(store) / f"cv{cv}_{runner}_model_fold{fold}_seed{seed}{variant}.parquet")
+
+
+def ingest(store: Path, input_dir: Path):
+    """Add the split counts of the ``cv*_feat_imp_*`` CSVs in ``input_dir`` (no gain)."""
+    frames = []
+    for path in sorted(Path(input_dir).iterdir()):
+        match = FILE_PATTERN.fullmatch(path.name)
+        if match is None:
+            continue
+        run = match.groupdict()
+        df = pd.read_csv(path).rename(columns={"imp": "split"})
+        frames.append(df.assign(gain=np.nan, runner=run["runner"], variant=run["variant"],
+                                cv=int(run["cv"]), fold=int(run["fold"]), seed=int(run["seed"])))
+    if frames:
+        _write(pd.concat(frames, ignore_index=True), Path(store) / f"ingested_{Path(input_dir).resolve().name}.parquet")
+    return len(frames)
+
+
+def read_store(store: Path):
+    """
+    All importances in ``store`` as one table. A run stored more than once keeps its most
+    recent copy with gains (appended by a runner) over copies ingested from CSVs.
+    """
+    paths = sorted(Path(store).glob("*.parquet"), key=lambda p: p.stat().st_mtime)
+    df = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+    df = (
+        df
+        .sort_values("gain", key=lambda gain: gain.notna(), kind="stable")
+        .drop_duplicates(RUN + ["feature"], keep="last")
+        .sort_index(ignore_index=True)
+    )
+    df = df.astype({"runner": "category", "variant": "category", "feature": "category",
+                    "cv": np.int8, "fold": np.int8, "seed": np.int16})
+    df["model"] = [model_label(r, v) for r, v in zip(df["runner"], df["variant"])]
+    return df
+
+
+def compact(store: Path):
+    """Merge the per-run files of ``store`` into one file."""
+    store = Path(store)
+    paths = list(store.glob("*.parquet"))
+    df = read_store(store).drop(columns="model")
+    _write(df, store / COMPACT_FILE)
+    for path in paths:
+        if path.name != COMPACT_FILE:
+            path.unlink()
+    return df
+
+
+def rank_runs(df: pd.DataFrame):
+    """
+    Rank of every feature within its run (1 = most important), by gain, or by split count for
+    runs without gain. Ties share their average rank.
+    """
+    importance = df["gain"].where(df["gain"].notna(), df["split"])
+    return importance.groupby([df[c] for c in RUN], observed=True).rank(ascending=False, method="average")
+
+
+def aggregate(df: pd.DataFrame, top_k: int = 10):
+    """Importance of every feature of a model and cv over its folds and seeds."""
+    df = df.assign(rank=rank_runs(df), top_k=lambda x: x["rank"] <= top_k, unused=lambda x: x["split"] == 0)
+    gain_total = df["gain"].groupby([df[c] for c in RUN], observed=True).transform("sum")
+    df["gain_share"] = df["gain"] / gain_total
+    return (
+        df
+        .groupby(["model", "variant", "cv", "feature"], observed=True)
+        .agg(
+            runs=("split", "size"),
+            split_mean=("split", "mean"),
+            split_var=("split", "var"),
+            gain_mean=("gain", "mean"),
+            gain_var=("gain", "var"),
+            gain_share=("gain_share", "mean"),
+            rank_mean=("rank", "mean"),
+            rank_sd=("rank", "std"),
+            top_k=("top_k", "mean"),
+            unused=("unused", "mean"),
+        )
+        .reset_index()
+        .sort_values(["model", "variant", "cv", "rank_mean"], ignore_index=True)
+    )
+
+
+def rank_stability(df: pd.DataFrame):
+    """
+    Kendall's W of the feature rankings of the runs of every model and cv: 1 when all folds
+    and seeds rank the features identically, near 0 when the rankings are unrelated.
+    """
+    df = df.assign(rank=rank_runs(df))
+    stability = []
+    for (model, variant, cv), group in df.groupby(["model", "variant", "cv"], observed=True):
+        m = group[RUN].drop_duplicates().shape[0]
+        rank_sums = group.groupby("feature", observed=True)["rank"].sum()
+        n = len(rank_sums)
+        s = ((rank_sums - rank_sums.mean()) ** 2).sum()
+        w = 12 * s / (m ** 2 * (n ** 3 - n)) if m > 1 and n > 1 else np.nan
+        stability.append({"model": model, "variant": variant, "cv": cv, "runs": m, "features": n, "kendall_w": w})
+    return pd.DataFrame(stability)
+
+
+def pruning_list(df: pd.DataFrame, runner: str = "e", min_unused: float = 1.0):
+    """Features without a split in at least ``min_unused`` of the runs of ``runner`` (all cvs)."""
+    df = df[df["runner"] == runner]
+    unused = (df["split"] == 0).groupby(df["feature"], observed=True).mean()
+    return sorted(unused.index[unused >= min_unused])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["ingest", "compact", "summary"])
+    parser.add_argument("--store", type=Path, default=Path("feat_imp"))
+    parser.add_argument("--input_dir", type=Path, default=Path("."), help="directory of feat_imp CSVs to ingest")
+    parser.add_argument("--output_dir", type=Path, default=Path("."))
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--prune_runner", default="e", help="runner whose unused features are pruned")
+    parser.add_argument("--min_unused", type=float, default=1.0, help="fraction of runs a pruned feature is unused in")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        print(f"Ingested {ingest(args.store, args.input_dir)} files into {args.store}")
+    elif args.command == "compact":
+        print(f"Compacted {len(compact(args.store))} rows into {args.store / COMPACT_FILE}")
+    else:
+        df = read_store(args.store)
+        print(f"{df[RUN].drop_duplicates().shape[0]} runs, {df['feature'].nunique()} features")
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+
+        outfile = args.output_dir / "feat_imp_summary.csv"
+        print("Writing:", outfile)
+        aggregate(df, args.top_k).to_csv(outfile, index=False)
+
+        stability = rank_stability(df)
+        print(stability.to_string(index=False))
+        outfile = args.output_dir / "feat_imp_stability.csv"
+        print("Writing:", outfile)
+        stability.to_csv(outfile, index=False)
+
+        pruned = pruning_list(df, args.prune_runner, args.min_unused)
+        print(f"{len(pruned)} features unused in at least {args.min_unused:.0%} of the "
+              f"{args.prune_runner.upper()} model runs")
+        outfile = args.output_dir / "pruned_features.txt"
+        print("Writing:", outfile)
+        outfile.write_text("".join(f"{feature}\n" for feature in pruned))
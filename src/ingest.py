@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Ingestion of a new season into the training files and the per-Env feature store.
+
+``append`` adds the rows of a new season (trait, meta, soil, weather, EC and hybrid info
+files with the columns of the training files) to the training files of ``--data``: rows
+are appended at the end of a file, and only the files already holding some of the new
+Envs (a re-ingested or corrected trial) are rewritten without their old rows. The
+``season_store.py`` store is then updated from the new rows alone, so an update costs in
+proportion to the new season: the aggregated yields, weather and soil features of the new
+Envs, and the lagged yield statistics of their Field_Locations for the reference years that
+see them. ``build`` creates the store from the training files, or brings it up to date
+after they were edited by hand (only Envs whose rows changed are recomputed).
+
+``create_datasets.py --feature_store`` reads the store instead of recomputing the features,
+and ``run_local.py --feature_store`` runs the pipeline with it: the dataset tasks rerun since
+the training files changed, but the splits whose datasets come out identical (e.g. the CV
+years do not include the new season) keep their Kronecker rows and models.
+
+Example:
+    python3 src/ingest.py build --data data/Training_Data --store data/store
+    python3 src/ingest.py append --data data/Training_Data --store data/store \\
+        --trait new/trait_2022.csv --meta new/meta_2022.csv --weather new/weather_2022.csv \\
+        --soil new/soil_2022.csv --ec new/ec_2022.csv --ref_years 2023
+    python3 run_local.py --data data/Training_Data --work_dir output --feature_store data/store
+"""
+import os
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from preprocessing import process_metadata
+from season_store import SeasonStore
+
+
+FILES = {  # table -> (training file, key of its rows)
+    "trait": ("1_Training_Trait_Data_2014_2021.csv", "Env"),
+    "meta": ("2_Training_Meta_Data_2014_2021.csv", "Env"),
+    "soil": ("3_Training_Soil_Data_2015_2021.csv", "Env"),
+    "weather": ("4_Training_Weather_Data_2014_2021.csv", "Env"),
+    "ec": ("6_Training_EC_Data_2014_2021.csv", "Env"),
+    "hybrids": ("All_hybrid_names_info.csv", "Hybrid"),
+}
+ENCODINGS = {"meta": "latin-1"}  # as process_metadata reads it
+
+
+def append_rows(path: Path, rows: pd.DataFrame, key: str, encoding: str = "utf-8"):
+    """Add ``rows`` to the CSV at ``path``, replacing its rows with the same keys. Returns the replaced count."""
+    columns = pd.read_csv(path, nrows=0, encoding=encoding).columns
+    extra = [c for c in rows.columns if c not in columns]
+    if extra:
+        raise Exception(f"{path.name} has no columns {extra}, the new rows need the columns of the training file.")
+    rows = rows.reindex(columns=columns)
+
+    keys = pd.read_csv(path, usecols=[key], encoding=encoding)[key]
+    replaced = keys.isin(rows[key]).sum()
+    if replaced == 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            newline = f.read(1) != b"\n"
+        with open(path, "a", encoding=encoding, newline="") as f:
+            if newline:
+                f.write("\n")
+            rows.to_csv(f, header=False, index=False)
+        return 0
+
+    df = pd.read_csv(path, encoding=encoding)
+    df = pd.concat([df[~df[key].isin(rows[key])], rows], ignore_index=True)
+    target = path.resolve()  # the file behind a staged symlink
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    df.to_csv(tmp, index=False, encoding=encoding)
+    os.replace(tmp, target)
+    return replaced
+
+
+def print_report(report: dict):
+    for table in ("trait", "weather", "soil"):
+        if table in report:
+            envs = report[table]
+            print(f"{table}: {len(envs)} Envs recomputed{': ' + ', '.join(envs) if 0 < len(envs) <= 20 else ''}")
+    if report.get("ref_years"):
+        print("lags: reference years added:", ", ".join(map(str, report["ref_years"])))
+    pairs = report.get("lags", [])
+    print(f"lags: {len(pairs)} (ref_year, Field_Location) recomputed")
+    for ref_year in sorted({year for year, _ in pairs}):
+        print(f"  {ref_year}:", ", ".join(loc for year, loc in pairs if year == ref_year))
+
+
+def build(data: Path, store: SeasonStore, ref_years: list):
+    trait = pd.read_csv(data / FILES["trait"][0])
+    meta = process_metadata(data / FILES["meta"][0])
+    weather = pd.read_csv(data / FILES["weather"][0])
+    soil = pd.read_csv(data / FILES["soil"][0])
+    return store.update(trait=trait, meta=meta, weather=weather, soil=soil, ref_years=ref_years)
+
+
+def append(data: Path, store: SeasonStore, files: dict, ref_years: list):
+    new = {}
+    for table, path in files.items():
+        name, key = FILES[table]
+        encoding = ENCODINGS.get(table, "utf-8")
+        new[table] = pd.read_csv(path, encoding=encoding)
+        replaced = append_rows(data / name, new[table], key, encoding)
+        print(f"Appending {len(new[table])} rows of {path} to {name}" + (f", replacing {replaced}" if replaced else ""))
+
+    trait = new.get("trait")
+    meta = None
+    if trait is not None or "meta" in new:
+        meta = process_metadata(data / FILES["meta"][0])
+        if "meta" in new:  # Envs of the new meta rows without new trait rows: their stations changed
+            envs = set(new["meta"]["Env"]) - set([] if trait is None else trait["Env"])
+            if envs:
+                old = pd.read_csv(data / FILES["trait"][0])
+                trait = pd.concat([trait, old[old["Env"].isin(envs)]], ignore_index=True)
+    return store.update(trait=trait, meta=meta, weather=new.get("weather"), soil=new.get("soil"), ref_years=ref_years)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="create the store or update it from the training files")
+    append_parser = commands.add_parser("append", help="append a new season to the training files and the store")
+    for command in (build_parser, append_parser):
+        command.add_argument("--data", type=Path, required=True, help="directory of the training files")
+        command.add_argument("--store", type=Path, required=True, help="feature store directory")
+        command.add_argument("--ref_years", type=int, nargs="+", default=[], help="reference years of the lag statistics to add")
+    for table in FILES:
+        append_parser.add_argument(f"--{table}", type=Path, default=None, help=f"new rows of {FILES[table][0]}")
+    append_parser.add_argument(
+        "--refit_ec", action="store_true", default=False, help="drop the EC SVD bases, the splits fit new ones"
+    )
+    args = parser.parse_args()
+
+    store = SeasonStore(args.store)
+    if args.command == "build":
+        report = build(args.data, store, args.ref_years)
+    else:
+        files = {table: getattr(args, table) for table in FILES if getattr(args, table) is not None}
+        if not files:
+            parser.error("append needs at least one of " + ", ".join(f"--{x}" for x in FILES))
+        report = append(args.data, store, files, args.ref_years)
+        if args.refit_ec:
+            store.drop_ec_bases()
+    print_report(report)
@@ -0,0 +1,147 @@
+"""
+Wall time, CPU time and peak RSS of the named stages of a run, logged as JSON lines.
+
+A background thread samples the resident set size (``/proc/self/statm``) every
+``interval`` seconds, so the peak of a stage is the largest sample taken while it ran, not
+the process high-water mark, which only ever grows. Each stage appends one line to the
+log and the run a ``total`` line on exit, with the process high-water mark. Lines carry the
+script, its arguments and the ``run_local.py`` task name, so ``memory_report.py`` can
+aggregate them into memory requests for ``workflow.py``. With ``profile``, the whole run is
+also profiled with cProfile and dumped there.
+
+The log and the profile default to the ``INSTRUMENT_LOG`` and ``INSTRUMENT_PROFILE``
+environment variables. Without either, stages only print their wall time.
+
+Example:
+    python3 -u run_e_model.py --cv 0 --fold 0 --seed 1 --timings timings.jsonl --profile e.prof
+    INSTRUMENT_LOG=timings.jsonl python3 -u create_datasets.py --cv 0 --fold 0 --seed 1
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import threading
+import contextlib
+from pathlib import Path
+from datetime import datetime, timezone
+
+
+PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 2 ** 20 if hasattr(os, "sysconf") else 4096 / 2 ** 20
+
+
+def current_rss():
+    """Resident set size of this process in MB (None where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_MB
+    except OSError:
+        return None
+
+
+def max_rss():
+    """High-water mark of the resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 2 ** 20)
+
+
+class Sampler(threading.Thread):
+    """Peak of the RSS samples since the last ``reset``."""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss() or 0.0
+        self.stop = threading.Event()
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+        return rss
+
+    def reset(self):
+        self.peak = current_rss() or 0.0
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.sample()
+
+
+class Recorder:
+    """Stage timings of a run, appended to ``log`` if given."""
+
+    def __init__(self, log: Path = None, profile: Path = None, interval: float = 0.05, **fields):
+        log = log or os.environ.get("INSTRUMENT_LOG")
+        profile = profile or os.environ.get("INSTRUMENT_PROFILE")
+        self.log = Path(log) if log else None
+        self.profile = Path(profile) if profile else None
+        self.fields = {
+            "script": Path(sys.argv[0]).name,
+            "argv": sys.argv[1:],
+            "task": os.environ.get("INSTRUMENT_TASK"),
+            "pid": os.getpid(),
+            **fields,
+        }
+        self.start = (time.perf_counter(), time.process_time())
+        self.sampler = None
+        if self.log is not None:
+            self.sampler = Sampler(interval)
+            self.sampler.start()
+        self.profiler = None
+        if self.profile is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.closed = False
+        atexit.register(self.close)
+
+    def write(self, record: dict):
+        if self.log is None:
+            return
+        line = json.dumps({"time": datetime.now(timezone.utc).isoformat(timespec="seconds"), **self.fields, **record})
+        with open(self.log, "a") as f:  # one write per line: concurrent runs can share the log
+            f.write(line + "\n")
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **fields):
+        """Time the block as stage ``name``; extra ``fields`` (e.g. the fold) go to its line."""
+        if self.sampler is not None:
+            self.sampler.reset()
+        wall, cpu = time.perf_counter(), time.process_time()
+        status = "error"
+        try:
+            yield
+            status = "ok"
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            record = {"stage": name, **fields, "status": status, "wall_s": round(wall, 4), "cpu_s": round(cpu, 4)}
+            if self.sampler is not None:
+                self.sampler.sample()
+                record["peak_rss_mb"] = round(self.sampler.peak, 1)
+            print(f"[{name}] {wall:.2f}s" + (f", peak RSS {record['peak_rss_mb']:.0f} MB" if "peak_rss_mb" in record else ""))
+            self.write(record)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profile.parent.mkdir(parents=True, exist_ok=True)
+            self.profiler.dump_stats(self.profile)
+        if self.sampler is not None:
+            self.sampler.stop.set()
+            self.write({
+                "stage": "total",
+                "wall_s": round(time.perf_counter() - self.start[0], 4),
+                "cpu_s": round(time.process_time() - self.start[1], 4),
+                "peak_rss_mb": round(max_rss(), 1),
+            })
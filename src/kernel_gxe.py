@@ -0,0 +1,153 @@
+"""
+G + E + GxE kernel regression on the Env x Hybrid grid, without forming the Kronecker matrix.
+
+The kernel of an (Env, Hybrid) pair is ``(K_E + J) kron (K_G + J)``, where ``K_E`` is the
+similarity of the Envs (linear kernel of their standardized mean environmental features,
+the features ``kronecker.R`` multiplies with the kinship) and ``K_G`` the kinship, both
+scaled to a unit mean diagonal, and ``J`` is all ones: expanded, it is the sum of an
+intercept, E, G and GxE kernels. The two small factors are eigendecomposed separately, so
+the pairs have the features ``Phi_E kron Phi_G`` (``Phi = U sqrt(S)``), and the kernel ridge
+regression is solved in that basis by conjugate gradients. The matrix-vector products use
+the identity ``(Phi_E kron Phi_G) vec(W) = vec(Phi_G W Phi_E')``, and the preconditioner is
+the exact diagonal of the normal equations; with every pair observed that diagonal is the
+system itself (``S_E kron S_G`` plus the ridge) and the solution is closed-form.
+Predictions of every pair of the grid, observed or not (CV2), are ``Phi_G W Phi_E'``.
+
+Example:
+    python3 -u run_g_or_gxe_model.py --cv 2 --fold 0 --seed 1 --model KGxE --A --grid
+"""
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse.linalg import LinearOperator, cg
+
+from assembly import KEYS, TARGET, read_features, read_kinship, read_targets
+from gblup import eigendecomposition
+
+
+RIDGE = 1.0
+EXPLAINED = 0.999  # fraction of the trace of each factor kept by its leading eigenvectors
+
+
+def env_kernel(*paths):
+    """Linear kernel of the standardized mean features of the Envs of the datasets in ``paths``."""
+    blocks = [read_features(path)[0] for path in paths]
+    features = pd.concat([
+        pd.DataFrame(block.values, columns=block.columns, index=block.index.get_level_values("Env"))
+        for block in blocks
+    ])
+    features = features.groupby(level=0).mean().dropna(axis=1)
+    z = (features - features.mean()) / features.std(ddof=0).replace(0, 1)
+    K = z.to_numpy() @ z.to_numpy().T / z.shape[1]
+    return features.index, K
+
+
+def factor_features(K: np.ndarray, explained: float = EXPLAINED, cache_dir: Path = None):
+    """``U sqrt(S)`` of ``K + J`` (``K`` scaled to a unit mean diagonal), leading eigenvectors only."""
+    K = K / np.mean(np.diag(K)) + 1.0
+    values, vectors = eigendecomposition(K, cache_dir)
+    order = np.argsort(values)[::-1]
+    values, vectors = values[order], vectors[:, order]
+    rank = int(np.searchsorted(np.cumsum(values) / values.sum(), explained) + 1)
+    return vectors[:, :rank] * np.sqrt(values[:rank])
+
+
+class KroneckerRidge(NamedTuple):
+    phi_e: np.ndarray  # Envs x components
+    phi_g: np.ndarray  # Hybrids x components
+    W: np.ndarray  # coefficients of the components of Phi_E kron Phi_G
+    mean: float
+    scale: float
+
+    def predict_grid(self):
+        """Predictions of every Hybrid (rows) in every Env (columns)."""
+        return self.mean + self.scale * (self.phi_g @ self.W @ self.phi_e.T)
+
+    def predict(self, env: np.ndarray, hybrid: np.ndarray):
+        return self.mean + self.scale * np.einsum("nk,nk->n", self.phi_g[hybrid] @ self.W, self.phi_e[env])
+
+
+def fit(phi_e: np.ndarray, phi_g: np.ndarray, env: np.ndarray, hybrid: np.ndarray, y: np.ndarray,
+        ridge: float = RIDGE, rtol: float = 1e-6, maxiter: int = 500):
+    """Kernel ridge regression on the pairs (``env``, ``hybrid``) (grid positions) with targets ``y``."""
+    mean, scale = y.mean(), y.std()
+    y = (y - mean) / scale
+    n_env, n_hybrid = len(phi_e), len(phi_g)
+    shape = (phi_g.shape[1], phi_e.shape[1])
+
+    def scatter(values):
+        grid = np.zeros((n_hybrid, n_env))
+        np.add.at(grid, (hybrid, env), values)
+        return grid
+
+    def normal_matvec(w):
+        fitted = (phi_g @ w.reshape(shape) @ phi_e.T)[hybrid, env]  # Phi w at the observed pairs
+        return (phi_g.T @ scatter(fitted) @ phi_e).ravel() + ridge * w  # Phi' Phi w + ridge w
+
+    counts = scatter(np.ones(len(y)))
+    diagonal = ((phi_g ** 2).T @ counts @ (phi_e ** 2)).ravel() + ridge
+    b = (phi_g.T @ scatter(y) @ phi_e).ravel()
+
+    n = b.size
+    w, info = cg(
+        LinearOperator((n, n), matvec=normal_matvec),
+        b,
+        x0=b / diagonal,
+        rtol=rtol,
+        maxiter=maxiter,
+        M=LinearOperator((n, n), matvec=lambda v: v / diagonal),
+    )
+    if info > 0:
+        print(f"Conjugate gradients did not converge in {maxiter} iterations.")
+    print(f"# Components: {shape[1]} Env x {shape[0]} Hybrid")
+    return KroneckerRidge(phi_e, phi_g, w.reshape(shape), mean, scale)
+
+
+class Grid(NamedTuple):
+    envs: pd.Index
+    hybrids: pd.Index
+    phi_e: np.ndarray
+    phi_g: np.ndarray
+
+
+def read_grid(cv: int, fold: int, seed: int, A=False, D=False, explained: float = EXPLAINED, cache_dir: Path = None):
+    """
+    Targets of a fold, Env and kinship factor features of the Envs and genotyped hybrids of
+    its training and validation sets, and the suffix of the output files.
+    """
+    if A == D:
+        raise Exception("The kernel GxE model uses one kinship, choose --A or --D.")
+    kinship, name, suffix = ("additive", "A", "_A") if A else ("dominant", "D", "_D")
+    print(f"Using {name} matrix.")
+
+    ytrain = read_targets(Path(f"cv{cv}_ytrain_fold{fold}_seed{seed}.csv"))
+    yval = read_targets(Path(f"cv{cv}_yval_fold{fold}_seed{seed}.csv"))
+    envs, K_E = env_kernel(Path(f"cv{cv}_xtrain_fold{fold}_seed{seed}.csv"), Path(f"cv{cv}_xval_fold{fold}_seed{seed}.csv"))
+
+    individuals = list(dict.fromkeys(ytrain["Hybrid"].tolist() + yval["Hybrid"].tolist()))
+    block = read_kinship(f"kinship_{kinship}.txt", name, individuals)
+    hybrids = pd.Index([x for x in individuals if x in set(block.index)])
+    rows = block.index.get_indexer(hybrids)
+    K_G = block.values[np.ix_(rows, rows)]
+    print("Grid:", len(envs), "Envs x", len(hybrids), "Hybrids")
+
+    grid = Grid(envs, hybrids, factor_features(K_E, explained, cache_dir), factor_features(K_G, explained, cache_dir))
+    ytrain = ytrain[ytrain["Env"].isin(envs) & ytrain["Hybrid"].isin(hybrids) & ytrain[TARGET].notna()]
+    yval = yval[yval["Env"].isin(envs) & yval["Hybrid"].isin(hybrids) & yval[TARGET].notna()]
+    return ytrain[KEYS + [TARGET]].reset_index(drop=True), yval[KEYS + [TARGET]].reset_index(drop=True), grid, suffix
+
+
+def positions(grid: Grid, y: pd.DataFrame):
+    return grid.envs.get_indexer(y["Env"]), grid.hybrids.get_indexer(y["Hybrid"])
+
+
+def grid_frame(grid: Grid, model: KroneckerRidge):
+    """Predictions of every (Env, Hybrid) pair in long format."""
+    ypred = model.predict_grid()
+    return pd.DataFrame({
+        "Env": np.tile(grid.envs, len(grid.hybrids)),
+        "Hybrid": np.repeat(grid.hybrids, len(grid.envs)),
+        "ypred": ypred.ravel(),
+    })
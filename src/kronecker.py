@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Kronecker rows of the GxE models, as ``kronecker.R`` writes them, rebuilding only the
+Envs whose inputs changed.
+
+The row of a pair (Env, Hybrid) is the Env's mean features (the datasets of every fold and
+seed of the cv without the lagged yields) times the kinship row of the hybrid, restricted to
+the phenotyped hybrids. Only the pairs of the phenotypes are computed, an Env at a time,
+instead of the full product that is subset afterwards, and they are written as Arrow record
+batches, in the row and column order of ``kronecker.R`` and with its column names (the
+``Env feature:Hybrid`` names of ``kronecker`` made syntactic by ``data.frame``).
+
+With ``--cache``, the last output and the digest of every Env's rows (its features and
+hybrids) are kept in the cache directory: a rebuild copies the rows of the unchanged Envs
+from there and computes those of new or changed Envs only, as after ``ingest.py append``.
+A different kinship, feature set or hybrid set rebuilds every row.
+
+Example:
+    python3 -u kronecker.py --cv 0 --kinship additive --cache store/kronecker
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from assembly import kinship_table, strip_hybrid_prefix
+
+
+def read_datasets(cv: int, kinds: tuple):
+    files = sorted(f for kind in kinds for f in Path(".").glob(f"cv{cv}_{kind}_fold*.csv"))
+    if not files:
+        raise Exception(f"No cv{cv} {'/'.join(kinds)} datasets in {Path.cwd()}.")
+    return pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
+
+
+def env_features(cv: int):
+    """Mean features of every Env over the datasets of the cv, without the lagged yields."""
+    x = read_datasets(cv, ("xtrain", "xval"))
+    x = x[[c for c in x.columns if "yield_lag" not in c and c != "Hybrid"]].groupby("Env").mean()
+    return x.dropna(axis=1, how="all").dropna()
+
+
+def env_hybrids(cv: int):
+    """Phenotyped (Env, Hybrid) pairs of the cv."""
+    y = read_datasets(cv, ("ytrain", "yval"))
+    y["Hybrid"] = strip_hybrid_prefix(y["Hybrid"])
+    return y.loc[y["Hybrid"] != "(Intercept)", ["Env", "Hybrid"]].drop_duplicates()
+
+
+def kinship_block(path: Path, hybrids):
+    """Kinship between the phenotyped hybrids, in the order of the kinship file."""
+    names, values = kinship_table(path)
+    hybrids = set(hybrids)
+    keep = np.array([i for i, x in enumerate(names[: len(values)]) if x in hybrids], dtype=np.intp)
+    return [names[i] for i in keep], values[np.ix_(keep, keep)]
+
+
+def make_names(names: list):
+    """
+    R's ``make.names(names, unique=TRUE)``, as ``data.frame`` applies it to the column names:
+    invalid characters become dots, an X goes before a name not starting with a letter (or a
+    dot not followed by a digit) and repeated names get a .1, .2, ... suffix.
+    """
+    names = [re.sub(r"[^A-Za-z0-9._]", ".", x) for x in names]
+    names = [x if re.match(r"[A-Za-z]|\.(?![0-9])", x) else f"X{x}" for x in names]
+    taken, counts, unique = set(names), {}, []
+    for name in names:
+        if name not in counts:  # first occurrence
+            counts[name] = 0
+            unique.append(name)
+            continue
+        k = counts[name] + 1
+        while f"{name}.{k}" in taken:
+            k += 1
+        counts[name] = k
+        taken.add(f"{name}.{k}")
+        unique.append(f"{name}.{k}")
+    return unique
+
+
+def digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else json.dumps(part).encode())
+    return h.hexdigest()
+
+
+def plan(x: pd.DataFrame, hybrids: list, pairs: pd.DataFrame):
+    """Rows of every Env in output order: (Env, positions of its hybrids in ``hybrids``)."""
+    position = pd.Series(np.arange(len(hybrids)), index=hybrids)
+    pairs = pairs[pairs["Env"].isin(x.index) & pairs["Hybrid"].isin(position.index)]
+    by_env = pairs.groupby("Env")["Hybrid"].agg(list)
+    return [(env, np.sort(position[by_env[env]].to_numpy())) for env in x.index if env in by_env.index]
+
+
+def write(outfile: Path, x: pd.DataFrame, hybrids: list, K: np.ndarray, rows: list, previous: Path = None):
+    """
+    Write the Kronecker rows, copying the Envs whose digest is unchanged from ``previous``.
+    Returns the digests of the Envs and the number of Envs computed.
+    """
+    columns = make_names(["id", *[f"{f}:{h}" for f in x.columns for h in hybrids]])[1:]
+    schema = pa.schema([("id", pa.string()), *[(c, pa.float64()) for c in columns]])
+    layout = digest(columns, K.tobytes())
+
+    old, reuse = None, {}
+    if previous is not None and previous.exists() and Path(f"{previous}.json").exists():
+        meta = json.loads(Path(f"{previous}.json").read_text())
+        if meta["layout"] == layout:
+            old = feather.read_table(previous, memory_map=True)
+            reuse = meta["envs"]
+
+    envs, computed, offset = {}, 0, 0
+    copy = None  # [start, length] of the rows copied next from the previous output, in one slice
+    tmp = outfile.with_name(f"{outfile.name}.{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        def flush():
+            if copy is not None:
+                writer.write_table(old.slice(*copy))
+
+        for env, positions in rows:
+            values = x.loc[env].to_numpy(dtype=np.float64)
+            key = digest(values.tobytes(), [hybrids[i] for i in positions])
+            if env in reuse and reuse[env][0] == key:
+                if copy is not None and copy[0] + copy[1] == reuse[env][1]:
+                    copy[1] += len(positions)
+                else:
+                    flush()
+                    copy = [reuse[env][1], len(positions)]
+            else:
+                flush()
+                copy = None
+                block = np.einsum("f,nh->nfh", values, K[positions]).reshape(len(positions), -1)
+                ids = pa.array([f"{env}:{hybrids[i]}" for i in positions])
+                writer.write_table(pa.Table.from_arrays([ids, *block.T], schema=schema))
+                computed += 1
+            envs[env] = [key, offset]
+            offset += len(positions)
+        flush()
+    os.replace(tmp, outfile)
+    return {"layout": layout, "envs": envs}, computed
+
+
+def keep(outfile: Path, meta: dict, cache: Path):
+    """Link the output and its digests into the cache for the next rebuild."""
+    cache.mkdir(parents=True, exist_ok=True)
+    cached = cache / outfile.name
+    tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+    try:
+        os.link(outfile, tmp)
+    except OSError:  # other file system
+        shutil.copyfile(outfile, tmp)
+    os.replace(tmp, cached)
+    Path(f"{tmp}.json").write_text(json.dumps(meta))
+    os.replace(f"{tmp}.json", f"{cached}.json")
+
+
+def main(args):
+    outfile = Path(f"cv{args.cv}_kronecker_{args.kinship}.arrow")
+    x = env_features(args.cv)
+    pairs = env_hybrids(args.cv)
+    hybrids, K = kinship_block(Path(f"kinship_{args.kinship}.txt"), pairs["Hybrid"].unique())
+    rows = plan(x, hybrids, pairs)
+    print(f"Using {args.kinship} kinship: {len(hybrids)} hybrids, {x.shape[0]} Envs x {x.shape[1]} features")
+    print(f"K dim: {sum(len(p) for _, p in rows)} x {x.shape[1] * len(hybrids)}")
+
+    previous = args.cache / outfile.name if args.cache is not None else None
+    meta, computed = write(outfile, x, hybrids, K, rows, previous)
+    print(f"Computed the rows of {computed} of {len(rows)} Envs")
+    if args.cache is not None:
+        keep(outfile, meta, args.cache)
+    print("Writing file:", outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cv", type=int, choices={0, 1, 2}, required=True)
+    parser.add_argument("--kinship", choices=["additive", "dominant"], required=True)
+    parser.add_argument("--cache", type=Path, default=None, help="directory keeping the last output to reuse unchanged Envs from")
+    main(parser.parse_args())
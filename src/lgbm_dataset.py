@@ -0,0 +1,265 @@
+"""
+LightGBM training on binned ``lgb.Dataset`` objects.
+
+Constructing a Dataset (histogram binning of the raw features) does not depend
+on the training seed, so the constructed Dataset is saved in LightGBM's binary
+format under a hash of the feature matrix and the binning parameters, and loaded
+directly when the same matrix is trained again (other seeds, other model variants).
+Folds that are row subsets of one table can also share a single binned Dataset.
+With squared loss, a table with repeated rows (the E-model design is constant
+within an Env) can be fitted on its distinct rows weighted by their counts.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import lightgbm as lgbm
+
+
+# same model as ``LGBMRegressor(random_state=seed, max_depth=3)``
+MODEL_PARAMS = {"objective": "regression", "max_depth": 3, "verbosity": -1}
+NUM_BOOST_ROUND = 100
+L2_OBJECTIVES = {"regression", "regression_l2", "l2", "mean_squared_error", "mse"}
+
+# parameters that change the constructed (binned) Dataset, with LightGBM defaults
+BIN_PARAMS = {
+    "max_bin": 255,
+    "min_data_in_bin": 3,
+    "bin_construct_sample_cnt": 200000,
+    "min_data_in_leaf": 20,  # used by feature_pre_filter
+    "feature_pre_filter": True,
+    "use_missing": True,
+    "zero_as_missing": False,
+}
+# seeds of the rows sampled for binning, passed only when set: LightGBM derives
+# ``data_random_seed`` from ``seed`` as ``LGBMRegressor`` does
+SEED_PARAMS = ("seed", "data_random_seed")
+
+
+def model_params(seed: int, n_jobs: int = None, **params):
+    if n_jobs is not None:
+        params["num_threads"] = n_jobs
+    return {**MODEL_PARAMS, "seed": seed, **params}
+
+
+def read_params(path):
+    """Model parameters and number of boosting rounds chosen by ``tune.py``."""
+    with open(path) as f:
+        tuned = json.load(f)
+    return tuned["params"], tuned["num_boost_round"]
+
+
+def bin_params(params: dict):
+    """Binning parameters of ``params``, with its seeds if any."""
+    bins = {k: params.get(k, v) for k, v in BIN_PARAMS.items()}
+    return {**bins, **{k: params[k] for k in SEED_PARAMS if k in params}}
+
+
+def bins_key(bins: dict, n_rows: int):
+    """
+    Binning parameters of the cache key. The seeds only reach the bins through row
+    sampling, which happens when there are more rows than ``bin_construct_sample_cnt``.
+    """
+    if n_rows <= bins["bin_construct_sample_cnt"]:
+        return {k: v for k, v in bins.items() if k not in SEED_PARAMS}
+    if "data_random_seed" in bins:  # used instead of the one derived from ``seed``
+        return {k: v for k, v in bins.items() if k != "seed"}
+    return bins
+
+
+def frame_to_array(df: pd.DataFrame, categories: dict = None):
+    """
+    Numeric array of a feature frame with categorical columns as codes.
+    Codes follow ``categories`` (taken from the training frame when None), unseen levels are NaN.
+    """
+    if categories is None:
+        categories = {c: df[c].cat.categories for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}
+    X = np.empty(df.shape, dtype=np.float64)
+    for j, col in enumerate(df.columns):
+        if col in categories:
+            codes = pd.Categorical(df[col], categories=categories[col]).codes.astype(np.float64)
+            codes[codes < 0] = np.nan
+            X[:, j] = codes
+        else:
+            X[:, j] = df[col].to_numpy(dtype=np.float64)
+    return X, categories
+
+
+def one_hot(df: pd.DataFrame, column: str, levels: list = None):
+    """
+    ``column`` replaced by 0/1 columns ``{column}_{level}`` of ``levels`` (those of ``df`` when
+    None), all 0 for other levels. Splits on them are one-vs-rest, whatever the number of levels.
+    """
+    if levels is None:
+        levels = sorted(df[column].dropna().astype(str).unique())
+    values = df[column].astype(object).to_numpy()
+    indicators = {f"{column}_{x}": (values == x).astype(np.float64) for x in levels}
+    return df.drop(columns=column).assign(**indicators), list(levels)
+
+
+def dataset_key(X: np.ndarray, feature_name: list, categorical_feature: list, bins: dict, weight: np.ndarray = None):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([list(X.shape), str(X.dtype), feature_name, categorical_feature, bins]).encode())
+    h.update(np.ascontiguousarray(X).data)
+    if weight is not None:
+        h.update(np.ascontiguousarray(weight, dtype=np.float64).data)
+    return h.hexdigest()
+
+
+def construct_dataset(X, y, params, feature_name, categorical_feature, cache_dir=None, weight=None):
+    """Binned Dataset for ``X``, loaded from ``cache_dir`` when it was constructed before."""
+    bins = bin_params(params)
+    if cache_dir is None:
+        return lgbm.Dataset(
+            X, label=y, weight=weight, feature_name=feature_name, categorical_feature=categorical_feature, params=bins
+        ).construct()
+
+    cache_dir = Path(cache_dir)
+    key = dataset_key(X, feature_name, categorical_feature, bins_key(bins, X.shape[0]), weight)
+    path = cache_dir / f"{key}.bin"
+    if path.exists():
+        print("Loading binned dataset:", path)
+        return lgbm.Dataset(str(path), label=y, weight=weight, params=bins).construct()
+
+    dataset = lgbm.Dataset(
+        X, label=y, weight=weight, feature_name=feature_name, categorical_feature=categorical_feature,
+        params=bins, free_raw_data=False
+    ).construct()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    dataset.save_binary(str(tmp))
+    os.replace(tmp, path)  # atomic, concurrent runs may write the same key
+    print("Saved binned dataset:", path)
+    return dataset
+
+
+def train(X, y, params, feature_name, categorical_feature="auto", cache_dir=None, num_boost_round=NUM_BOOST_ROUND):
+    """Fit a booster on ``X``; the binned Dataset is cached in ``cache_dir`` if given."""
+    dataset = construct_dataset(X, y, params, feature_name, categorical_feature, cache_dir)
+    params = {**params, **bin_params(params)}
+    return lgbm.train(params, dataset, num_boost_round=num_boost_round)
+
+
+def train_subsets(X, y, params, feature_name, subsets, categorical_feature="auto", cache_dir=None,
+                  num_boost_round=NUM_BOOST_ROUND):
+    """
+    Fit one booster per row subset of ``X`` (e.g. the folds of a cv/seed), binning ``X`` once.
+    Bin boundaries come from all rows of ``X``, so they see the features (never the targets)
+    of rows that are validation rows in some of the subsets.
+    """
+    reference = construct_dataset(X, y, params, feature_name, categorical_feature, cache_dir)
+    params = {**params, **bin_params(params)}
+    for rows in subsets:
+        yield lgbm.train(params, reference.subset(np.sort(rows)), num_boost_round=num_boost_round)
+
+
+class DistinctRows(NamedTuple):
+    """Distinct rows of a feature matrix with the sufficient statistics of the target on each."""
+
+    X: np.ndarray
+    total: np.ndarray  # sum of the targets
+    count: np.ndarray
+    squares: np.ndarray  # sum of the squared targets
+    inverse: np.ndarray  # position of every original row in ``X``
+
+    def residual_rmse(self):
+        """RMSE of the mean target of every distinct row, the training error a fit cannot go below."""
+        return np.sqrt(np.maximum(self.squares - self.total ** 2 / self.count, 0).sum() / self.count.sum())
+
+
+def distinct(X: np.ndarray):
+    """Distinct rows of ``X`` (NaN equal to NaN), the position of every row among them and their counts."""
+    X = np.ascontiguousarray(X)
+    rows = X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).reshape(-1)
+    _, first, inverse, count = np.unique(rows, return_index=True, return_inverse=True, return_counts=True)
+    return X[first], inverse.reshape(-1), count
+
+
+def distinct_rows(X: np.ndarray, y: np.ndarray):
+    unique, inverse, count = distinct(X)
+    y = np.asarray(y, dtype=np.float64)
+    total = np.bincount(inverse, weights=y, minlength=len(unique))
+    squares = np.bincount(inverse, weights=y ** 2, minlength=len(unique))
+    return DistinctRows(unique, total, count, squares, inverse)
+
+
+def compressed_params(params: dict):
+    """
+    Parameters that grow, on the distinct rows weighted by their counts, the trees ``params``
+    grow on all rows. With squared loss a row has a hessian of 1, so the weighted hessians are
+    the row counts: LightGBM counts the (distinct) rows for ``min_data_in_leaf`` and
+    ``min_data_in_bin``, which become a bound on the hessian and no bound.
+    """
+    if params.get("objective", "regression") not in L2_OBJECTIVES:
+        raise Exception("Row compression gives the same trees with squared loss only.")
+    if params.get("bagging_freq", 0) > 0 and params.get("bagging_fraction", 1.0) < 1.0:
+        raise Exception("Row compression would bag distinct rows instead of rows, fit without bagging.")
+    min_data = params.get("min_data_in_leaf", BIN_PARAMS["min_data_in_leaf"])
+    min_hessian = max(params.get("min_sum_hessian_in_leaf", 1e-3), min_data - 0.5)  # integer hessians
+    return {**params, "min_data_in_leaf": 0, "min_data_in_bin": 1, "min_sum_hessian_in_leaf": min_hessian}
+
+
+def check_categorical(X: np.ndarray, params: dict, feature_name: list, categorical_feature):
+    """
+    Refuse categorical features that LightGBM would not split one-vs-rest. Above
+    ``max_cat_to_onehot`` bins (the levels, NaN and one more), the levels are sorted and
+    filtered by row counts (``cat_smooth``, ``min_data_per_group``) that LightGBM estimates from
+    the hessians with the rows-per-hessian ratio of the leaf. That ratio is 1 on all rows but
+    not on weighted distinct rows, so these splits would differ.
+    """
+    if isinstance(categorical_feature, str):  # "auto": no categorical columns in an array
+        return
+    max_bins = params.get("max_cat_to_onehot", 4)
+    for feature in categorical_feature:
+        j = feature_name.index(feature) if isinstance(feature, str) else feature
+        missing = np.isnan(X[:, j])
+        bins = np.unique(X[~missing, j]).size + missing.any() + 1
+        if bins > max_bins:
+            raise Exception(
+                f"Row compression gives other trees for the categorical feature {feature_name[j]} with {bins} bins, "
+                f"more than max_cat_to_onehot={max_bins}: encode it with one_hot or fit on all rows."
+            )
+
+
+def train_compressed(X, y, params, feature_name, categorical_feature="auto", cache_dir=None,
+                     num_boost_round=NUM_BOOST_ROUND):
+    """
+    Fit the booster of ``train`` on the distinct rows of ``X``, each with the mean target of its
+    copies and their count as weight: the gradient and hessian sums of every histogram bin are
+    those of the copies, so the fit costs in distinct rows. Categorical features are limited to
+    one-vs-rest splits (``check_categorical``), so a many-level one goes through ``one_hot``. Returns the booster and the rows, whose
+    ``inverse`` expands their predictions to the rows of ``X``.
+    """
+    rows = distinct_rows(X, y)
+    params = compressed_params(params)
+    check_categorical(rows.X, params, feature_name, categorical_feature)
+    dataset = construct_dataset(
+        rows.X, rows.total / rows.count, params, feature_name, categorical_feature, cache_dir,
+        weight=rows.count.astype(np.float64),
+    )
+    params = {**params, **bin_params(params)}
+    return lgbm.train(params, dataset, num_boost_round=num_boost_round), rows
+
+
+def predict_distinct(model: lgbm.Booster, X: np.ndarray):
+    """Predictions for the rows of ``X``, computed once per distinct row."""
+    unique, inverse, _ = distinct(X)
+    return model.predict(unique)[inverse]
+
+
+def union_rows(frames: list):
+    """
+    Distinct rows (index and values) of the fold frames and the row positions of every frame in it.
+    A row whose features differ between folds (e.g. fold-wise mean imputation) is kept once per version.
+    """
+    hashes = [pd.util.hash_pandas_object(df, index=True) for df in frames]
+    union = pd.concat(frames)
+    first = ~pd.concat(hashes).duplicated().to_numpy()
+    union = union[first]
+    index = pd.Index(pd.concat(hashes).to_numpy()[first])
+    positions = [index.get_indexer(h.to_numpy()) for h in hashes]
+    return union, positions
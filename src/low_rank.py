@@ -0,0 +1,157 @@
+"""
+Low-rank genomic features of the G model, read without the hybrids x hybrids kinship.
+
+The full G design has one kinship column per hybrid, so its width and SVD grow with the
+square of the panel. Both modes read only the kinship columns of ``landmarks`` sampled
+hybrids (an n x m block) and give ``rank`` features per hybrid whose inner products
+approximate the kinship:
+
+- ``nystrom``: the landmarks are training hybrids. With ``W = U diag(l) U'`` the kinship
+  between them and ``C`` the n x m block, the features ``C U_r diag(l_r)^-1/2`` give the
+  Nyström approximation ``C W^+ C'`` of the kinship.
+- ``parents``: the additive relationship of two single crosses is the mean of the
+  relationships of their four parental pairs, ``K = Z K_P Z'``, where ``Z`` is the
+  hybrids x parents incidence (1/2 per parent) of ``All_hybrid_names_info.csv``. The
+  parental kinship ``K_P`` is solved by least squares from the kinship between the
+  landmarks, which are extended until they cover every parent of the split. A hybrid's
+  features are the mean of its parents' features ``U_r diag(l_r)^1/2``, so hybrids that
+  were not genotyped get features too.
+
+``compare`` reports the accuracy against the full-kinship model of the same split.
+
+Example:
+    python3 -u run_g_or_gxe_model.py --cv 0 --fold 0 --seed 1 --model G --A --lag_features --low_rank nystrom --rank 50
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import assembly
+from assembly import Block, kinship_table
+from evaluate import avg_rmse
+
+
+MODES = ("nystrom", "parents")
+HYBRID_INFO_PATH = "All_hybrid_names_info.csv"
+PARENT_COLS = ["Hybrid_Parent1", "Hybrid_Parent2"]
+TOL = 1e-10  # eigenvalues below TOL times the largest are dropped
+
+
+def kinship_names(path):
+    header = pd.read_csv(path, sep="\t", nrows=0).columns
+    return [x[: len(x) // 2].rstrip("_") for x in header]  # fix duplicated column names
+
+
+def kinship_columns(path, columns: list):
+    """Hybrid names of a kinship file and its columns of ``columns``, in file order (n x m)."""
+    if assembly.KINSHIP_CACHE is not None:  # parsed already in the worker
+        names, values = kinship_table(path)
+        positions = [i for i, x in enumerate(names) if x in set(columns)]
+        return names, values[:, positions]
+    names = kinship_names(path)
+    positions = [i for i, x in enumerate(names) if x in set(columns)]
+    values = pd.read_csv(path, sep="\t", usecols=positions).to_numpy(dtype=np.float64)
+    return names, values
+
+
+def sample(candidates: list, size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    candidates = list(dict.fromkeys(candidates))
+    return set(rng.choice(candidates, size=min(size, len(candidates)), replace=False).tolist())
+
+
+def top_eigen(matrix: np.ndarray, rank: int):
+    """Leading ``rank`` eigenpairs of a symmetric matrix, the numerically zero ones dropped."""
+    values, vectors = np.linalg.eigh((matrix + matrix.T) / 2)
+    order = np.argsort(values)[::-1][:rank]
+    order = order[values[order] > TOL * values[order[0]]]
+    return values[order], vectors[:, order]
+
+
+def approximation_error(features: np.ndarray, landmark_features: np.ndarray, C: np.ndarray):
+    """Relative Frobenius error of the features' inner products on the landmark columns ``C``."""
+    return np.linalg.norm(features @ landmark_features.T - C) / np.linalg.norm(C)
+
+
+def nystrom(path, kinship: str, train_hybrids: list, rank: int, landmarks: int, seed: int):
+    names = kinship_names(path)
+    genotyped = set(names)
+    chosen = sample([h for h in train_hybrids if h in genotyped], landmarks, seed)
+    names, C = kinship_columns(path, chosen)
+    rows = np.array([i for i, x in enumerate(names) if x in chosen])
+    values, vectors = top_eigen(C[rows], rank)
+    features = C @ (vectors / np.sqrt(values))
+    print(f"Nyström features: {len(rows)} landmarks, rank {len(values)}")
+    print("Kinship approximation error on the landmark columns:", approximation_error(features, features[rows], C))
+    columns = [f"nystrom{i}_{kinship}" for i in range(len(values))]
+    return Block(pd.Index(names, name="Hybrid"), features, columns, name=f"nystrom_{kinship}")
+
+
+def parents(path, kinship: str, train_hybrids: list, individuals: list, rank: int, landmarks: int, seed: int):
+    info = pd.read_csv(HYBRID_INFO_PATH).drop_duplicates("Hybrid").dropna(subset=PARENT_COLS).set_index("Hybrid")
+    names = kinship_names(path)
+    genotyped = [x for x in names if x in info.index]
+
+    # landmarks: training hybrids, and genotyped hybrids for the parents they miss
+    chosen = sample([h for h in train_hybrids if h in set(genotyped)], landmarks, seed)
+    covered = set(info.loc[list(chosen), PARENT_COLS].to_numpy().ravel())
+    needed = set(info.loc[[h for h in individuals if h in info.index], PARENT_COLS].to_numpy().ravel())
+    for hybrid in genotyped:
+        if needed <= covered:
+            break
+        if set(info.loc[hybrid, PARENT_COLS]) & (needed - covered):
+            chosen.add(hybrid)
+            covered.update(info.loc[hybrid, PARENT_COLS])
+    names, C = kinship_columns(path, chosen)
+    rows = np.array([i for i, x in enumerate(names) if x in chosen])
+
+    # K_S = Z_S K_P Z_S' solved for the parental kinship K_P
+    parent_names = sorted(covered)
+    position = pd.Series(np.arange(len(parent_names)), index=parent_names)
+
+    def incidence(hybrids):
+        Z = np.zeros((len(hybrids), len(parent_names)))
+        for col in PARENT_COLS:
+            np.add.at(Z, (np.arange(len(hybrids)), position[info.loc[hybrids, col]].to_numpy()), 0.5)
+        return Z
+
+    Zs = np.linalg.pinv(incidence([names[i] for i in rows]))
+    values, vectors = top_eigen(Zs @ C[rows] @ Zs.T, rank)
+    parent_features = vectors * np.sqrt(values)
+
+    hybrids = info.index[info[PARENT_COLS].isin(position.index).all(axis=1)]
+    features = incidence(hybrids) @ parent_features
+    print(f"Parental features: {len(parent_names)} parents from {len(rows)} landmarks, rank {len(values)}, {len(hybrids)} hybrids")
+    positions = pd.Index(hybrids).get_indexer(names)
+    known = positions >= 0
+    error = approximation_error(features[positions[known]], features[positions[rows]], C[known])
+    print("Kinship approximation error on the landmark columns:", error)
+    columns = [f"parents{i}_{kinship}" for i in range(len(values))]
+    return Block(pd.Index(hybrids, name="Hybrid"), features, columns, name=f"parents_{kinship}")
+
+
+def read_low_rank(mode: str, path, kinship: str, train_hybrids: list, individuals: list, rank: int,
+                  landmarks: int = None, seed: int = 0):
+    """Block of ``rank`` low-rank genomic features per hybrid, in place of ``read_kinship``."""
+    landmarks = landmarks or 2 * rank
+    if landmarks < rank:
+        raise Exception(f"{landmarks} landmarks give at most rank {landmarks}, fewer than {rank}.")
+    if mode == "nystrom":
+        return nystrom(path, kinship, train_hybrids, rank, landmarks, seed)
+    if mode == "parents":
+        return parents(path, kinship, train_hybrids, individuals, rank, landmarks, seed)
+    raise Exception(f"Unknown low-rank mode {mode}, one of {', '.join(MODES)}.")
+
+
+def compare(df_eval: pd.DataFrame, baseline: Path):
+    """Average RMSE of ``df_eval`` next to the full-kinship model's OOF predictions ``baseline``."""
+    if not Path(baseline).exists():
+        print("No full-kinship baseline to compare with:", baseline)
+        return None
+    df_base = pd.read_csv(baseline)
+    merged = df_eval.merge(df_base, on=["Env", "Hybrid"], suffixes=("", "_full"))
+    rmse, rmse_full = avg_rmse(df_eval, verbose=False), avg_rmse(df_base, verbose=False)
+    print(f"Full-kinship baseline {baseline}: RMSE {rmse_full:.4f}, low-rank RMSE {rmse:.4f} ({rmse / rmse_full - 1:+.2%})")
+    print("Correlation with the baseline predictions:", merged["ypred"].corr(merged["ypred_full"]))
+    return rmse, rmse_full
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Batch scoring of the 2022 submission template with the ensemble of the registered models.
+
+Models saved by the runners with ``--model_registry`` are visited in split order. The test
+features of a split (``cv{cv}_xtest_fold{fold}_seed{seed}.csv``: they depend on the fold
+through the imputation means and the EC SVD) are read once and shared by every model of the
+split, each model's test design is assembled by the same gathers as its training design and
+scored by one vectorized ``predict``, and the predictions are reduced into a running sum and
+count per template row. Memory therefore holds one split and one model at a time, whatever
+the number of folds, seeds and variants in the ensemble.
+
+GxE models score no rows: the Kronecker files hold the (Env, Hybrid) pairs of the training
+years only. Their count is reported, and a template row no model scores is left empty.
+
+Example:
+    python3 -u predict.py --model_registry models --runners e g --output submission.csv
+"""
+import argparse
+from itertools import groupby
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from assembly import KEYS, TARGET, Block, Projection, assemble, field_location_block, read_kinship, read_kronecker
+from assembly import strip_hybrid_prefix
+from lgbm_dataset import frame_to_array, one_hot
+from prefetch import prefetch
+from preprocessing import create_field_location
+from registry import entries, load
+
+
+TEST_PATH = "1_Submission_Template_2022.csv"
+KINSHIP_FILES = {"A": "kinship_additive.txt", "D": "kinship_dominant.txt"}
+KRONECKER_FILES = {"additive": "kronecker_additive.arrow", "dominant": "kronecker_dominant.arrow"}
+
+
+class Ensemble:
+    """Running sum and count of the predictions of every template row."""
+
+    def __init__(self, n: int):
+        self.total = np.zeros(n)
+        self.count = np.zeros(n, dtype=np.int64)
+
+    def add(self, rows: np.ndarray, ypred: np.ndarray):
+        self.total[rows] += ypred
+        self.count[rows] += 1
+
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+
+def read_test(cv: int, fold: int, seed: int):
+    return pd.read_csv(f"cv{cv}_xtest_fold{fold}_seed{seed}.csv")
+
+
+def e_design(meta: dict, xtest: pd.DataFrame):
+    """Test design of an E model, keyed by the (Env, Hybrid) of the template."""
+    xtest = create_field_location(xtest.copy())
+    if "one_hot" in meta:  # fitted with --field_location onehot
+        xtest, _ = one_hot(xtest, "Field_Location", meta["one_hot"]["Field_Location"])
+    else:
+        xtest["Field_Location"] = xtest["Field_Location"].astype("category")
+    X, _ = frame_to_array(xtest[meta["feature_name"]], meta["categories"])
+    return X, pd.MultiIndex.from_frame(xtest[KEYS])
+
+
+class Sources:
+    """Kinship and Kronecker files, read once for every model that uses them."""
+
+    def __init__(self):
+        self.blocks = {}
+
+    def block(self, cv: int, name: str, columns: list):
+        path = KINSHIP_FILES.get(name) or f"cv{cv}_{KRONECKER_FILES[name]}"
+        if path not in self.blocks:
+            if name in KINSHIP_FILES:
+                full = read_kinship(path, name, [])
+                columns_all = [f"{x}_{name}" for x in full.index]
+            else:
+                full = read_kronecker(path, name)
+                columns_all = full.columns
+            self.blocks[path] = (full, {c: i for i, c in enumerate(columns_all)})
+        full, position = self.blocks[path]
+        return Block(full.index, full.values, columns, usecols=[position[c] for c in columns], name=name)
+
+
+def g_or_gxe_design(meta: dict, xtest: pd.DataFrame, sources: Sources, components: np.ndarray = None):
+    """Test design of a G or GxE model, with the blocks and columns of its training design."""
+    if "blocks" not in meta:
+        raise Exception(f"{meta['name']} was saved without the blocks of its design, fit it again to score it.")
+    keys = xtest[KEYS].assign(Hybrid=strip_hybrid_prefix(xtest["Hybrid"]))
+    index = pd.MultiIndex.from_frame(keys)
+    blocks = []
+    for name, start, stop in meta["blocks"]:
+        columns = meta["inputs"][start:stop]
+        if name == "Field_Location":
+            blocks.append(field_location_block(keys["Env"], meta["categories"]["Field_Location"])[0])
+        elif name in ("E", "lag"):
+            blocks.append(Block(index, xtest[columns].to_numpy(dtype=np.float64), columns, name=name))
+        else:
+            blocks.append(sources.block(meta["cv"], name, columns))
+
+    design = assemble(keys.assign(**{TARGET: 0.0}), blocks)  # a dummy target: assemble drops empty ones
+    assert design.columns == meta["inputs"]
+    if components is None:
+        return design.X, design.index
+    return Projection(meta["inputs"][:components.shape[1]], components).transform(design.X), design.index
+
+
+def score(registry: Path, template: pd.DataFrame, runners=None, cvs=None, depth: int = 1):
+    """Ensemble mean of the registered models on the rows of ``template``, reading ``depth`` splits ahead."""
+    raw = pd.MultiIndex.from_frame(template[KEYS])
+    stripped = pd.MultiIndex.from_arrays([template["Env"], strip_hybrid_prefix(template["Hybrid"])], names=KEYS)
+    ensemble = Ensemble(len(template))
+    sources = Sources()
+
+    models = entries(registry, runners, cvs)
+    print("# Models:", len(models))
+    splits = [(key, list(split)) for key, split in groupby(models, key=lambda m: (m["cv"], m["fold"], m["seed"]))]
+    tests = prefetch(lambda key: read_test(*key), [key for key, _ in splits], depth)
+    for ((cv, fold, seed), split), xtest in zip(splits, tests):
+        print(f"Split cv{cv} fold{fold} seed{seed}: {len(xtest)} test rows")
+        for meta in split:
+            model, components = load(registry, meta)
+            if meta["runner"] == "e":
+                X, index = e_design(meta, xtest)
+                rows = raw.get_indexer(index)
+            else:
+                X, index = g_or_gxe_design(meta, xtest, sources, components)
+                rows = stripped.get_indexer(index)
+            keep = rows >= 0
+            if keep.any():
+                ensemble.add(rows[keep], model.predict(X[keep]))
+            print(f"  {meta['name']}: {int(keep.sum())} rows scored")
+            del model, X
+
+    submission = template[KEYS].copy()
+    submission[TARGET] = ensemble.mean()
+    print("Rows without predictions:", int((ensemble.count == 0).sum()))
+    return submission
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_registry", type=Path, required=True, help="directory of the saved models")
+    parser.add_argument("--runners", nargs="+", default=None, help="runners to ensemble, e.g. e g (default: all)")
+    parser.add_argument("--cv", type=int, nargs="+", choices={0, 1, 2}, default=None)
+    parser.add_argument("--template", type=Path, default=TEST_PATH)
+    parser.add_argument("--output", type=Path, default=Path("submission.csv"))
+    parser.add_argument("--prefetch", type=int, default=1, help="splits read ahead while models score, 0 to read each in turn")
+    args = parser.parse_args()
+
+    template = pd.read_csv(args.template)
+    submission = score(args.model_registry, template, args.runners, args.cv, args.prefetch)
+    print("Writing:", args.output)
+    submission.to_csv(args.output, index=False)
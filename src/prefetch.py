@@ -0,0 +1,61 @@
+"""
+Background loading of the next splits of a sweep while the current one is fitted.
+
+``prefetch(load, keys, depth)`` yields ``load(key)`` for every key in order, with a thread
+running the loads ahead: while the caller fits split k, split k + 1 is read, decoded and
+assembled. CSV and Arrow reads, the numpy gathers of the designs and LightGBM training all
+release the GIL, so loading and fitting overlap. At most ``depth`` loaded splits wait
+besides the one in use, which bounds memory to ``depth + 1`` splits; ``depth=0`` loads
+each split when it is needed, like a plain loop.
+
+Example:
+    for xtrain, xval, ytrain, yval in prefetch(lambda fold: read_e_fold(cv, fold, seed), folds):
+        ...
+"""
+import queue
+import threading
+from typing import Callable, Iterable
+
+
+_DONE = object()
+
+
+def prefetch(load: Callable, keys: Iterable, depth: int = 1):
+    """``load(key)`` of every key in order, loaded up to ``depth`` keys ahead in a thread."""
+    keys = list(keys)
+    if depth <= 0:
+        for key in keys:
+            yield load(key)
+        return
+
+    slots = threading.Semaphore(depth + 1)  # the split in use and the ones loaded ahead
+    ready = queue.Queue()
+    stop = threading.Event()
+
+    def loader():
+        for key in keys:
+            slots.acquire()
+            if stop.is_set():
+                return
+            try:
+                ready.put((True, load(key)))
+            except BaseException as e:  # raised in the caller, at the split that failed
+                ready.put((False, e))
+                return
+        ready.put((True, _DONE))
+
+    thread = threading.Thread(target=loader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = ready.get()
+            if not ok:
+                raise item
+            if item is _DONE:
+                return
+            yield item
+            del item
+            slots.release()  # the caller is done with the split
+    finally:
+        stop.set()
+        slots.release()  # unblock the loader if the caller stopped early
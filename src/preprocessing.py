@@ -62,7 +62,7 @@ def process_blues(df: pd.DataFrame):
     print(df["predicted.value"])
     df["predicted.value"] = df.apply(
         lambda x: x["Yield_Mg_ha"]
-        if x["predicted.value"] < 0
+        if x["predicted.value"] < 0 or pd.isna(x["predicted.value"])  # no BLUE for the pair
         else x["predicted.value"],
         axis=1,
     )
@@ -0,0 +1,75 @@
+"""
+Registry of the fitted LightGBM models, the persisted half of the 2022 test scoring.
+
+Each model is a LightGBM text file with a JSON sidecar holding what scoring needs to rebuild
+its design on the test rows: the runner, split and output suffix, the feature columns before
+and after the SVD, the source block (kinship, Kronecker, E, lag, Field_Location) and column
+range of every block of the G/GxE design, the Field_Location levels of the categorical codes,
+and the SVD components (``.npy``) if the design was projected. Files are written atomically, so an
+interrupted run never leaves a half-written model for ``predict.py`` to pick up.
+
+Example:
+    python3 -u run_e_model.py --cv 0 --fold 0 1 2 3 4 --seed 1 --model_registry models
+    python3 -u run_g_or_gxe_model.py --cv 0 --fold 0 --seed 1 --model G --A --svd --model_registry models
+"""
+import os
+import json
+from pathlib import Path
+
+import numpy as np
+import lightgbm as lgbm
+
+
+def model_name(runner: str, cv: int, fold: int, seed: int, suffix: str = ""):
+    return f"cv{cv}_{runner}_model_fold{fold}_seed{seed}{suffix}"
+
+
+def _replace(path: Path, write):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _save_array(path: Path, array: np.ndarray):
+    with open(path, "wb") as f:  # a file object keeps np.save from appending ".npy"
+        np.save(f, array)
+
+
+def save(registry: Path, booster: lgbm.Booster, runner: str, cv: int, fold: int, seed: int, suffix: str = "",
+         components: np.ndarray = None, **meta):
+    """Write ``booster`` with its metadata (feature columns, blocks, categories, ...) to ``registry``."""
+    registry = Path(registry)
+    registry.mkdir(parents=True, exist_ok=True)
+    name = model_name(runner, cv, fold, seed, suffix)
+    meta = {"name": name, "runner": runner, "cv": cv, "fold": fold, "seed": seed, "suffix": suffix, **meta}
+    if components is not None:
+        meta["components"] = f"{name}.npy"
+        _replace(registry / meta["components"], lambda tmp: _save_array(tmp, components))
+
+    _replace(registry / f"{name}.txt", lambda tmp: booster.save_model(tmp))
+    _replace(registry / f"{name}.json", lambda tmp: tmp.write_text(json.dumps(meta, indent=1)))
+    print("Saved model:", registry / f"{name}.txt")
+    return name
+
+
+def entries(registry: Path, runners=None, cvs=None):
+    """Metadata of the registered models, ordered by split so each split's test data is built once."""
+    found = []
+    for path in sorted(Path(registry).glob("*.json")):
+        meta = json.loads(path.read_text())
+        if runners is not None and meta["runner"] not in runners:
+            continue
+        if cvs is not None and meta["cv"] not in cvs:
+            continue
+        if not (path.parent / f"{meta['name']}.txt").exists():
+            continue
+        found.append(meta)
+    return sorted(found, key=lambda m: (m["cv"], m["fold"], m["seed"], m["runner"], m["suffix"]))
+
+
+def load(registry: Path, meta: dict):
+    """The booster of a registry entry and its SVD components (None without SVD)."""
+    registry = Path(registry)
+    model = lgbm.Booster(model_file=str(registry / f"{meta['name']}.txt"))
+    components = np.load(registry / meta["components"]) if "components" in meta else None
+    return model, components
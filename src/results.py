@@ -0,0 +1,276 @@
+"""
+Consolidated results of the E, G, GxE and FA model runs.
+
+Every ``cv*_oof_*`` and ``cv*_pred_train_*`` file of a directory is read in parallel into one
+typed table (kind, runner, variant, model, cv, fold, seed, Env, Hybrid, ytrue, ypred), saved
+as a Parquet dataset partitioned by kind, runner and cv. Per-Env RMSE and Pearson r, their
+averages per run and paired model comparisons are grouped reductions over that table, and
+``all_predictions.csv`` is written for ``comparisons.R``.
+
+Example:
+    python3 -u results.py --input_dir output --output_dir output
+"""
+import os
+import re
+import time
+import argparse
+from pathlib import Path
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+from preprocessing import create_field_location
+
+
+FILE_PATTERN = re.compile(
+    r"cv(?P<cv>\d)_(?P<kind>oof|pred_train)_(?P<runner>[a-z]+)_model"
+    r"_fold(?P<fold>\d)_seed(?P<seed>\d+)(?P<variant>.*)\.csv"
+)
+COLUMN_TYPES = {
+    "Env": pa.dictionary(pa.int32(), pa.string()),
+    "Hybrid": pa.dictionary(pa.int32(), pa.string()),
+    "ytrue": pa.float64(),
+    "ypred": pa.float64(),
+}
+PARTITIONS = ["kind", "runner", "cv"]
+RUN = ["kind", "model", "variant", "cv", "fold", "seed"]
+
+# G and GxE variants fitted by 6-job_g.sh and 7-job_gxe.sh
+SWEEP_VARIANT = r"_lag_features_svd\d+comps$"
+
+
+def model_label(runner: str, variant: str):
+    """Model name of the paper and ``comparisons.R``: E, FA, G(A), G(D)+E, G(A)EI, ..., GBLUP(A) and KGxE(A)."""
+    if runner in ("e", "fa"):
+        return runner.upper()
+    tokens = variant.strip("_").split("_")
+    label = "G(" + "+".join(k for k in ("A", "D") if k in tokens) + ")"
+    if runner == "gblup":
+        return f"GBLUP{label[1:]}"
+    if runner == "kgxe":
+        return f"KGxE{label[1:]}"
+    if runner == "gxe":
+        return f"{label}EI"
+    return f"{label}+E" if "E" in tokens else label
+
+
+def find_files(input_dir: Path):
+    return sorted(p for p in Path(input_dir).iterdir() if FILE_PATTERN.fullmatch(p.name))
+
+
+def read_file(path: Path):
+    # pred_train files of the E model also have an unnamed index column
+    options = pv.ConvertOptions(include_columns=list(COLUMN_TYPES), column_types=COLUMN_TYPES)
+    return pv.read_csv(path, convert_options=options)
+
+
+def read_results(paths: list, workers: int = None):
+    """One table of every prediction file, with the run of each row taken from its file name."""
+    with ThreadPoolExecutor(workers) as pool:
+        tables = list(pool.map(read_file, paths))
+    n_rows = [t.num_rows for t in tables]
+    table = pa.concat_tables(tables).unify_dictionaries()
+    del tables
+    df = table.to_pandas(split_blocks=True, self_destruct=True)  # frees the Arrow buffers as it converts
+    del table
+
+    files = pd.DataFrame([FILE_PATTERN.fullmatch(p.name).groupdict() for p in paths])
+    files["model"] = [model_label(r, v) for r, v in zip(files["runner"], files["variant"])]
+    files = files.astype({
+        "kind": "category", "runner": "category", "variant": "category", "model": "category",
+        "cv": np.int8, "fold": np.int8, "seed": np.int16,
+    })
+    rows = np.repeat(np.arange(len(paths)), n_rows)
+    runs = files.iloc[rows].reset_index(drop=True)
+    return pd.concat([runs[["kind", "runner", "variant", "model", "cv", "fold", "seed"]], df], axis=1)
+
+
+def write_store(df: pd.DataFrame, path: Path):
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        path,
+        partition_cols=PARTITIONS,
+        existing_data_behavior="delete_matching",
+    )
+
+
+def read_store(path: Path, filters: list = None):
+    """Results table (or the partitions matching ``filters``, e.g. ``[("kind", "=", "oof")]``)."""
+    df = pd.read_parquet(path, filters=filters)
+    df["cv"] = df["cv"].astype(np.int8)
+    return df
+
+
+def group_codes(df: pd.DataFrame, keys: list):
+    """
+    Group number of every row over the categorical or integer columns ``keys`` and the key
+    values of every group, without the per-key factorizations of a pandas groupby.
+    """
+    levels = []
+    codes = []
+    for key in keys:
+        if isinstance(df[key].dtype, pd.CategoricalDtype):
+            codes.append(df[key].cat.codes.to_numpy())
+            levels.append(df[key].cat.categories)
+        else:
+            code, level = pd.factorize(df[key], sort=True)
+            codes.append(code)
+            levels.append(level)
+    shape = [len(level) for level in levels]
+    unique, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    groups = pd.DataFrame({
+        key: level[code] for key, level, code in zip(keys, levels, np.unravel_index(unique, shape))
+    })
+    return inverse, groups
+
+
+def per_env(df: pd.DataFrame):
+    """RMSE and Pearson r of every run and Env."""
+    codes, out = group_codes(df, RUN + ["Env"])
+    x = df["ytrue"].to_numpy()
+    y = df["ypred"].to_numpy()
+
+    n = np.bincount(codes)
+    mx = np.bincount(codes, x) / n
+    my = np.bincount(codes, y) / n
+    dx = x - mx[codes]
+    dy = y - my[codes]
+    sxx = np.bincount(codes, dx * dx)
+    syy = np.bincount(codes, dy * dy)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.bincount(codes, dx * dy) / np.sqrt(sxx * syy)
+    # undefined for constant values within an Env (e.g. E model predictions), not rounding noise
+    r[(sxx <= n * (1e-12 * mx) ** 2) | (syy <= n * (1e-12 * my) ** 2)] = np.nan
+
+    out["n"] = n
+    out["rmse"] = np.sqrt(np.bincount(codes, (y - x) ** 2) / n)
+    out["r"] = r
+    return out
+
+
+def per_run(df_env: pd.DataFrame):
+    """Average over Envs of the per-Env metrics, i.e. the score printed by ``avg_rmse``."""
+    return (
+        df_env
+        .groupby(RUN, observed=True)
+        .agg(n_env=("Env", "size"), rmse=("rmse", "mean"), r=("r", "mean"))
+        .reset_index()
+    )
+
+
+def summarize(df_run: pd.DataFrame):
+    """Mean and standard deviation of the run scores over folds and seeds."""
+    return (
+        df_run
+        .groupby(["kind", "model", "variant", "cv"], observed=True)
+        .agg(
+            runs=("rmse", "size"),
+            rmse=("rmse", "mean"),
+            rmse_sd=("rmse", "std"),
+            r=("r", "mean"),
+            r_sd=("r", "std"),
+        )
+        .reset_index()
+    )
+
+
+def compare_models(df_run: pd.DataFrame):
+    """
+    Paired differences (model1 - model2) of the run scores over the (fold, seed) runs of a cv
+    that both models have, with the fraction of runs in which model1 has the lower RMSE.
+    """
+    wide = df_run.pivot_table(
+        index=["cv", "fold", "seed"], columns="model", values=["rmse", "r"], observed=True, dropna=False
+    )
+    comparisons = []
+    for model1, model2 in combinations(wide["rmse"].columns, 2):
+        diff = pd.DataFrame({
+            "rmse_diff": wide["rmse", model1] - wide["rmse", model2],
+            "r_diff": wide["r", model1] - wide["r", model2],
+        }).dropna(subset=["rmse_diff"])
+        diff["wins"] = diff["rmse_diff"] < 0
+        stats = (
+            diff
+            .groupby(level="cv")
+            .agg(
+                runs=("rmse_diff", "size"),
+                rmse_diff=("rmse_diff", "mean"),
+                rmse_diff_sd=("rmse_diff", "std"),
+                r_diff=("r_diff", "mean"),
+                wins=("wins", "mean"),
+            )
+            .reset_index()
+        )
+        stats.insert(1, "model1", model1)
+        stats.insert(2, "model2", model2)
+        comparisons.append(stats)
+    if not comparisons:  # a single model, e.g. partial results
+        return pd.DataFrame(columns=["cv", "model1", "model2", "runs", "rmse_diff", "rmse_diff_sd", "r_diff", "wins"])
+    return pd.concat(comparisons, ignore_index=True).sort_values(["cv", "model1", "model2"], ignore_index=True)
+
+
+def all_predictions(df: pd.DataFrame):
+    """Out-of-fold predictions in the layout read by ``comparisons.R``."""
+    oof = df[df["kind"] == "oof"]
+    envs = pd.DataFrame({"Env": oof["Env"].cat.categories})
+    codes, field_locations = pd.factorize(create_field_location(envs)["Field_Location"])
+    return pd.DataFrame({
+        "Field Location": pd.Categorical.from_codes(codes[oof["Env"].cat.codes.to_numpy()], field_locations),
+        "Env": oof["Env"].array,
+        "Hybrid": oof["Hybrid"].array,
+        "Model": oof["model"].array,
+        "CV": oof["cv"].array,
+        "Fold": oof["fold"].array,
+        "Seed": oof["seed"].array,
+        "ytrue": oof["ytrue"].array,
+        "ypred": oof["ypred"].array,
+    })
+
+
+def write_csv(df: pd.DataFrame, path: Path):
+    """Arrow's CSV writer keeps categorical columns encoded, which matters for the prediction tables."""
+    pv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_dir", type=Path, default=Path("."), help="directory of the oof and pred_train files")
+    parser.add_argument("--output_dir", type=Path, default=Path("."))
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="files read in parallel")
+    parser.add_argument(
+        "--variant",
+        default=SWEEP_VARIANT,
+        help="regex of the G/GxE variants in all_predictions.csv and the model comparisons",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = find_files(args.input_dir)
+    df = read_results(paths, args.workers)
+    print(f"Read {len(paths)} files, {len(df)} rows in {time.perf_counter() - start:.1f}s")
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    store = args.output_dir / "results"
+    write_store(df, store)
+    print("Writing:", store)
+
+    df_env = per_env(df)
+    df_run = per_run(df_env)
+    outputs = {"results_per_env.csv": df_env, "results_per_run.csv": df_run, "results_summary.csv": summarize(df_run)}
+
+    # comparisons and comparisons.R use one variant per model
+    in_sweep = df["runner"].isin(["e", "fa"]).to_numpy() | df["variant"].str.contains(args.variant).to_numpy()
+    oof_runs = df_run[(df_run["kind"] == "oof") & df_run["variant"].isin(df.loc[in_sweep, "variant"].unique())]
+    if len(oof_runs):
+        outputs["results_comparisons.csv"] = compare_models(oof_runs)
+    outputs["all_predictions.csv"] = all_predictions(df[in_sweep])
+
+    for name, out in outputs.items():
+        print("Writing:", args.output_dir / name)
+        write_csv(out, args.output_dir / name)
+    print(f"Done in {time.perf_counter() - start:.1f}s")
@@ -1,18 +1,54 @@
+#!/usr/bin/env python3
 import argparse
 from pathlib import Path
 
 import pandas as pd
-import lightgbm as lgbm
 
-from preprocessing import process_test_data, create_field_location
+from preprocessing import process_test_data
+from assembly import read_e_fold
 from evaluate import create_df_eval, avg_rmse, feat_imp
+from importance import append as append_feat_imp
+from registry import save as save_model
+from lgbm_dataset import (
+    NUM_BOOST_ROUND, model_params, read_params, frame_to_array, one_hot, train, train_subsets, union_rows,
+    train_compressed, predict_distinct,
+)
+from instrument import Recorder
+from prefetch import prefetch
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--cv", type=int, choices={0, 1, 2}, required=True)
-parser.add_argument("--fold", type=int, choices={0, 1, 2, 3, 4}, required=True)
+parser.add_argument("--fold", type=int, choices={0, 1, 2, 3, 4}, nargs="+", required=True)
 parser.add_argument("--seed", type=int, required=True)
-args = parser.parse_args()
+parser.add_argument("--n_jobs", type=int, default=None, help="LightGBM and BLAS threads")
+parser.add_argument("--dataset_cache", type=Path, default=None, help="directory of cached binned datasets")
+parser.add_argument("--params", type=Path, default=None, help="tuned parameters written by tune.py")
+parser.add_argument("--feat_imp_store", type=Path, default=None, help="feature-importance store to append to")
+parser.add_argument("--model_registry", type=Path, default=None, help="directory to save the fitted models to (predict.py)")
+parser.add_argument(
+    "--shared_bins",
+    action="store_true",
+    default=False,
+    help="bin the union of the folds' training rows once and train every fold on a row subset",
+)
+parser.add_argument(
+    "--compress_rows",
+    action="store_true",
+    default=False,
+    help="fit on the distinct feature rows (one per Env) weighted by their counts, the trees of all rows; "
+    "needs --field_location onehot",
+)
+parser.add_argument(
+    "--field_location",
+    choices=["categorical", "onehot"],
+    default="categorical",
+    help="Field_Location as a categorical feature, or as 0/1 columns of the training locations "
+    "(a different model, split one location against the rest, which --compress_rows fits exactly)",
+)
+parser.add_argument("--prefetch", type=int, default=1, help="folds read ahead while a model trains, 0 to read each in turn")
+parser.add_argument("--timings", type=Path, default=None, help="JSONL log of the stage timings and peak RSS")
+parser.add_argument("--profile", type=Path, default=None, help="cProfile dump of the run")
 
 TRAIT_PATH = "1_Training_Trait_Data_2014_2021.csv"
 TEST_PATH = "1_Submission_Template_2022.csv"
@@ -20,46 +56,22 @@ META_TRAIN_PATH = "2_Training_Meta_Data_2014_2021.csv"
 META_TEST_PATH = "2_Testing_Meta_Data_2022.csv"
 
 
-if __name__ == "__main__":
-    # df_sub = process_test_data(TEST_PATH).reset_index()[['Env', 'Hybrid']]
-
-    xtrain = pd.read_csv(f"cv{args.cv}_xtrain_fold{args.fold}_seed{args.seed}.csv")
-    xval = pd.read_csv(f"cv{args.cv}_xval_fold{args.fold}_seed{args.seed}.csv")
-    # xtest = pd.read_csv(OUTPUT_PATH / 'xtest.csv')
-    ytrain = pd.read_csv(
-        f"cv{args.cv}_ytrain_fold{args.fold}_seed{args.seed}.csv"
-    ).set_index(["Env", "Hybrid"])["Yield_Mg_ha"]
-    yval = pd.read_csv(
-        f"cv{args.cv}_yval_fold{args.fold}_seed{args.seed}.csv"
-    ).set_index(["Env", "Hybrid"])["Yield_Mg_ha"]
-
-    # add factor
-    xtrain = create_field_location(xtrain)
-    xtrain["Field_Location"] = xtrain["Field_Location"].astype("category")
-    xval = create_field_location(xval)
-    xval["Field_Location"] = xval["Field_Location"].astype("category")
-    # xtest = create_field_location(xtest)
-    # xtest['Field_Location'] = xtest['Field_Location'].astype('category')
-
-    # set index
-    xtrain = xtrain.set_index(["Env", "Hybrid"])
-    xval = xval.set_index(["Env", "Hybrid"])
-    # xtest = xtest.set_index(['Env', 'Hybrid'])
-
-    # fit
-    model = lgbm.LGBMRegressor(random_state=args.seed, max_depth=3)
-    model.fit(xtrain, ytrain)
-
+def write_fold(args, fold, model, categories, levels, xtrain, xval, ytrain, yval, ypred_train, ypred):
     # feature importance
     df_feat_imp = feat_imp(model)
     df_feat_imp.to_csv(
-        f"cv{args.cv}_feat_imp_e_model_fold{args.fold}_seed{args.seed}.csv",
+        f"cv{args.cv}_feat_imp_e_model_fold{fold}_seed{args.seed}.csv",
         index=False,
     )
-
-    # predict
-    ypred_train = model.predict(xtrain)
-    ypred = model.predict(xval)
+    if args.feat_imp_store is not None:
+        append_feat_imp(args.feat_imp_store, model, "e", args.cv, fold, args.seed)
+    if args.model_registry is not None:
+        save_model(
+            args.model_registry, model, "e", args.cv, fold, args.seed,
+            feature_name=xtrain.columns.tolist(),
+            categories={k: v.tolist() for k, v in categories.items()},
+            **({"one_hot": {"Field_Location": levels}} if levels is not None else {}),
+        )
 
     # evaluate
     df_eval_train = create_df_eval(xtrain, ytrain, ypred_train)
@@ -67,13 +79,108 @@ if __name__ == "__main__":
     _ = avg_rmse(df_eval)
 
     # write
-    outfile = f"cv{args.cv}_oof_e_model_fold{args.fold}_seed{args.seed}.csv"
+    outfile = f"cv{args.cv}_oof_e_model_fold{fold}_seed{args.seed}.csv"
     print("Writing:", outfile, "\n")
     df_eval.to_csv(outfile, index=False)
     df_eval_train.to_csv(
-        f"cv{args.cv}_pred_train_e_model_fold{args.fold}_seed{args.seed}.csv"
+        f"cv{args.cv}_pred_train_e_model_fold{fold}_seed{args.seed}.csv"
     )
 
-    # predict on test
-    # df_sub['Yield_Mg_ha'] = model.predict(xtest)
-    # df_sub.to_csv('output/submission.csv', index=False)
+
+def main(args):
+    if args.compress_rows and args.shared_bins:
+        raise Exception("--compress_rows fits every fold on its own distinct rows, without --shared_bins.")
+    if args.compress_rows and args.field_location != "onehot":
+        raise Exception(
+            "--compress_rows grows the trees of all rows with --field_location onehot only: LightGBM filters "
+            "the levels of a categorical Field_Location by row counts, which differ on weighted distinct rows."
+        )
+    recorder = Recorder(args.timings, args.profile, cv=args.cv, seed=args.seed)
+    tuned, num_boost_round = read_params(args.params) if args.params else ({}, NUM_BOOST_ROUND)
+    params = model_params(args.seed, args.n_jobs, **tuned)
+
+    if not args.shared_bins:
+        # the next folds are read in the background while a model trains
+        splits = prefetch(lambda fold: read_e_fold(args.cv, fold, args.seed), args.fold, args.prefetch)
+        for fold in args.fold:
+            with recorder.stage("read", fold=fold):  # the wait for the fold, not overlapped with fitting
+                xtrain, xval, ytrain, yval = next(splits)
+            print("Using fold", fold)
+
+            # fit
+            with recorder.stage("fit", fold=fold):
+                levels = None
+                if args.field_location == "onehot":
+                    xtrain, levels = one_hot(xtrain, "Field_Location")
+                    xval, _ = one_hot(xval, "Field_Location", levels)
+                Xtrain, categories = frame_to_array(xtrain)
+                Xval, _ = frame_to_array(xval, categories)
+                options = dict(
+                    feature_name=xtrain.columns.tolist(),
+                    categorical_feature=list(categories),
+                    cache_dir=args.dataset_cache,
+                    num_boost_round=num_boost_round,
+                )
+                if args.compress_rows:
+                    model, rows = train_compressed(Xtrain, ytrain.to_numpy(), params, **options)
+                    print(f"Fitted on {len(rows.X)} distinct rows of {len(Xtrain)}")
+                    print("RMSE of the mean yields of the distinct rows:", rows.residual_rmse())
+                else:
+                    model = train(Xtrain, ytrain.to_numpy(), params, **options)
+
+            # predict
+            with recorder.stage("predict", fold=fold):
+                if args.compress_rows:
+                    ypred_train = model.predict(rows.X)[rows.inverse]
+                    ypred = predict_distinct(model, Xval)
+                else:
+                    ypred_train = model.predict(Xtrain)
+                    ypred = model.predict(Xval)
+            with recorder.stage("write", fold=fold):
+                write_fold(args, fold, model, categories, levels, xtrain, xval, ytrain, yval, ypred_train, ypred)
+
+    else:
+        # one binned dataset over the union of training rows, folds are row subsets of it
+        print("Sharing bins across folds", args.fold)
+        with recorder.stage("read"):
+            folds = {fold: read_e_fold(args.cv, fold, args.seed) for fold in args.fold}
+        if len({tuple(xtrain.columns) for xtrain, _, _, _ in folds.values()}) > 1:
+            raise Exception("--shared_bins needs the same feature columns in every fold (e.g. EC SVD components), bin the folds separately.")
+        with recorder.stage("fit"):
+            union, positions = union_rows([
+                xtrain.assign(Yield_Mg_ha=ytrain, Field_Location=xtrain["Field_Location"].astype(str))
+                for xtrain, _, ytrain, _ in folds.values()
+            ])
+            yunion = union.pop("Yield_Mg_ha")
+            union["Field_Location"] = union["Field_Location"].astype("category")
+            levels = None
+            if args.field_location == "onehot":
+                union, levels = one_hot(union, "Field_Location")
+            Xunion, categories = frame_to_array(union)
+            models = list(train_subsets(  # the boosters are trained as the generator is consumed
+                Xunion,
+                yunion.to_numpy(),
+                params,
+                feature_name=union.columns.tolist(),
+                subsets=positions,
+                categorical_feature=list(categories),
+                cache_dir=args.dataset_cache,
+                num_boost_round=num_boost_round,
+            ))
+        for (fold, (xtrain, xval, ytrain, yval)), rows, model in zip(folds.items(), positions, models):
+            print("Using fold", fold)
+            if levels is not None:
+                xtrain, _ = one_hot(xtrain, "Field_Location", levels)
+                xval, _ = one_hot(xval, "Field_Location", levels)
+            with recorder.stage("predict", fold=fold):
+                ypred_train = model.predict(Xunion[rows])
+                ypred = model.predict(frame_to_array(xval, categories)[0])
+            with recorder.stage("write", fold=fold):
+                write_fold(args, fold, model, categories, levels, xtrain, xval, ytrain, yval, ypred_train, ypred)
+
+    # test predictions: predict.py scores the models saved with --model_registry
+    recorder.close()
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
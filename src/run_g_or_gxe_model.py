@@ -1,290 +1,240 @@
-import gc
+#!/usr/bin/env python3
 import argparse
 from pathlib import Path
 
 import pandas as pd
-import numpy as np
-import lightgbm as lgbm
-from sklearn.decomposition import TruncatedSVD
+from threadpoolctl import threadpool_limits
 
-from preprocessing import create_field_location
 from evaluate import create_df_eval, avg_rmse, feat_imp
+from importance import append as append_feat_imp
+from registry import save as save_model
+from lgbm_dataset import NUM_BOOST_ROUND, model_params, read_params, train
+import assembly
+from assembly import g_or_gxe_designs, leading_components
+from gblup import fit as fit_gblup, read_fold as read_gblup_fold
+import kernel_gxe
+import low_rank
+from instrument import Recorder
+from prefetch import prefetch
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--cv', type=int, choices={0, 1, 2}, required=True)
-parser.add_argument('--fold', type=int, choices={0, 1, 2, 3, 4}, required=True)
+parser.add_argument('--fold', type=int, choices={0, 1, 2, 3, 4}, nargs='+', required=True)
 parser.add_argument('--seed', type=int, required=True)
-parser.add_argument('--model', choices={'G', 'GxE'}, required=True)
+parser.add_argument('--model', choices={'G', 'GxE', 'GBLUP', 'KGxE'}, required=True)
 parser.add_argument('--A', action='store_true', default=False)
 parser.add_argument('--D', action='store_true', default=False)
 parser.add_argument('--E', action='store_true', default=False)
 parser.add_argument('--svd', action='store_true', default=False)
-parser.add_argument('--n_components', type=int, default=100)
+parser.add_argument('--n_components', type=int, nargs='+', default=[100], help='SVD ranks, several fit the SVD once at the largest')
+parser.add_argument('--svd_solver', choices=['randomized', 'arpack'], default='randomized', help='TruncatedSVD algorithm')
+parser.add_argument('--low_rank', choices=low_rank.MODES, default=None, help='G: low-rank kinship features instead of the kinship columns')
+parser.add_argument('--rank', type=int, default=100, help='number of low-rank kinship features')
+parser.add_argument('--landmarks', type=int, default=None, help='hybrids whose kinship columns are read for --low_rank (default 2 x rank)')
 parser.add_argument('--lag_features', action='store_true', default=False)
-args = parser.parse_args()
-
-PREFIX = f'cv{args.cv}_'
-
-if args.model == 'G':
-    outfile = Path(f'{PREFIX}oof_g_model_fold{args.fold}_seed{args.seed}')
-    print('Using G model.')
-else:
-    print('Using GxE model.')
-    outfile = Path(f'{PREFIX}oof_gxe_model_fold{args.fold}_seed{args.seed}')
-
-
-def preprocess_g(df, kinship, individuals: list):
-    individuals = [x.replace('Hybrid', '') if x.startswith('Hybrid') else x for x in individuals]
-    df.columns = [x[:len(x) // 2].rstrip('_') for x in df.columns]  # fix duplicated column names
-    df.index = df.columns
-    #print("Index: \n", df.index)
-    #print("Individuals: \n ", individuals[:20])
-    df = df[df.index.isin(individuals)]  # filter rows
-    df = df[[col for col in df.columns if col in individuals]]  # filter columns
-    df.index.name = 'Hybrid'
-    df.columns = [f'{x}_{kinship}' for x in df.columns]
-    return df
-
-
-def preprocess_kron(df, kinship):
-    print(f"Dataframe: {df.head()}")
-    print(f"Columns: {df.columns}")
-    df[['Env', 'Hybrid']] = df['id'].str.split(':', expand=True)
-    df = df.drop('id', axis=1).set_index(['Env', 'Hybrid'])
-    df.columns = [f'{x}_{kinship}' for x in df.columns]
-    # print(df.info(), '\n')
-    # df[df.columns] = np.array(df.values, dtype=np.float32)  # downcast is too slow
-    # print(df.info(), '\n')
-    return df
-
-
-def prepare_gxe(kinship):
-    print(f"KINSHIP: {kinship}")
-    kron = pd.read_feather(Path(f'{PREFIX}kronecker_{kinship}.arrow'))
-    print(f"KRON: {kron}")
-    kron = preprocess_kron(kron, kinship=kinship)
-    return kron
-
-
-if __name__ == '__main__':
-    
-    # load targets
-    ytrain = pd.read_csv(Path(f'{PREFIX}ytrain_fold{args.fold}_seed{args.seed}.csv'))
-    yval = pd.read_csv(Path(f'{PREFIX}yval_fold{args.fold}_seed{args.seed}.csv'))
-    individuals = ytrain['Hybrid'].unique().tolist() + yval['Hybrid'].unique().tolist()
-    individuals = list(dict.fromkeys(individuals))  # take unique but preserves order (python 3.7+)
-    yval["Hybrid"] = yval["Hybrid"].str.replace(r'^Hybrid', '', regex=True)
-
-    # load kinships or kroneckers
-    kinships = []
-    kroneckers = []
-    if args.A:
-        print('Using A matrix.')
-        outfile = f'{outfile}_A'
-        if args.model == 'G':
-            A = pd.read_csv('kinship_additive.txt', sep='\t')
-            print("A:\n ", A)
-            A = preprocess_g(A, 'A', individuals)
-            print("A2:\n ", A)
-            kinships.append(A)
-        else:
-            kroneckers.append(prepare_gxe('additive'))
-    if args.D:
-        print('Using D matrix.')
-        outfile = f'{outfile}_D'
-        if args.model == 'G':
-            D = pd.read_csv('kinship_dominant.txt', sep='\t')
-            D = preprocess_g(D, 'D', individuals)
-            kinships.append(D)
-        else:
-            kroneckers.append(prepare_gxe('dominant'))
-    if args.E:
-        if args.model == 'G':
-            print('Using E matrix.')
-            outfile = f'{outfile}_E'
-            Etrain = pd.read_csv(Path(f'{PREFIX}xtrain_fold{args.fold}_seed{args.seed}.csv'))
-            Eval = pd.read_csv(Path(f'{PREFIX}xval_fold{args.fold}_seed{args.seed}.csv'))
-        else:
-            raise Exception('G+E+GxE is not implemented.')
-        
-    print('Using fold', args.fold)
-
-    if (args.model == 'G' and len(kinships) == 0) or (args.model == 'GxE' and len(kroneckers) == 0):
-        raise Exception('Choose at least one matrix.')
-    
-    # concat dataframes and bind target
-    ytrain["Hybrid"] = ytrain["Hybrid"].str.replace(r'^Hybrid', '', regex=True)
-    if args.model == 'G':
-        
-        K = pd.concat(kinships, axis=1)
-
-        
-        merged = pd.merge(ytrain, K, on='Hybrid', how='left')
-
-        merged_clean = merged.dropna()
-
-        xtrain = merged_clean.set_index(['Env', 'Hybrid'])
-        xval = pd.merge(yval, K, on='Hybrid', how='left').dropna().set_index(['Env', 'Hybrid'])
-        del kinships
-        gc.collect()
-    else:
-        kron = pd.concat(kroneckers, axis=1)
-        del kroneckers
-        xtrain = pd.merge(ytrain, kron, on=['Env', 'Hybrid'], how='inner')
-        xval = pd.merge(yval, kron, on=['Env', 'Hybrid'], how='inner')
-        del kron
-        gc.collect()
-
-    # split x, y
-    ytrain = xtrain['Yield_Mg_ha']
-    del xtrain['Yield_Mg_ha']
-    yval = xval['Yield_Mg_ha']
-    del xval['Yield_Mg_ha']
-    gc.collect()
-    
-
-    # include E matrix if requested
-    if args.E:
-        Etrain = Etrain.dropna(axis=1)
-        Eval = Eval.dropna(axis=1)
-        Etrain["Hybrid"] = Etrain["Hybrid"].str.replace(r'^Hybrid', '', regex=True)
-        Eval["Hybrid"] = Eval["Hybrid"].str.replace(r'^Hybrid', '', regex=True)
-        xtrain = xtrain.merge(Etrain, on=['Env', 'Hybrid'], how='left').copy().set_index(['Env', 'Hybrid'])
-        xval = xval.merge(Eval, on=['Env', 'Hybrid'], how='left').copy().set_index(['Env', 'Hybrid'])
-        lag_cols = xtrain.filter(regex='_lag', axis=1).columns
-        if len(lag_cols) > 0:
-            xtrain = xtrain.drop(lag_cols, axis=1)
-            xval = xval.drop(lag_cols, axis=1)
-
-    # bind lagged yield features
-    no_lags_cols = [x for x in xtrain.columns.tolist() if x not in ['Env', 'Hybrid']]
-    
-    if args.lag_features:
-        xtrain_lag = pd.read_csv(Path(f'{PREFIX}xtrain_fold{args.fold}_seed{args.seed}.csv'), usecols=lambda x: 'yield_lag' in x or x in ['Env', 'Hybrid']).set_index(['Env', 'Hybrid'])
-        xval_lag = pd.read_csv(Path(f'{PREFIX}xval_fold{args.fold}_seed{args.seed}.csv'), usecols=lambda x: 'yield_lag' in x or x in ['Env', 'Hybrid']).set_index(['Env', 'Hybrid'])
-        outfile = f'{outfile}_lag_features'
-
-        
-        xtrain_lag.index = xtrain_lag.index.set_levels(
-            xtrain_lag.index.levels[1].str.replace("Hybrid", "", regex=True), level=1
+parser.add_argument('--n_jobs', type=int, default=None, help='LightGBM and BLAS threads')
+parser.add_argument('--dataset_cache', type=Path, default=None, help='directory of cached binned datasets')
+parser.add_argument('--params', type=Path, default=None, help='tuned parameters written by tune.py')
+parser.add_argument('--feat_imp_store', type=Path, default=None, help='feature-importance store to append to')
+parser.add_argument('--eigen_cache', type=Path, default=None, help='directory of cached kinship eigendecompositions (KGxE)')
+parser.add_argument('--ridge', type=float, default=kernel_gxe.RIDGE, help='KGxE ridge penalty (targets are standardized)')
+parser.add_argument('--explained', type=float, default=kernel_gxe.EXPLAINED, help='KGxE fraction of the kernel traces kept')
+parser.add_argument('--grid', action='store_true', default=False, help='KGxE: also write predictions of every Env x Hybrid pair')
+parser.add_argument('--model_registry', type=Path, default=None, help='directory to save the fitted model to (predict.py, G and GxE)')
+parser.add_argument('--prefetch', type=int, default=1, help='folds read ahead while a model trains, 0 to read each in turn')
+parser.add_argument('--timings', type=Path, default=None, help='JSONL log of the stage timings and peak RSS')
+parser.add_argument('--profile', type=Path, default=None, help='cProfile dump of the run')
+
+
+def fit_predict(args, xtrain, xval, seed):
+    tuned, num_boost_round = read_params(args.params) if args.params else ({}, NUM_BOOST_ROUND)
+    model = train(
+        xtrain.X,
+        xtrain.y,
+        model_params(seed, args.n_jobs, **tuned),
+        feature_name=xtrain.columns,
+        categorical_feature=['Field_Location'],
+        cache_dir=args.dataset_cache,
+        num_boost_round=num_boost_round,
+    )
+
+    # predict
+    ypred_train = model.predict(xtrain.X)
+    ypred = model.predict(xval.X)
+
+    # validate
+    df_eval_train = create_df_eval(xtrain, xtrain.y, ypred_train)
+    df_eval = create_df_eval(xval, xval.y, ypred)
+    _ = avg_rmse(df_eval)
+    return model, df_eval, df_eval_train
+
+
+def fit_predict_gblup(args, ytrain, yval, kinship):
+    keys = pd.concat([ytrain, yval])[['Env', 'Hybrid']]
+    model = fit_gblup(ytrain, kinship, keys)
+
+    # predict
+    ypred_train = model.predict(ytrain)
+    ypred = model.predict(yval)
+
+    # validate
+    xtrain = ytrain.set_index(['Env', 'Hybrid'])
+    xval = yval.set_index(['Env', 'Hybrid'])
+    df_eval_train = create_df_eval(xtrain, xtrain['Yield_Mg_ha'], ypred_train)
+    df_eval = create_df_eval(xval, xval['Yield_Mg_ha'], ypred)
+    _ = avg_rmse(df_eval)
+    return model, df_eval, df_eval_train
+
+
+def fit_predict_kgxe(args, ytrain, yval, grid):
+    model = kernel_gxe.fit(grid.phi_e, grid.phi_g, *kernel_gxe.positions(grid, ytrain), ytrain['Yield_Mg_ha'].to_numpy(), ridge=args.ridge)
+
+    # predict
+    ypred_train = model.predict(*kernel_gxe.positions(grid, ytrain))
+    ypred = model.predict(*kernel_gxe.positions(grid, yval))
+
+    # validate
+    xtrain = ytrain.set_index(['Env', 'Hybrid'])
+    xval = yval.set_index(['Env', 'Hybrid'])
+    df_eval_train = create_df_eval(xtrain, xtrain['Yield_Mg_ha'], ypred_train)
+    df_eval = create_df_eval(xval, xval['Yield_Mg_ha'], ypred)
+    _ = avg_rmse(df_eval)
+    return model, df_eval, df_eval_train
+
+
+def read_split(args, fold):
+    """Inputs of the model on a fold and the suffix of its output files."""
+    if args.model == 'GBLUP':
+        ytrain, yval, kinship, suffix = read_gblup_fold(args.cv, fold, args.seed, A=args.A, D=args.D)
+        return (ytrain, yval, kinship), suffix
+    if args.model == 'KGxE':
+        ytrain, yval, grid, suffix = kernel_gxe.read_grid(
+            args.cv, fold, args.seed, A=args.A, D=args.D, explained=args.explained, cache_dir=args.eigen_cache
         )
-        xval_lag.index = xval_lag.index.set_levels(
-            xval_lag.index.levels[1].str.replace("Hybrid", "", regex=True), level=1
-        )
-       
-
-        xtrain = xtrain.merge(xtrain_lag, on=['Env', 'Hybrid'], how='inner').copy()
-        xval = xval.merge(xval_lag, on=['Env', 'Hybrid'], how='inner').copy()
-    
-    if args.model == 'GxE':
-        if 'Env' in xtrain.columns and 'Hybrid' in xtrain.columns:
-            xtrain = xtrain.set_index(['Env', 'Hybrid'])
-            xval = xval.set_index(['Env', 'Hybrid'])
+        return (ytrain, yval, grid), suffix
+    xtrain, xval, suffix = g_or_gxe_designs(
+        args.cv, fold, args.seed, args.model, A=args.A, D=args.D, E=args.E,
+        lag_features=args.lag_features, svd=args.svd, n_components=max(args.n_components),
+        low_rank=args.low_rank, rank=args.rank, landmarks=args.landmarks, svd_solver=args.svd_solver
+    )
+    return (xtrain, xval), suffix
 
 
+def svd_ranks(args, data, suffix):
+    """Inputs and suffix of every rank of ``--n_components``, from the SVD fitted at the largest."""
     if not args.svd:
+        yield data, suffix, None
+        return
+    xtrain, xval = data
+    largest = max(args.n_components)
+    for k in sorted(set(args.n_components)):
+        explained = xtrain.projection.explained[:k].sum()
+        if len(args.n_components) > 1:
+            print(f'# Components: {k}, explained variance: {explained}')
+        yield (
+            (leading_components(xtrain, k), leading_components(xval, k)),
+            suffix.replace(f'_svd{largest}comps', f'_svd{k}comps'),
+            {'n_components': k, 'explained': round(float(explained), 6)},
+        )
 
-        # add factor
-        xtrain = xtrain.reset_index()
-        xtrain = create_field_location(xtrain)
-        xtrain['Field_Location'] = xtrain['Field_Location'].astype('category')
-        xtrain = xtrain.set_index(['Env', 'Hybrid'])
-        xval = xval.reset_index()
-        xval = create_field_location(xval)
-        xval['Field_Location'] = xval['Field_Location'].astype('category')
-        xval = xval.set_index(['Env', 'Hybrid'])
-
-        # include E matrix if requested
-        if args.E:
-            lag_cols = xtrain.filter(regex='_lag', axis=1).columns
-            if len(lag_cols) > 0:
-                xtrain = xtrain.drop(lag_cols, axis=1)
-                xval = xval.drop(lag_cols, axis=1)
-            xtrain = xtrain.merge(Etrain, on=['Env', 'Hybrid'], how='left').set_index(['Env', 'Hybrid'])
-            xval = xval.merge(Eval, on=['Env', 'Hybrid'], how='left').set_index(['Env', 'Hybrid'])
-            del Etrain, Eval
-            gc.collect()
-
-        print('Using full set of features.')
-        print('# Features:', xtrain.shape[1])
 
-        # fit
-        model = lgbm.LGBMRegressor(random_state=args.seed, max_depth=3)
-        model.fit(xtrain, ytrain)
+def main(args):
+    if args.n_jobs is not None:
+        threadpool_limits(limits=args.n_jobs)  # BLAS threads of the SVD
 
-        # predict
-        ypred_train = model.predict(xtrain)
-        ypred = model.predict(xval)
+    PREFIX = f'cv{args.cv}_'
 
-        # validate
-        df_eval_train = create_df_eval(xtrain, ytrain, ypred_train)
-        df_eval = create_df_eval(xval, yval, ypred)
-        _ = avg_rmse(df_eval)
-        
+    if args.model == 'G':
+        name = 'g'
+        print('Using G model.')
+    elif args.model == 'GBLUP':
+        if args.E or args.svd or args.lag_features:
+            raise Exception('GBLUP uses the kinship only, without E, lagged yield or SVD features.')
+        if args.eigen_cache is not None:
+            raise Exception('The GBLUP kinship is scaled by the record counts of the split, its eigendecomposition is not cached.')
+        name = 'gblup'
+        print('Using GBLUP model.')
+    elif args.model == 'KGxE':
+        if args.E or args.svd or args.lag_features:
+            raise Exception('The kernel GxE model has its own E kernel, without lagged yield or SVD features.')
+        name = 'kgxe'
+        print('Using G + E + GxE kernel model.')
     else:
-        outfile = f'{outfile}_svd{args.n_components}comps'
-        print('Using svd.')
-        print('# Components:', args.n_components)
-        svd = TruncatedSVD(n_components=args.n_components, random_state=args.seed)
-        print("Null Values: ", xtrain[no_lags_cols].isna().sum().sum())
-        svd.fit(xtrain[no_lags_cols])  # fit but without lagged yield features
-        
+        print('Using GxE model.')
+        name = 'gxe'
+
+    if args.model_registry is not None and args.model not in ('G', 'GxE'):
+        raise Exception('Only the LightGBM models (G, GxE) are saved to the model registry.')
+    if args.low_rank is not None and args.model != 'G':
+        raise Exception('Low-rank kinship features are implemented for the G model.')
+    if args.low_rank is not None and args.model_registry is not None:
+        raise Exception('predict.py rebuilds the kinship columns, models on low-rank features are not saved to the registry.')
+    if len(args.n_components) > 1 and not (args.svd and args.model in ('G', 'GxE')):
+        raise Exception('Several --n_components are a sweep of the SVD ranks of the G and GxE models (--svd).')
+    if len(args.fold) > 1 and assembly.KINSHIP_CACHE is None:
+        assembly.KINSHIP_CACHE = {}  # the folds share the parsed kinship
+
+    recorder = Recorder(args.timings, args.profile, cv=args.cv, seed=args.seed, model=args.model)
+
+    # the next folds are read and assembled in the background while a model trains
+    splits = prefetch(lambda fold: read_split(args, fold), args.fold, args.prefetch)
+    for fold in args.fold:
+        with recorder.stage('read', fold=fold):  # the wait for the fold, not overlapped with fitting
+            split, split_suffix = next(splits)
+        if args.svd:
+            projection = split[0].projection
+            recorder.write({
+                'stage': 'svd', 'fold': fold, 'solver': args.svd_solver,
+                'n_components': len(projection.components), 'wall_s': round(projection.seconds, 4),
+            })
+        # one SVD per fold, a model per rank
+        for data, suffix, rank in svd_ranks(args, split, split_suffix):
+            with recorder.stage('fit', fold=fold, **(rank or {})):
+                if args.model == 'GBLUP':
+                    model, df_eval, df_eval_train = fit_predict_gblup(args, *data)
+                elif args.model == 'KGxE':
+                    model, df_eval, df_eval_train = fit_predict_kgxe(args, *data)
+                else:
+                    model, df_eval, df_eval_train = fit_predict(args, *data, args.seed)
+            outfile = f'{PREFIX}oof_{name}_model_fold{fold}_seed{args.seed}{suffix}'
+
+            with recorder.stage('write', fold=fold, **(rank or {})):
+                # feature importance (LightGBM models)
+                if args.svd:
+                    df_feat_imp = feat_imp(model)
+                    feat_imp_outfile = f'{outfile.replace("oof", "feat_imp")}.csv'
+                    df_feat_imp.to_csv(feat_imp_outfile, index=False)
+                if args.feat_imp_store is not None and args.model in ('G', 'GxE'):
+                    append_feat_imp(args.feat_imp_store, model, args.model.lower(), args.cv, fold, args.seed, suffix)
+                if args.model_registry is not None:
+                    xtrain = data[0]
+                    projection = xtrain.projection
+                    save_model(
+                        args.model_registry, model, args.model.lower(), args.cv, fold, args.seed, suffix,
+                        components=None if projection is None else projection.components,
+                        model=args.model,
+                        inputs=xtrain.columns if projection is None else projection.columns + xtrain.columns[len(projection.components):],
+                        feature_name=xtrain.columns,
+                        blocks=xtrain.blocks,
+                        categories={'Field_Location': xtrain.categories},
+                    )
+                    del xtrain
+
+                # write OOF results
+                outfile = f'{outfile}.csv'
+                print('Writing file:', outfile, '\n')
+                df_eval.to_csv(outfile, index=False)
+                df_eval_train.to_csv(outfile.replace('oof_', 'pred_train_'), index=False)
+                if args.low_rank is not None:
+                    low_rank.compare(df_eval, outfile.replace(f'_{args.low_rank}{args.rank}', ''))
+                if args.model == 'KGxE' and args.grid:
+                    print('Writing file:', outfile.replace('oof_', 'grid_'), '\n')
+                    kernel_gxe.grid_frame(data[2], model).to_csv(outfile.replace('oof_', 'grid_'), index=False)
+            del data, model, df_eval, df_eval_train
+        del split
+    recorder.close()
 
-        print('Explained variance:', svd.explained_variance_ratio_.sum())
 
-        # transform from the fitted svd
-        svd_cols = [f'svd{i}' for i in range(args.n_components)]
-        xtrain_svd = pd.DataFrame(svd.transform(xtrain[no_lags_cols]), columns=svd_cols, index=xtrain[no_lags_cols].index)
-        xval_svd = pd.DataFrame(svd.transform(xval[no_lags_cols]), columns=svd_cols, index=xval[no_lags_cols].index)
-        del svd
-        gc.collect()
-
-        # bind lagged yield features if needed
-        if args.lag_features:
-            xtrain = xtrain_svd.merge(xtrain_lag, on=['Env', 'Hybrid'], how='inner').copy()
-            del xtrain_svd, xtrain_lag
-            xval = xval_svd.merge(xval_lag, on=['Env', 'Hybrid'], how='inner').copy()
-            del xval_svd, xval_lag
-            gc.collect()
-        else:
-            xtrain = xtrain_svd.copy()
-            del xtrain_svd
-            xval = xval_svd.copy()
-            del xval_svd
-            gc.collect()
-
-    if args.svd:
-
-        # add factor
-        xtrain = xtrain.reset_index()
-        xtrain = create_field_location(xtrain)
-        xtrain['Field_Location'] = xtrain['Field_Location'].astype('category')
-        xtrain = xtrain.set_index(['Env', 'Hybrid'])
-        xval = xval.reset_index()
-        xval = create_field_location(xval)
-        xval['Field_Location'] = xval['Field_Location'].astype('category')
-        xval = xval.set_index(['Env', 'Hybrid'])
-
-        model = lgbm.LGBMRegressor(random_state=args.seed, max_depth=3)
-        model.fit(xtrain, ytrain)
-
-        # predict
-        ypred_train = model.predict(xtrain)
-        ypred = model.predict(xval)
-
-        # validate
-        df_eval_train = create_df_eval(xtrain, ytrain, ypred_train)
-        df_eval = create_df_eval(xval, yval, ypred)
-        _ = avg_rmse(df_eval)
-
-        # feature importance
-        df_feat_imp = feat_imp(model)
-        feat_imp_outfile = f'{outfile.replace("oof", "feat_imp")}.csv'
-        df_feat_imp.to_csv(feat_imp_outfile, index=False)
-
-    # write OOF results
-    outfile = f'{outfile}.csv'
-    print('Writing file:', outfile, '\n')
-    df_eval.to_csv(outfile, index=False)
-    df_eval_train.to_csv(outfile.replace('oof_', 'pred_train_'), index=False)
+if __name__ == '__main__':
+    main(parser.parse_args())
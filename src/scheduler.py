@@ -0,0 +1,114 @@
+"""
+Core-aware scheduler for the E, G and GxE model sweeps.
+
+Runs the per-(cv, fold, seed) runner invocations of ``5-job_e.sh``, ``6-job_g.sh`` and
+``7-job_gxe.sh``, as ``workflow.stage_graph`` lists them (with the GBLUP and kernel GxE
+runs), concurrently within a total core budget. Every run gets an explicit
+``--n_jobs`` and BLAS thread limit sized from its input files, and the CPU utilization
+of the sweep (child CPU time over wall time x cores) is reported at the end.
+
+Example:
+    python3 -u scheduler.py g --cores 16
+"""
+import os
+import sys
+import time
+import math
+import argparse
+import subprocess
+from pathlib import Path
+from typing import NamedTuple
+
+
+SRC_PATH = Path(__file__).parent.resolve()
+BYTES_PER_THREAD = 64 * 1024 ** 2  # input bytes that keep one LightGBM/BLAS thread busy
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+SWEEP_STAGES = {"e": "5-job_e.sh", "g": "6-job_g.sh", "gxe": "7-job_gxe.sh"}
+
+sys.path.insert(0, str(SRC_PATH.parent))
+from workflow import CVS, FOLDS, SEEDS, stage_graph  # noqa: E402  the runs of the job scripts
+
+
+class Task(NamedTuple):
+    name: str
+    args: list
+    inputs: list
+
+
+def sweep_tasks(sweep, cvs, folds, seeds):
+    """Runner invocations of the sweep's stage in ``workflow.stage_graph``."""
+    stage = next(s for s in stage_graph(cvs, folds, seeds) if s.name == SWEEP_STAGES[sweep])
+    for task in stage.tasks:
+        yield Task(task.name, task.command[2:], task.inputs)  # without "python3 -u"
+
+
+def threads_for(task: Task, max_threads: int):
+    """Threads sized to the task's data: one per ``BYTES_PER_THREAD`` of input."""
+    size = sum(Path(f).stat().st_size for f in task.inputs if Path(f).exists())
+    return max(1, min(max_threads, math.ceil(size / BYTES_PER_THREAD)))
+
+
+def run(tasks, cores: int, max_threads: int, log_dir: Path, extra_args: list):
+    """Start tasks largest-first while their threads fit in the free cores."""
+    pending = sorted(((threads_for(t, min(cores, max_threads)), t) for t in tasks), key=lambda x: -x[0])
+    running = {}
+    free = cores
+    failed = []
+    cpu_total = 0.0
+    start = time.perf_counter()
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    while pending or running:
+        launched = True
+        while launched:
+            launched = False
+            for i, (n_threads, task) in enumerate(pending):
+                if n_threads <= free:
+                    env = {**os.environ, **{var: str(n_threads) for var in BLAS_THREAD_VARS}}
+                    cmd = [sys.executable, "-u", str(SRC_PATH / task.args[0]), *task.args[1:],
+                           f"--n_jobs={n_threads}", *extra_args]
+                    with open(log_dir / f"{task.name}.txt", "w") as log:
+                        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+                    running[proc.pid] = (proc, n_threads, task, time.perf_counter())
+                    free -= n_threads
+                    del pending[i]
+                    launched = True
+                    break
+
+        pid, status, rusage = os.wait4(-1, 0)
+        proc, n_threads, task, task_start = running.pop(pid)
+        proc.returncode = code = os.waitstatus_to_exitcode(status)
+        free += n_threads
+        wall = time.perf_counter() - task_start
+        cpu = rusage.ru_utime + rusage.ru_stime
+        cpu_total += cpu
+        if code != 0:
+            failed.append(task.name)
+        print(f"[{'ok' if code == 0 else f'FAILED ({code})'}] {task.name}: "
+              f"{n_threads} threads, {wall:.1f}s wall, {cpu:.1f}s cpu, utilization {cpu / (wall * n_threads):.0%}")
+
+    wall = time.perf_counter() - start
+    print(f"\nCores: {cores}, wall: {wall:.1f}s, cpu: {cpu_total:.1f}s, "
+          f"utilization: {cpu_total / (wall * cores):.0%}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sweep", choices=["e", "g", "gxe"])
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="total core budget")
+    parser.add_argument("--max_threads", type=int, default=8, help="threads of the largest single fit")
+    parser.add_argument("--cv", type=int, nargs="+", default=list(CVS))
+    parser.add_argument("--fold", type=int, nargs="+", default=list(FOLDS))
+    parser.add_argument("--seed", type=int, nargs="+", default=list(SEEDS))
+    parser.add_argument("--log_dir", type=Path, default=Path("."))
+    args, extra_args = parser.parse_known_args()  # anything else is passed to the runners
+
+    tasks = list(sweep_tasks(args.sweep, args.cv, args.fold, args.seed))
+    print(f"Scheduling {len(tasks)} runs on {args.cores} cores.")
+
+    failed = run(tasks, args.cores, args.max_threads, args.log_dir, extra_args)
+    if failed:
+        print("Failed runs:", *failed, sep="\n  ")
+        sys.exit(1)
@@ -0,0 +1,235 @@
+"""
+Per-Env feature tables of the training seasons, updated one season at a time.
+
+The store keeps what ``create_datasets.py`` otherwise recomputes over the whole history for
+every split: the aggregated yields (``agg_yield``), the weather and soil features
+(``feat_eng_weather``, ``feat_eng_soil``), the median planting dates and the lagged yield
+statistics (``feat_eng_target``) of every reference year, as Arrow tables, and the EC SVD
+basis of every split. Every table row belongs to one Env, or to one (ref_year,
+Field_Location) for the lags, so ``update`` only recomputes the Envs whose raw rows changed
+(new seasons, corrected trials), compared by a content hash of their rows, and the lag
+statistics of the Field_Locations of these Envs for the reference years that see them
+(``Year <= ref_year - lag``). The results equal a full recomputation.
+
+The EC SVD bases are the exception: a split fits its basis once and later runs project the
+Envs of new seasons onto it instead of refitting, so the features of the Envs already in
+the datasets do not move. ``ingest.py append --refit_ec`` drops the bases.
+
+Example:
+    store = SeasonStore("data/store")
+    store.update(trait=trait, meta=process_metadata(META_TRAIN_PATH), weather=weather, soil=soil)
+    xtrain = xtrain.merge(store.weather_features(), on="Env", how="left")
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import create_field_location, agg_yield, feat_eng_weather, feat_eng_soil, feat_eng_target
+
+
+META_COLS = ["Env", "weather_station_lat", "weather_station_lon", "treatment_not_standard"]
+LAG = 2
+REF_YEARS = [2020, 2021, 2022]  # the YTRAIN_YEAR, YVAL_YEAR and YTEST_YEAR of create_datasets.py
+
+
+def env_digests(df: pd.DataFrame, key: str = "Env"):
+    """Content hash of the rows of every Env, whatever their order in the file."""
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    columns = json.dumps(df.columns.tolist()).encode()
+    digests = {}
+    for env, positions in df.groupby(key).indices.items():
+        h = hashlib.blake2b(columns, digest_size=16)
+        h.update(np.sort(rows[positions]).tobytes())
+        digests[env] = h.hexdigest()
+    return digests
+
+
+def field_location(env: str):
+    return re.sub("(_).*", "", env)  # as create_field_location
+
+
+def weather_columns(columns: list, order: list):
+    """Columns of ``feat_eng_weather`` in its order: features as in ``order``, then seasons."""
+    features = list(dict.fromkeys(c.rsplit("_", 1)[0] for c in [*order, *columns]))
+    return sorted(set(columns), key=lambda c: (features.index(c.rsplit("_", 1)[0]), c.rsplit("_", 1)[1]))
+
+
+class SeasonStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.root / "state.json"
+        self.state = json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+        self.state.setdefault("digests", {})
+        self.state.setdefault("ref_years", list(REF_YEARS))
+        self.state.setdefault("lag", LAG)
+
+    # --- tables --------------------------------------------------------------
+    def _read(self, name: str):
+        path = self.root / f"{name}.arrow"
+        return pd.read_feather(path) if path.exists() else None
+
+    def _write(self, name: str, df: pd.DataFrame):
+        path = self.root / f"{name}.arrow"
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        df.reset_index(drop=True).to_feather(tmp)
+        os.replace(tmp, path)
+
+    def _table(self, name: str):
+        df = self._read(name)
+        if df is None:
+            raise Exception(f"{self.root} has no {name} table, build it with ingest.py build.")
+        return df
+
+    def save(self):
+        tmp = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.state, indent=1, sort_keys=True))
+        os.replace(tmp, self.state_path)
+
+    def yields(self):
+        """``agg_yield`` of the trait data with the meta columns."""
+        return self._table("yields")
+
+    def planting(self):
+        """Median ``Date_Planted`` of every Env, the input of ``weather_windows.planting_dates``."""
+        return self._table("planting")
+
+    def weather_features(self):
+        return self._table("weather").set_index("Env")
+
+    def soil_features(self):
+        return self._table("soil").set_index("Env")
+
+    def lag_features(self, ref_year: int, lag: int = LAG):
+        """``feat_eng_target`` of the yields, stored for the reference years of the store."""
+        if ref_year not in self.state["ref_years"] or lag != self.state["lag"]:
+            return feat_eng_target(self.yields(), ref_year=ref_year, lag=lag)
+        lags = self._table("lags")
+        return lags[lags["ref_year"] == ref_year].drop(columns="ref_year").set_index("Field_Location")
+
+    # --- EC SVD bases ----------------------------------------------------------
+    def ec_basis(self, split: str):
+        """EC columns and SVD components fitted by the split, None before its first run."""
+        path = self.root / "ec_svd" / f"{split}.json"
+        if not path.exists():
+            return None
+        meta = json.loads(path.read_text())
+        return meta["columns"], np.load(path.with_suffix(".npy"))
+
+    def save_ec_basis(self, split: str, columns: list, components: np.ndarray):
+        directory = self.root / "ec_svd"
+        directory.mkdir(exist_ok=True)
+        for suffix, write in (
+            (".npy", lambda f: np.save(f, components)),
+            (".json", lambda f: f.write(json.dumps({"columns": columns}).encode())),
+        ):
+            path = directory / f"{split}{suffix}"
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+
+    def drop_ec_bases(self):
+        shutil.rmtree(self.root / "ec_svd", ignore_errors=True)
+
+    # --- updates -------------------------------------------------------------
+    def changed(self, table: str, df: pd.DataFrame):
+        """Envs of ``df`` whose rows differ from the ones the store was built from."""
+        digests = env_digests(df)
+        known = self.state["digests"].setdefault(table, {})
+        changed = sorted(env for env, digest in digests.items() if known.get(env) != digest)
+        return changed, {env: digests[env] for env in changed}
+
+    def _replace_rows(self, name: str, new: pd.DataFrame, envs: list):
+        old = self._read(name)
+        if old is None:
+            return new
+        return pd.concat([old[~old["Env"].isin(envs)], new], ignore_index=True)
+
+    def update(self, trait: pd.DataFrame = None, meta: pd.DataFrame = None, weather: pd.DataFrame = None,
+               soil: pd.DataFrame = None, ref_years: list = ()):
+        """
+        Recompute the tables for the Envs of the given rows that are new or changed: ``trait``
+        (with ``meta``, processed by ``process_metadata``, for its stations), ``weather`` and
+        ``soil`` may hold a single season or the whole history. Returns the changed Envs of
+        every table, the recomputed (ref_year, Field_Location) pairs of the lags and the reference
+        years added, whose lags are computed for every Field_Location.
+        """
+        report = {}
+        new_ref_years = [year for year in ref_years if year not in self.state["ref_years"]]
+        self.state["ref_years"] = sorted({*self.state["ref_years"], *ref_years})
+
+        if trait is not None:
+            if meta is None:
+                raise Exception("The trait rows need the meta data of their Envs.")
+            rows = trait.merge(meta[META_COLS], on="Env", how="left")
+            envs, digests = self.changed("trait", rows)
+            rows = create_field_location(rows[rows["Env"].isin(envs)].copy())
+            if envs:
+                yields = self._replace_rows("yields", agg_yield(rows), envs)
+                self._write("yields", yields.sort_values(["Env", "Hybrid"], kind="stable"))
+                dates = pd.to_datetime(rows["Date_Planted"], format="%m/%d/%y", errors="coerce")
+                planting = dates.groupby(rows["Env"]).median().dt.strftime("%m/%d/%y").rename("Date_Planted").reset_index()
+                planting = self._replace_rows("planting", planting, envs)
+                self._write("planting", planting.sort_values("Env", kind="stable"))
+            report["trait"] = envs
+            self.state["digests"]["trait"].update(digests)
+
+        # lags: the Field_Locations of the changed Envs, for the reference years that see them
+        pairs = {
+            (ref_year, field_location(env))
+            for ref_year in self.state["ref_years"]
+            if ref_year not in new_ref_years
+            for env in report.get("trait", [])
+            if int(env[-4:]) <= ref_year - self.state["lag"]
+        }
+        lags = self._read("lags")
+        if pairs or new_ref_years or (lags is None and report.get("trait")):
+            yields = self.yields()
+            tables = []
+            for ref_year in self.state["ref_years"]:
+                locs = sorted(loc for year, loc in pairs if year == ref_year)
+                if ref_year in new_ref_years or lags is None:
+                    tables.append(feat_eng_target(yields, ref_year=ref_year, lag=self.state["lag"]).assign(ref_year=ref_year))
+                elif locs:
+                    table = feat_eng_target(yields[yields["Field_Location"].isin(locs)], ref_year=ref_year, lag=self.state["lag"])
+                    tables.append(table.assign(ref_year=ref_year))
+            new = pd.concat(tables).reset_index()
+            if lags is not None:
+                recomputed = pd.MultiIndex.from_frame(new[["ref_year", "Field_Location"]])
+                lags = lags[~pd.MultiIndex.from_frame(lags[["ref_year", "Field_Location"]]).isin(recomputed)]
+                new = pd.concat([lags, new[lags.columns]], ignore_index=True)
+            else:
+                new = new[["ref_year", *[c for c in new.columns if c != "ref_year"]]]
+            self._write("lags", new.sort_values(["ref_year", "Field_Location"], kind="stable"))
+        report["lags"] = sorted(pairs)
+        report["ref_years"] = new_ref_years
+
+        if weather is not None:
+            envs, digests = self.changed("weather", weather)
+            if envs:
+                features = feat_eng_weather(weather[weather["Env"].isin(envs)].copy()).reset_index()
+                old = self._read("weather")
+                table = self._replace_rows("weather", features, envs)
+                order = [c for c in [*([] if old is None else old.columns), *features.columns] if c != "Env"]
+                columns = weather_columns([c for c in table.columns if c != "Env"], order)
+                self._write("weather", table[["Env", *columns]].sort_values("Env", kind="stable"))
+            report["weather"] = envs
+            self.state["digests"]["weather"].update(digests)
+
+        if soil is not None:
+            envs, digests = self.changed("soil", soil)
+            if envs:
+                features = feat_eng_soil(soil[soil["Env"].isin(envs)]).reset_index()
+                self._write("soil", self._replace_rows("soil", features, envs).sort_values("Env", kind="stable"))
+            report["soil"] = envs
+            self.state["digests"]["soil"].update(digests)
+
+        self.save()
+        return report
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs of the whole pipeline, at any scale, for load testing without the real data.
+
+Writes ``Training_Data`` and ``Testing_Data`` folders with the files and columns the scripts
+read (trait, meta, soil, daily weather and EC data, ``All_hybrid_names_info.csv``, the
+submission template and the genotype VCF), and the additive and dominance kinships
+``kinship.R`` would compute from it. Environments are field locations x years 2014 to 2022
+(``NYS1`` always exists, ``create_folds`` expects it); hybrids are crosses of two parent
+pools, and their yields add Env means, parent effects, a low-rank GxE term and plot noise.
+Genotypes are those of inbred parents, so the VCF and the kinships agree: the kinships are
+computed from the first ``kinship_snps`` markers. Everything is drawn from ``--seed`` and
+written in chunks, so the VCF and the kinships can be larger than memory.
+
+Sizes are presets of ``Scale`` (``small`` for quick runs, ``real`` for about the size of the
+competition data, ``large`` for 10x its Envs, 20k hybrids and 500k SNPs); any field can be
+overridden.
+
+Example:
+    python3 -u synthetic_data.py --size small --output_dir data_synthetic --seed 1
+    python3 -u synthetic_data.py --size large --snps 100000 --output_dir /scratch/data_large
+    python3 run_local.py --data data_synthetic/Training_Data --work_dir output_synthetic
+"""
+import argparse
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+TRAINING_YEARS = range(2014, 2022)
+TEST_YEAR = 2022
+STATES = ["IA", "NE", "IL", "IN", "WI", "MN", "MI", "NY", "TX", "DE", "GA", "NC", "SC", "CO", "KS", "MO", "OH", "AR", "ON", "GE"]
+WEATHER_COLUMNS = [
+    "QV2M", "T2MDEW", "PS", "RH2M", "WS2M", "GWETTOP", "ALLSKY_SFC_SW_DWN", "ALLSKY_SFC_PAR_TOT", "T2M_MAX",
+    "T2M_MIN", "T2MWET", "GWETROOT", "T2M", "GWETPROF", "ALLSKY_SFC_SW_DNI", "PRECTOTCORR",
+]
+SOIL_COLUMNS = [
+    "1:1 Soil pH", "WDRF Buffer pH", "1:1 S Salts mmho/cm", "Organic Matter LOI %", "Nitrate-N ppm N", "lbs N/A",
+    "Potassium ppm K", "Sulfate-S ppm S", "Calcium ppm Ca", "Magnesium ppm Mg", "Sodium ppm Na",
+    "CEC/Sum of Cations me/100g", "%H Sat", "%K Sat", "%Ca Sat", "%Mg Sat", "%Na Sat", "Mehlich P-III ppm P",
+    "% Sand", "% Silt", "% Clay",
+]
+EC_VARIABLES = ["HI30", "PH", "SDR", "FLN", "AccPAR", "ETP", "RUE", "Tmax", "Tmin", "TT", "PR", "ET", "Nstress", "Wstress"]
+EC_STAGES = ["pGerEme", "pEmeEnJ", "pEnJFlo", "pFloFla", "pFlaFlw", "pFlwStG", "pStGEnG", "pEnGMat", "pMatHar"]
+VCF_CHUNK = 256  # markers per write
+
+
+class Scale(NamedTuple):
+    locations: int  # field locations, each in most years
+    hybrids: int
+    parents: int  # per parent pool
+    hybrids_per_env: int
+    replicates: int
+    snps: int  # markers of the VCF (0: no VCF)
+    kinship_snps: int  # leading markers the kinships are computed from
+    ec_columns: int
+
+
+SIZES = {
+    "tiny": Scale(locations=8, hybrids=300, parents=20, hybrids_per_env=40, replicates=2, snps=500, kinship_snps=500, ec_columns=40),
+    "small": Scale(locations=20, hybrids=1500, parents=60, hybrids_per_env=150, replicates=2, snps=5000, kinship_snps=2000, ec_columns=120),
+    "real": Scale(locations=45, hybrids=5000, parents=300, hybrids_per_env=400, replicates=2, snps=20000, kinship_snps=5000, ec_columns=765),
+    "large": Scale(locations=450, hybrids=20000, parents=1000, hybrids_per_env=400, replicates=2, snps=500000, kinship_snps=5000, ec_columns=765),
+}
+
+
+def location_names(n: int):
+    names = ["NYS1"] + [f"{STATES[i % len(STATES)]}H{i // len(STATES) + 1}" for i in range(n - 1)]
+    return names[:max(n, 1)]
+
+
+def environments(rng: np.random.Generator, scale: Scale):
+    """Env, Year and Field_Location of every trial, and the coordinates of the field locations."""
+    locations = pd.DataFrame({"Field_Location": location_names(scale.locations)})
+    locations["lat"] = rng.uniform(30, 46, len(locations)).round(4)
+    locations["lon"] = rng.uniform(-102, -75, len(locations)).round(4)
+    envs = []
+    for year in [*TRAINING_YEARS, TEST_YEAR]:
+        active = rng.random(len(locations)) < 0.8
+        active[0] |= year >= 2019  # NYS1 is in the CV0 training and validation years
+        envs.append(locations[active].assign(Year=year))
+    envs = pd.concat(envs, ignore_index=True)
+    envs.insert(0, "Env", envs["Field_Location"] + "_" + envs["Year"].astype(str))
+    return envs
+
+
+def hybrid_names(rng: np.random.Generator, scale: Scale):
+    """Hybrids as crosses of a parent of each pool, with the parent of each side."""
+    n_pairs = scale.parents * scale.parents
+    if scale.hybrids > n_pairs:
+        raise Exception(f"{scale.parents} parents per pool give at most {n_pairs} hybrids.")
+    pairs = rng.choice(n_pairs, scale.hybrids, replace=False)
+    p1, p2 = pairs // scale.parents, pairs % scale.parents
+    names = [f"PA{a:05d}/PB{b:05d}" for a, b in zip(p1, p2)]
+    return pd.DataFrame({"Hybrid": names, "p1": p1, "p2": p2})
+
+
+def trait_data(rng: np.random.Generator, scale: Scale, envs: pd.DataFrame, hybrids: pd.DataFrame):
+    """Plot records of the training Envs, and the (Env, Hybrid) pairs of the test Envs."""
+    gca1 = rng.normal(0, 0.6, scale.parents)
+    gca2 = rng.normal(0, 0.6, scale.parents)
+    sensitivity = rng.normal(0, 0.3, len(hybrids))  # hybrid response to the Env GxE covariate
+    env_mean = rng.normal(10.5, 2.0, len(envs)).clip(3, None)
+    env_cov = rng.normal(0, 1, len(envs))
+
+    # hybrids tested each year: a pool of the hybrids, trials sample from it
+    per_env = min(scale.hybrids_per_env, len(hybrids))
+    pools = {year: rng.choice(len(hybrids), max(per_env, len(hybrids) // 2), replace=False) for year in envs["Year"].unique()}
+    env_rows, hybrid_rows = [], []
+    for i, year in enumerate(envs["Year"]):
+        env_rows.append(np.full(per_env, i))
+        hybrid_rows.append(rng.choice(pools[year], per_env, replace=False))
+    env_rows, hybrid_rows = np.concatenate(env_rows), np.concatenate(hybrid_rows)
+
+    test = envs["Year"].to_numpy()[env_rows] == TEST_YEAR
+    template = pd.DataFrame({
+        "Env": envs["Env"].to_numpy()[env_rows[test]],
+        "Hybrid": hybrids["Hybrid"].to_numpy()[hybrid_rows[test]],
+        "Yield_Mg_ha": np.nan,
+    })
+    env_rows, hybrid_rows = np.repeat(env_rows[~test], scale.replicates), np.repeat(hybrid_rows[~test], scale.replicates)
+    n = len(env_rows)
+
+    p1, p2 = hybrids["p1"].to_numpy()[hybrid_rows], hybrids["p2"].to_numpy()[hybrid_rows]
+    y = (
+        env_mean[env_rows]
+        + gca1[p1] + gca2[p2]
+        + sensitivity[hybrid_rows] * env_cov[env_rows]
+        + rng.normal(0, 0.8, n)
+    ).clip(0.1, None)
+    y[rng.random(n) < 0.03] = np.nan  # discarded plots
+    years = envs["Year"].to_numpy()[env_rows]
+    planted = pd.to_datetime(years.astype(str) + "-05-01") + pd.to_timedelta(rng.integers(0, 30, n), unit="D")
+    trait = pd.DataFrame({
+        "Env": envs["Env"].to_numpy()[env_rows],
+        "Year": years,
+        "Field_Location": envs["Field_Location"].to_numpy()[env_rows],
+        "Experiment": "G2FE",
+        "Replicate": np.tile(np.arange(1, scale.replicates + 1), n // scale.replicates),
+        "Block": np.tile(np.arange(1, scale.replicates + 1), n // scale.replicates),
+        "Plot": np.arange(n) % 10000 + 1,
+        "Range": rng.integers(1, 40, n),
+        "Pass": rng.integers(1, 30, n),
+        "Hybrid": hybrids["Hybrid"].to_numpy()[hybrid_rows],
+        "Hybrid_orig_name": hybrids["Hybrid"].to_numpy()[hybrid_rows],
+        "Hybrid_Parent1": np.char.add("PA", np.char.zfill(p1.astype(str), 5)),
+        "Hybrid_Parent2": np.char.add("PB", np.char.zfill(p2.astype(str), 5)),
+        "Plot_Area_ha": 0.00045,
+        "Date_Planted": planted.strftime("%m/%d/%y"),
+        "Date_Harvested": (planted + pd.to_timedelta(rng.integers(130, 170, n), unit="D")).strftime("%m/%d/%y"),
+        "Stand_Count_plants": rng.integers(40, 80, n),
+        "Pollen_DAP_days": rng.integers(55, 80, n),
+        "Silk_DAP_days": rng.integers(56, 82, n),
+        "Plant_Height_cm": rng.normal(250, 25, n).round(1),
+        "Ear_Height_cm": rng.normal(110, 15, n).round(1),
+        "Root_Lodging_plants": rng.poisson(0.5, n),
+        "Stalk_Lodging_plants": rng.poisson(1.0, n),
+        "Yield_Mg_ha": y.round(4),
+        "Grain_Moisture": rng.normal(20, 3, n).round(1),
+        "Twt_kg_m3": rng.normal(720, 30, n).round(1),
+    })
+    return trait, template
+
+
+def meta_data(rng: np.random.Generator, envs: pd.DataFrame):
+    envs = envs.reset_index(drop=True)
+    n = len(envs)
+    return pd.DataFrame({
+        "Year": envs["Year"],
+        "Env": envs["Env"],
+        "Experiment_Code": "G2FE",
+        "Treatment": np.where(rng.random(n) < 0.9, "Standard", "Late planting"),
+        "City": " " + envs["Field_Location"] + " City ",  # process_metadata strips the City
+        "Farm": envs["Field_Location"] + " Farm",
+        "Field": "Field " + pd.Series(rng.integers(1, 9, n)).astype(str),
+        "Weather_Station_Serial_Number (Last four digits, e.g. m2700s#####)": rng.integers(1000, 9999, n),
+        "Weather_Station_Latitude (in decimal numbers NOT DMS)": (envs["lat"] + rng.normal(0, 0.01, n)).round(5),
+        "Weather_Station_Longitude (in decimal numbers NOT DMS)": (envs["lon"] + rng.normal(0, 0.01, n)).round(5),
+        "Previous_Crop": rng.choice(["soybean", "corn", "wheat"], n),
+        "Pre-plant_tillage_method(s)": rng.choice(["Conventional", "No-till", "Chisel"], n),
+        "Comments": "",
+    })
+
+
+def soil_data(rng: np.random.Generator, envs: pd.DataFrame):
+    """One or two samples of the Envs from 2015 on, some Envs without soil data."""
+    envs = envs[(envs["Year"] >= 2015) & (rng.random(len(envs)) < 0.9)]
+    rows = np.repeat(np.arange(len(envs)), rng.integers(1, 3, len(envs)))
+    n = len(rows)
+    df = pd.DataFrame({
+        "Year": envs["Year"].to_numpy()[rows],
+        "Env": envs["Env"].to_numpy()[rows],
+        "LabID": rng.integers(10000, 99999, n),
+        "E Depth": 8,
+    })
+    scales = rng.uniform(1, 100, len(SOIL_COLUMNS))
+    for col, s in zip(SOIL_COLUMNS, scales):
+        df[col] = np.abs(rng.normal(s, s / 4, n)).round(2)
+    df["Texture"] = rng.choice(["Loam", "Silt Loam", "Clay Loam", "Sandy Loam"], n)
+    return df
+
+
+def weather_data(rng: np.random.Generator, envs: pd.DataFrame):
+    """Daily weather of every Env over its calendar year, seasonal with the latitude."""
+    frames = []
+    for env, year, lat in zip(envs["Env"], envs["Year"], envs["lat"]):
+        dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D")
+        day = np.arange(len(dates))
+        season = -np.cos(2 * np.pi * (day - 15) / 365.25)
+        t2m = 12 - (lat - 38) * 0.6 + 14 * season + rng.normal(0, 3, len(day))
+        df = pd.DataFrame({"Env": env, "Date": dates.strftime("%Y%m%d").astype(int)})
+        df["QV2M"] = (6 + 5 * season + rng.normal(0, 1, len(day))).clip(0.5)
+        df["T2MDEW"] = t2m - rng.uniform(2, 8, len(day))
+        df["PS"] = rng.normal(98, 1, len(day))
+        df["RH2M"] = rng.uniform(40, 100, len(day))
+        df["WS2M"] = rng.gamma(3, 1, len(day))
+        df["GWETTOP"] = rng.uniform(0.2, 0.9, len(day))
+        df["ALLSKY_SFC_SW_DWN"] = (16 + 9 * season + rng.normal(0, 3, len(day))).clip(0.5)
+        df["ALLSKY_SFC_PAR_TOT"] = df["ALLSKY_SFC_SW_DWN"] * rng.uniform(1.8, 2.2, len(day))
+        df["T2M_MAX"] = t2m + rng.uniform(4, 9, len(day))
+        df["T2M_MIN"] = t2m - rng.uniform(4, 9, len(day))
+        df["T2MWET"] = t2m - rng.uniform(0, 3, len(day))
+        df["GWETROOT"] = rng.uniform(0.3, 0.9, len(day))
+        df["T2M"] = t2m
+        df["GWETPROF"] = rng.uniform(0.3, 0.9, len(day))
+        df["ALLSKY_SFC_SW_DNI"] = rng.uniform(0, 30, len(day))
+        df["PRECTOTCORR"] = rng.exponential(2.5, len(day)) * (rng.random(len(day)) < 0.4)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True).round(3)[["Env", "Date", *WEATHER_COLUMNS]]
+
+
+def ec_data(rng: np.random.Generator, envs: pd.DataFrame, n_columns: int):
+    """Environmental covariates of most Envs, from a few latent weather factors."""
+    envs = envs[rng.random(len(envs)) < 0.95]
+    names = [f"{v}_{s}" for v in EC_VARIABLES for s in EC_STAGES]
+    names = (names + [f"{n}_{i}" for i in range(n_columns // len(names) + 1) for n in names])[:n_columns]
+    latent = rng.normal(0, 1, (len(envs), 8))
+    values = latent @ rng.normal(0, 1, (8, n_columns)) + rng.normal(0, 0.3, (len(envs), n_columns))
+    df = pd.DataFrame(values.round(4), columns=names)
+    df.insert(0, "Env", envs["Env"].to_numpy())
+    return df
+
+
+def hybrid_info(rng: np.random.Generator, hybrids: pd.DataFrame):
+    """``All_hybrid_names_info.csv``: about 95% of the hybrids are genotyped (in the VCF)."""
+    return pd.DataFrame({
+        "Hybrid": hybrids["Hybrid"],
+        "Hybrid_Parent1": "PA" + hybrids["p1"].astype(str).str.zfill(5),
+        "Hybrid_Parent2": "PB" + hybrids["p2"].astype(str).str.zfill(5),
+        "vcf": rng.random(len(hybrids)) < 0.95,
+    })
+
+
+def write_vcf(path: Path, seed: int, scale: Scale, hybrids: pd.DataFrame):
+    """
+    Genotypes of the hybrids (crosses of inbred parents, allele frequencies of a U-shaped beta),
+    written ``VCF_CHUNK`` markers at a time. Returns the alternate allele dosages of the first
+    ``kinship_snps`` markers.
+    """
+    n_chrom = 10
+    n = len(hybrids)
+    p1, p2 = hybrids["p1"].to_numpy(), hybrids["p2"].to_numpy()
+    kept = []
+    with open(path, "wb") as f:
+        f.write(b"##fileformat=VCFv4.2\n##source=synthetic_data.py\n")
+        for chrom in range(1, n_chrom + 1):
+            f.write(f"##contig=<ID={chrom}>\n".encode())
+        f.write(b'##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        f.write(("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", *hybrids["Hybrid"]]) + "\n").encode())
+
+        per_chrom = -(-scale.snps // n_chrom)
+        for start in range(0, scale.snps, VCF_CHUNK):
+            rng = np.random.default_rng([seed, 5, start])
+            m = min(VCF_CHUNK, scale.snps - start)
+            freq = rng.beta(0.5, 0.5, m).clip(0.02, 0.98)
+            a1 = (rng.random((scale.parents, m)) < freq).astype(np.uint8)  # parents of each pool are inbred
+            a2 = (rng.random((scale.parents, m)) < freq).astype(np.uint8)
+            g1, g2 = a1[p1], a2[p2]  # hybrids x markers
+            if start < scale.kinship_snps:
+                kept.append((g1 + g2)[:, :scale.kinship_snps - start].astype(np.int8))
+
+            body = np.empty((m, n, 4), dtype=np.uint8)
+            body[:, :, 0] = g1.T + ord("0")
+            body[:, :, 1] = ord("/")
+            body[:, :, 2] = g2.T + ord("0")
+            body[:, :, 3] = ord("\t")
+            body[:, -1, 3] = ord("\n")
+            ref = rng.integers(0, 4, m)
+            alt = (ref + rng.integers(1, 4, m)) % 4
+            for j in range(m):
+                snp = start + j
+                chrom, pos = snp // per_chrom + 1, (snp % per_chrom) * 1000 + 1
+                prefix = f"{chrom}\t{pos}\tS{chrom}_{pos}\t{'ACGT'[ref[j]]}\t{'ACGT'[alt[j]]}\t.\tPASS\t.\tGT\t"
+                f.write(prefix.encode())
+                f.write(body[j].tobytes())
+    return np.hstack(kept) if kept else np.zeros((n, 0), dtype=np.int8)
+
+
+def write_kinships(output_dir: Path, names: list, dosages: np.ndarray, chunk_rows: int = 1000):
+    """Additive (VanRaden) and dominance (Vitezica) kinships in the layout of ``kinship.R``."""
+    X = dosages.astype(np.float32)
+    p = X.mean(axis=0) / 2
+    q = 1 - p
+    Z = X - 2 * p
+    W = np.where(X == 2, -2 * q ** 2, np.where(X == 1, 2 * p * q, -2 * p ** 2)).astype(np.float32)
+    header = "\t".join(f"{x}_{x}" for x in names)  # plink --double-id names, as read_kinship expects
+    for kinship, M, denominator in (
+        ("additive", Z, 2 * np.sum(p * q)),
+        ("dominant", W, np.sum((2 * p * q) ** 2)),
+    ):
+        path = output_dir / f"kinship_{kinship}.txt"
+        with open(path, "w") as f:
+            f.write(header + "\n")
+            for start in range(0, len(M), chunk_rows):
+                block = M[start:start + chunk_rows] @ M.T / denominator
+                np.savetxt(f, block, delimiter="\t", fmt="%.6f")
+        print("Writing:", path)
+
+
+def generate(output_dir: Path, scale: Scale, seed: int = 1):
+    output_dir = Path(output_dir)
+    train_dir, test_dir = output_dir / "Training_Data", output_dir / "Testing_Data"
+    train_dir.mkdir(parents=True, exist_ok=True)
+    test_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    envs = environments(rng, scale)
+    hybrids = hybrid_names(rng, scale)
+    trait, template = trait_data(rng, scale, envs, hybrids)
+    info = hybrid_info(rng, hybrids)
+    is_test = envs["Year"] == TEST_YEAR
+    print(f"{(~is_test).sum()} training Envs, {is_test.sum()} test Envs, {len(hybrids)} hybrids, {len(trait)} plots")
+
+    files = {
+        train_dir / "1_Training_Trait_Data_2014_2021.csv": trait,
+        test_dir / "1_Submission_Template_2022.csv": template,
+        train_dir / "2_Training_Meta_Data_2014_2021.csv": meta_data(rng, envs[~is_test]),
+        test_dir / "2_Testing_Meta_Data_2022.csv": meta_data(rng, envs[is_test]),
+        train_dir / "3_Training_Soil_Data_2015_2021.csv": soil_data(rng, envs[~is_test]),
+        test_dir / "3_Testing_Soil_Data_2022.csv": soil_data(rng, envs[is_test]),
+        train_dir / "4_Training_Weather_Data_2014_2021.csv": weather_data(rng, envs[~is_test]),
+        test_dir / "4_Testing_Weather_Data_2022.csv": weather_data(rng, envs[is_test]),
+        train_dir / "6_Training_EC_Data_2014_2021.csv": ec_data(rng, envs[~is_test], scale.ec_columns),
+        test_dir / "6_Testing_EC_Data_2022.csv": ec_data(rng, envs[is_test], scale.ec_columns),
+        train_dir / "All_hybrid_names_info.csv": info,
+    }
+    for path, df in files.items():
+        print("Writing:", path)
+        df.to_csv(path, index=False)
+
+    genotyped = hybrids[info["vcf"].to_numpy()].reset_index(drop=True)
+    if scale.snps > 0:
+        path = train_dir / "5_Genotype_Data_All_2014_2025_Hybrids.vcf"
+        print("Writing:", path)
+        dosages = write_vcf(path, seed, scale, genotyped)
+        write_kinships(output_dir, genotyped["Hybrid"].tolist(), dosages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", choices=list(SIZES), default="small", help="preset of the fields below")
+    parser.add_argument("--output_dir", type=Path, required=True)
+    parser.add_argument("--seed", type=int, default=1)
+    for field in Scale._fields:
+        parser.add_argument(f"--{field}", type=int, default=None)
+    args = parser.parse_args()
+
+    scale = SIZES[args.size]._replace(**{k: getattr(args, k) for k in Scale._fields if getattr(args, k) is not None})
+    print(scale)
+    generate(args.output_dir, scale, args.seed)
@@ -16,7 +16,33 @@ def test_python_compilation():
         'src/preprocessing.py',
         'src/evaluate.py',
         'src/create_datasets.py',
-        'src/create_individuals.py'
+        'src/create_individuals.py',
+        'src/assembly.py',
+        'src/lgbm_dataset.py',
+        'src/scheduler.py',
+        'src/tune.py',
+        'src/results.py',
+        'src/importance.py',
+        'src/blues.py',
+        'src/gblup.py',
+        'src/kernel_gxe.py',
+        'src/registry.py',
+        'src/predict.py',
+        'src/ensemble.py',
+        'src/synthetic_data.py',
+        'src/benchmark.py',
+        'src/instrument.py',
+        'src/worker.py',
+        'src/prefetch.py',
+        'src/weather_windows.py',
+        'src/season_store.py',
+        'src/ingest.py',
+        'src/kronecker.py',
+        'src/low_rank.py',
+        'run_local.py',
+        'artifacts.py',
+        'memory_report.py',
+        'workflow.py'
     ]
     
     print("=== Testing Python Compilation ===")
@@ -70,6 +96,362 @@ def test_r_structure():
     
     return all_passed
 
+def test_blues_reml():
+    """Test the BLUEs and residual variances of blues.py against a dense REML fit"""
+    import numpy as np
+    import pandas as pd
+    from scipy.optimize import minimize_scalar
+
+    sys.path.insert(0, 'src')
+    import blues
+
+    print("\n=== Testing BLUEs REML ===")
+    rng = np.random.default_rng(0)
+
+    def dense_reml(hybrid, replicate, y):
+        X = pd.get_dummies(hybrid).to_numpy(dtype=np.float64)
+        Z = pd.get_dummies(replicate).to_numpy(dtype=np.float64)
+        n, p = X.shape
+
+        def solve(log_ratio):
+            Hinv = np.linalg.inv(np.eye(n) + np.exp(log_ratio) * Z @ Z.T)
+            xhx = X.T @ Hinv @ X
+            beta = np.linalg.solve(xhx, X.T @ Hinv @ y)
+            sigma2 = (y - X @ beta) @ Hinv @ (y - X @ beta) / (n - p)
+            return beta, sigma2, (n - p) * np.log(sigma2) - np.linalg.slogdet(Hinv)[1] + np.linalg.slogdet(xhx)[1]
+
+        best = minimize_scalar(lambda t: solve(t)[2], bounds=blues.LOG_RATIO_BOUNDS, method='bounded',
+                               options={'xatol': 1e-8})
+        return solve(best.x)[:2]
+
+    # one balanced Env (closed form) and one with missing plots (REML)
+    df = pd.DataFrame(
+        [(env, f'H{h}', str(r)) for env in ('A_2020', 'B_2020') for h in range(8) for r in range(3)],
+        columns=['Env', 'Hybrid', 'Replicate'],
+    )
+    df['Yield_Mg_ha'] = (
+        df['Hybrid'].str[1:].astype(int) * 0.3 + df['Replicate'].astype(int) * 0.8 + rng.normal(size=len(df))
+    )
+    df = df.drop(index=df.index[(df['Env'] == 'B_2020').to_numpy() & (rng.random(len(df)) < 0.25)])
+    df = df.astype({'Env': 'category', 'Hybrid': 'category', 'Replicate': 'category'})
+
+    passed = True
+    balanced, stats = blues.balanced_blues(df[df['Env'] == 'A_2020'])
+    a = df[df['Env'] == 'A_2020']
+    beta, sigma2 = dense_reml(a['Hybrid'].astype(str), a['Replicate'].astype(str), a['Yield_Mg_ha'].to_numpy())
+    passed &= np.allclose(balanced['predicted.value'], beta) and np.isclose(stats['sigma2'].iloc[0], sigma2, rtol=1e-5)
+    b = df[df['Env'] == 'B_2020']
+    _, _, beta_b, sigma2_b = blues.reml_fit(
+        'B_2020', b['Hybrid'].to_numpy(dtype=str), b['Replicate'].to_numpy(dtype=str), b['Yield_Mg_ha'].to_numpy()
+    )
+    beta, sigma2 = dense_reml(b['Hybrid'].astype(str), b['Replicate'].astype(str), b['Yield_Mg_ha'].to_numpy())
+    passed &= np.allclose(beta_b, beta, atol=1e-5) and np.isclose(sigma2_b, sigma2, rtol=1e-5)
+    print(f"{'✓' if passed else '✗'} balanced and unbalanced BLUEs and residual variances")
+    assert passed
+
+def test_gblup_reml():
+    """Test the spectral REML of gblup.py against a dense REML fit"""
+    import numpy as np
+    from scipy.optimize import minimize_scalar
+
+    sys.path.insert(0, 'src')
+    import gblup
+
+    print("\n=== Testing Spectral GBLUP REML ===")
+    rng = np.random.default_rng(0)
+    M = rng.normal(size=(40, 60))
+    counts = rng.integers(1, 6, 40)
+    w = np.sqrt(counts)
+    K = M @ M.T / 60 * np.outer(w, w)  # kinship scaled by the record counts, as gblup.fit decomposes it
+    y = w * (1.5 + M[:, 0] + rng.normal(size=40) / w)
+    values, vectors = np.linalg.eigh(K)
+    mu, var_g, delta, r = gblup.reml(np.clip(values, 0, None), vectors.T @ y, vectors.T @ w)
+
+    def solve(log_delta):
+        V = K + np.exp(log_delta) * np.eye(40)
+        Vinv_x, Vinv_y = np.linalg.solve(V, w), np.linalg.solve(V, y)
+        mu_d = (w @ Vinv_y) / (w @ Vinv_x)
+        resid = np.linalg.solve(V, y - w * mu_d)
+        var_d = (y - w * mu_d) @ resid / 39
+        return mu_d, var_d, resid, 39 * np.log(var_d) + np.linalg.slogdet(V)[1] + np.log(w @ Vinv_x)
+
+    best = minimize_scalar(lambda t: solve(t)[-1], bounds=gblup.LOG_DELTA_BOUNDS, method='bounded',
+                           options={'xatol': 1e-8})
+    mu_d, var_d, resid, _ = solve(best.x)
+    passed = (
+        np.isclose(mu, mu_d, rtol=1e-4) and np.isclose(var_g, var_d, rtol=1e-4)
+        and np.isclose(np.log(delta), best.x, atol=1e-3) and np.allclose(vectors @ r, resid, atol=1e-4)
+    )
+    print(f"{'✓' if passed else '✗'} mu={mu:.4f} ({mu_d:.4f}), var_g={var_g:.4f} ({var_d:.4f}), "
+          f"delta={delta:.4f} ({np.exp(best.x):.4f})")
+    assert passed
+
+def test_kernel_gxe_fit():
+    """Test the conjugate-gradient fit of kernel_gxe.py against a direct solve of the ridge system"""
+    import numpy as np
+
+    sys.path.insert(0, 'src')
+    import kernel_gxe
+
+    print("\n=== Testing Kernel GxE Ridge ===")
+    rng = np.random.default_rng(0)
+    phi_e, phi_g = rng.normal(size=(6, 3)), rng.normal(size=(15, 4))
+    # a sparse set of observed pairs, some of them repeated
+    env, hybrid = rng.integers(0, 6, 50), rng.integers(0, 15, 50)
+    y = 2 + rng.normal(size=50)
+    model = kernel_gxe.fit(phi_e, phi_g, env, hybrid, y, rtol=1e-10)
+
+    features = np.einsum('na,nb->nab', phi_g[hybrid], phi_e[env]).reshape(len(y), -1)
+    ystd = (y - y.mean()) / y.std()
+    w = np.linalg.solve(features.T @ features + kernel_gxe.RIDGE * np.eye(features.shape[1]), features.T @ ystd)
+    fitted = y.mean() + y.std() * features @ w
+    passed = np.allclose(model.W.ravel(), w, atol=1e-6) and np.allclose(model.predict(env, hybrid), fitted, atol=1e-6)
+    print(f"{'✓' if passed else '✗'} max |W - direct| = {np.abs(model.W.ravel() - w).max():.2e}")
+    assert passed
+
+def test_ensemble_mean():
+    """Test the streaming ensemble of ensemble.py and predict.py against a pandas groupby"""
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    sys.path.insert(0, 'src')
+    import ensemble
+    import predict
+
+    print("\n=== Testing Ensemble Mean ===")
+    rng = np.random.default_rng(0)
+    # predictions of two models over four seeds and folds, each file with repeated, overlapping and new pairs
+    rows = pd.DataFrame({
+        'file': np.repeat(np.arange(4), 30),
+        'model': rng.choice(['E', 'G'], 120),
+        'Env': [f'ENV{rng.integers(0, 3 + i // 30)}_2020' for i in range(120)],
+        'Hybrid': rng.choice([f'H{h}' for h in range(4)], 120),
+        'ypred': rng.normal(size=120),
+    })
+    rows['ytrue'] = rows.groupby(['Env', 'Hybrid'])['ypred'].transform('size').astype(float)  # one target per pair
+
+    reducer = ensemble.Reducer()
+    for (_, model), part in rows.groupby(['file', 'model']):
+        reducer.add(('pred', model, 'none', 0),
+                    pa.Table.from_pandas(part[['Env', 'Hybrid', 'ytrue', 'ypred']], preserve_index=False))
+    got = reducer.frame().set_index(['model', 'Env', 'Hybrid']).sort_index()
+    expected = rows.groupby(['model', 'Env', 'Hybrid']).agg(
+        n=('ypred', 'size'), ytrue=('ytrue', 'mean'), ypred=('ypred', 'mean'), ypred_var=('ypred', 'var'),
+    )
+    passed = (
+        list(got.index) == list(expected.index)
+        and np.array_equal(got['n'], expected['n'])
+        and np.allclose(got[['ytrue', 'ypred']], expected[['ytrue', 'ypred']])
+        and np.allclose(got['ypred_var'], expected['ypred_var'], equal_nan=True)
+    )
+    print(f"{'✓' if passed else '✗'} Reducer: {len(got)} pairs from {len(rows)} predictions")
+
+    # predict.Ensemble: template rows scored by some of the models, the last row by none
+    scored = pd.DataFrame({
+        'row': np.concatenate([rng.choice(10, 6, replace=False) for _ in range(5)]),
+        'ypred': rng.normal(size=30),
+    })
+    mean = predict.Ensemble(11)
+    for _, model in scored.groupby(np.arange(30) // 6):
+        mean.add(model['row'].to_numpy(), model['ypred'].to_numpy())
+    expected = scored.groupby('row')['ypred'].mean().reindex(range(11))
+    ok = np.allclose(mean.mean(), expected, equal_nan=True)
+    print(f"{'✓' if ok else '✗'} Ensemble: mean of 5 models over 11 template rows")
+    assert passed and ok
+
+def test_kronecker_column_names():
+    """Test that kronecker.py names its columns as kronecker.R does"""
+    import shutil
+    import tempfile
+    from pathlib import Path
+
+    import numpy as np
+    import pandas as pd
+    import pyarrow.feather as feather
+
+    sys.path.insert(0, 'src')
+    import kronecker
+
+    print("\n=== Testing Kronecker Column Names ===")
+    x = pd.DataFrame([[1.0, 2.0]], index=['DEH1_2020'], columns=['T2M_max_fall', '1st'])
+    hybrids = ['PA00015/PB00017', 'B73:Mo17', 'B73/Mo17']
+    # names of data.frame(id = rownames(K), kronecker(x, K, make.dimnames = TRUE)) in R
+    expected = [
+        'T2M_max_fall.PA00015.PB00017', 'T2M_max_fall.B73.Mo17', 'T2M_max_fall.B73.Mo17.1',
+        'X1st.PA00015.PB00017', 'X1st.B73.Mo17', 'X1st.B73.Mo17.1',
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        outfile = Path(tmp) / 'cv0_kronecker_additive.arrow'
+        kronecker.write(outfile, x, hybrids, np.eye(3), [('DEH1_2020', np.arange(3))])
+        columns = feather.read_table(outfile).column_names[1:]
+        if shutil.which('Rscript'):
+            script = (
+                'x <- matrix(c(1, 2), 1, dimnames = list("DEH1_2020", c("T2M_max_fall", "1st")));'
+                f'h <- c({", ".join(repr(h) for h in hybrids)});'
+                'K <- kronecker(x, diag(3, dimnames = list(h, h)), make.dimnames = TRUE);'
+                'cat(names(data.frame(id = rownames(K), K))[-1], sep = "\\n")'
+            )
+            expected = subprocess.run(['Rscript', '-e', script], check=True, capture_output=True, text=True).stdout.split()
+    passed = columns == expected
+    print(f"{'✓' if passed else '✗'} kronecker.py columns {columns} - R columns {expected}")
+    assert passed
+
+def test_fold_bins():
+    """Test that a fold's Dataset is binned from its training rows alone"""
+    import tempfile
+
+    import numpy as np
+    import lightgbm as lgbm
+
+    sys.path.insert(0, 'src')
+    from lgbm_dataset import NUM_BOOST_ROUND, model_params, train, train_subsets
+
+    print("\n=== Testing Per-Fold Bins ===")
+    rng = np.random.default_rng(0)
+    Xtrain = rng.normal(size=(500, 4))
+    Xval = rng.normal(3, 2, size=(200, 4))  # shifted, so bins that saw these rows would move
+    ytrain = Xtrain[:, 0] + rng.normal(size=500)
+    names = [f'f{i}' for i in range(4)]
+    params = model_params(1)
+
+    alone = lgbm.train(params, lgbm.Dataset(Xtrain, label=ytrain, feature_name=names), num_boost_round=NUM_BOOST_ROUND)
+    with tempfile.TemporaryDirectory() as tmp:
+        fitted = [train(Xtrain, ytrain, params, names, cache_dir=tmp) for _ in range(2)]  # binned, then loaded
+    X = np.vstack([Xtrain, Xval])
+    shared = next(train_subsets(X, np.concatenate([ytrain, np.zeros(200)]), params, names, [np.arange(500)]))
+
+    trees = alone.trees_to_dataframe()
+    passed = all(model.trees_to_dataframe().equals(trees) for model in fitted)
+    print(f"{'✓' if passed else '✗'} fold trees are those of a Dataset of the training rows alone")
+    assert passed
+    leaked = not shared.trees_to_dataframe().equals(trees)
+    print(f"{'✓' if leaked else '✗'} bins of the union of training and validation rows are told apart")
+    assert leaked
+
+def test_compressed_trees():
+    """Test that the E-model fit on distinct rows grows the trees of the fit on all rows"""
+    import numpy as np
+
+    sys.path.insert(0, 'src')
+    from lgbm_dataset import model_params, train, train_compressed
+
+    print("\n=== Testing Row-Compressed Trees ===")
+    rng = np.random.default_rng(0)
+    counts = rng.integers(5, 80, 60)  # rows of every Env
+    envs = rng.normal(size=(60, 6))
+    envs[:, 5] = rng.integers(0, 3, 60)  # categorical, split one-vs-rest
+    envs[rng.random(60) < 0.1, 2] = np.nan
+    X = np.repeat(envs, counts, axis=0)
+    y = np.repeat(3 * rng.normal(size=60), counts) + X[:, 0] + rng.normal(size=len(X))
+    names = [f'f{i}' for i in range(6)]
+    params = model_params(1)
+
+    full = train(X, y, params, feature_name=names, categorical_feature=['f5'])
+    compressed, _ = train_compressed(X, y, params, feature_name=names, categorical_feature=['f5'])
+    a, b = full.trees_to_dataframe(), compressed.trees_to_dataframe()
+    splits = ['tree_index', 'node_index', 'split_feature', 'threshold', 'decision_type']
+    passed = (
+        a[splits].equals(b[splits])
+        and np.allclose(a['value'], b['value'], atol=1e-6)
+        and (full.predict(X, pred_leaf=True) == compressed.predict(X, pred_leaf=True)).all()
+    )
+    print(f"{'✓' if passed else '✗'} same splits, leaves and leaf values")
+    assert passed
+
+    envs[:, 5] = rng.integers(0, 10, 60)  # sorted categorical splits count rows
+    try:
+        train_compressed(np.repeat(envs, counts, axis=0), y, params, feature_name=names, categorical_feature=['f5'])
+        refused = False
+    except Exception:
+        refused = True
+    print(f"{'✓' if refused else '✗'} many-level categorical refused")
+    assert refused
+
+    # E design of a fold: Envs of 40 locations x 4 years, per-Env features, Field_Location as 0/1 columns
+    import pandas as pd
+    from lgbm_dataset import frame_to_array, one_hot
+
+    envs = pd.DataFrame(rng.normal(size=(160, 20)), columns=[f'e{i}' for i in range(20)])
+    envs.iloc[rng.random((160, 20)) < 0.05] = np.nan
+    envs['Env'] = [f'L{i % 40:02d}H1_{2018 + i // 40}' for i in range(160)]
+    xtrain = envs.loc[envs.index.repeat(rng.integers(20, 60, 160))].reset_index(drop=True)
+    xtrain['Hybrid'] = [f'H{i}' for i in range(len(xtrain))]
+    xtrain['Field_Location'] = xtrain['Env'].str.replace('(_).*', '', regex=True).astype('category')
+    xtrain = xtrain.set_index(['Env', 'Hybrid'])
+    y = 2 * xtrain['e0'].fillna(0).to_numpy() + xtrain['Field_Location'].cat.codes.to_numpy() % 3 + rng.normal(size=len(xtrain))
+    xtrain, levels = one_hot(xtrain, 'Field_Location')
+    X, categories = frame_to_array(xtrain)
+    names = xtrain.columns.tolist()
+
+    full = train(X, y, params, feature_name=names, categorical_feature=list(categories))
+    compressed, rows = train_compressed(X, y, params, feature_name=names, categorical_feature=list(categories))
+    a, b = full.trees_to_dataframe(), compressed.trees_to_dataframe()
+    passed = (
+        len(levels) == 40 and len(rows.X) == 160
+        and a[splits].equals(b[splits])
+        and np.allclose(a['value'], b['value'], atol=1e-6)
+        and np.allclose(full.predict(X), compressed.predict(rows.X)[rows.inverse], atol=1e-6)
+    )
+    print(f"{'✓' if passed else '✗'} fold of {len(X)} rows, {len(rows.X)} Envs: same trees with 0/1 Field_Location columns")
+    assert passed
+
+def test_registry_round_trip():
+    """Test that predict.py rebuilds the design of a saved G+E model on the test rows"""
+    import tempfile
+    from pathlib import Path
+
+    import numpy as np
+    import pandas as pd
+
+    sys.path.insert(0, 'src')
+    import predict
+    import registry
+    from assembly import g_or_gxe_designs
+    from lgbm_dataset import model_params, train
+
+    print("\n=== Testing Model Registry Round Trip ===")
+    rng = np.random.default_rng(0)
+    hybrids = [f'H{i}' for i in range(20)]
+    G = rng.normal(size=(20, 30))
+    envs = pd.DataFrame({
+        'Env': [f'{loc}_{year}' for loc in ('DEH1', 'IAH2', 'NYH3') for year in (2019, 2020, 2021)],
+        'T2M_max': rng.normal(size=9),
+        'lbs_N_A': rng.normal(size=9),  # soil feature whose name ends like an additive kinship column
+        'percentage_Ca_Sat': rng.normal(size=9),
+    })
+    pairs = envs.merge(pd.DataFrame({'Hybrid': hybrids}), how='cross')
+    pairs['Yield_Mg_ha'] = pairs['lbs_N_A'] + G[pairs['Hybrid'].str[1:].astype(int), 0] + rng.normal(size=len(pairs))
+    val_rows = pairs['Env'].str.endswith('2021').to_numpy()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            K = pd.DataFrame(G @ G.T / 30, columns=[f'{h}_{h}' for h in hybrids])
+            K.to_csv('kinship_additive.txt', sep='\t', index=False)
+            for kind, rows in (('train', ~val_rows), ('val', val_rows)):
+                pairs.loc[rows, ['Env', 'Hybrid', 'Yield_Mg_ha']].to_csv(f'cv0_y{kind}_fold0_seed1.csv', index=False)
+                pairs.loc[rows].drop(columns='Yield_Mg_ha').to_csv(f'cv0_x{kind}_fold0_seed1.csv', index=False)
+            pairs.loc[val_rows].drop(columns='Yield_Mg_ha').to_csv('cv0_xtest_fold0_seed1.csv', index=False)
+
+            xtrain, xval, suffix = g_or_gxe_designs(0, 0, 1, 'G', A=True, E=True)
+            model = train(xtrain.X, xtrain.y, model_params(1, min_data_in_leaf=5), feature_name=xtrain.columns,
+                          categorical_feature=['Field_Location'])
+            registry.save('models', model, 'g', 0, 0, 1, suffix, model='G', inputs=xtrain.columns,
+                          feature_name=xtrain.columns, blocks=xtrain.blocks,
+                          categories={'Field_Location': xtrain.categories})
+            submission = predict.score(Path('models'), pairs.loc[val_rows, ['Env', 'Hybrid']].reset_index(drop=True))
+        finally:
+            os.chdir(cwd)
+
+    expected = pd.Series(model.predict(xval.X), index=xval.index)
+    scored = submission.set_index(['Env', 'Hybrid'])['Yield_Mg_ha']
+    names = [name for name, _, _ in xtrain.blocks]
+    passed = names == ['A', 'E', 'Field_Location'] and np.allclose(scored[expected.index], expected)
+    print(f"{'✓' if passed else '✗'} blocks {names}, test predictions of the saved model")
+    assert passed
+
 def check_migration_completeness():
     """Check if migration is complete"""
     print("\n=== Migration Completeness Check ===")
@@ -110,6 +492,62 @@ def main():
     # Test R structure  
     r_ok = test_r_structure()
     
+    # Test the BLUEs REML
+    try:
+        test_blues_reml()
+        blues_ok = True
+    except AssertionError:
+        blues_ok = False
+
+    # Test the spectral GBLUP REML
+    try:
+        test_gblup_reml()
+        gblup_ok = True
+    except AssertionError:
+        gblup_ok = False
+
+    # Test the kernel GxE ridge
+    try:
+        test_kernel_gxe_fit()
+        kernel_ok = True
+    except AssertionError:
+        kernel_ok = False
+
+    # Test the ensemble mean
+    try:
+        test_ensemble_mean()
+        ensemble_ok = True
+    except AssertionError:
+        ensemble_ok = False
+
+    # Test Kronecker column names
+    try:
+        test_kronecker_column_names()
+        kronecker_ok = True
+    except AssertionError:
+        kronecker_ok = False
+
+    # Test per-fold bins
+    try:
+        test_fold_bins()
+        bins_ok = True
+    except AssertionError:
+        bins_ok = False
+
+    # Test row-compressed trees
+    try:
+        test_compressed_trees()
+        compressed_ok = True
+    except AssertionError:
+        compressed_ok = False
+
+    # Test model registry round trip
+    try:
+        test_registry_round_trip()
+        registry_ok = True
+    except AssertionError:
+        registry_ok = False
+
     # Check migration completeness
     migration_ok = check_migration_completeness()
     
@@ -117,9 +555,17 @@ def main():
     print("SUMMARY:")
     print(f"Python Compilation: {'✓ PASSED' if python_ok else '✗ FAILED'}")
     print(f"R Structure: {'✓ PASSED' if r_ok else '✗ FAILED'}")
+    print(f"BLUEs REML: {'✓ PASSED' if blues_ok else '✗ FAILED'}")
+    print(f"GBLUP REML: {'✓ PASSED' if gblup_ok else '✗ FAILED'}")
+    print(f"Kernel GxE Ridge: {'✓ PASSED' if kernel_ok else '✗ FAILED'}")
+    print(f"Ensemble Mean: {'✓ PASSED' if ensemble_ok else '✗ FAILED'}")
+    print(f"Kronecker Names: {'✓ PASSED' if kronecker_ok else '✗ FAILED'}")
+    print(f"Fold Bins: {'✓ PASSED' if bins_ok else '✗ FAILED'}")
+    print(f"Compressed Trees: {'✓ PASSED' if compressed_ok else '✗ FAILED'}")
+    print(f"Registry Round Trip: {'✓ PASSED' if registry_ok else '✗ FAILED'}")
     print(f"Migration: {'✓ COMPLETE' if migration_ok else '✗ INCOMPLETE'}")
     
-    overall_status = python_ok and r_ok and migration_ok
+    overall_status = python_ok and r_ok and blues_ok and gblup_ok and kernel_ok and ensemble_ok and kronecker_ok and bins_ok and compressed_ok and registry_ok and migration_ok
     print(f"\nOverall Status: {'✓ READY FOR TRAINING' if overall_status else '✗ NEEDS FIXES'}")
     
     if overall_status:
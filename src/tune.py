@@ -0,0 +1,235 @@
+"""
+Multi-fidelity hyperparameter search for the E, G and GxE LightGBM models.
+
+Random configurations are raced with Hyperband: brackets of successive halving over the
+number of boosting rounds, each trial early-stopped on an inner holdout of the fold's
+training rows (grouped by Hybrid or Env, so the holdout mimics the CV scheme). Trials run
+in parallel within a core budget and are appended to ``{name}_trials.jsonl``; the best
+configuration is written to ``{name}_params.json``, which the runners read with ``--params``.
+
+Example:
+    python3 -u tune.py --model E --cv 1 --seed 1 --cores 8
+    python3 -u run_e_model.py --cv 1 --fold 0 --seed 1 --params tuning_cv1_e_model_params.json
+"""
+import os
+import json
+import math
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import lightgbm as lgbm
+from sklearn.model_selection import GroupShuffleSplit
+
+from evaluate import avg_rmse
+from assembly import read_e_fold, g_or_gxe_designs
+from lgbm_dataset import MODEL_PARAMS, NUM_BOOST_ROUND, BIN_PARAMS, model_params, frame_to_array
+
+
+EARLY_STOPPING_ROUNDS = 20
+# bins are shared by every trial, so min_data_in_leaf must not pre-filter features
+TUNING_BIN_PARAMS = {**BIN_PARAMS, "feature_pre_filter": False}
+del TUNING_BIN_PARAMS["min_data_in_leaf"]
+
+_data = {}  # per worker: fold -> training data and constructed Datasets
+
+
+def sample_config(rng: np.random.Generator):
+    """One random configuration (log-uniform for scale parameters)."""
+    return {
+        "learning_rate": float(np.exp(rng.uniform(np.log(0.01), np.log(0.3)))),
+        "max_depth": int(rng.choice([3, 4, 5, 6, 8, -1])),
+        "num_leaves": int(np.exp(rng.uniform(np.log(7), np.log(255)))),
+        "min_data_in_leaf": int(np.exp(rng.uniform(np.log(5), np.log(200)))),
+        "feature_fraction": float(rng.uniform(0.5, 1.0)),
+        "bagging_fraction": float(rng.uniform(0.5, 1.0)),
+        "bagging_freq": 1,
+        "lambda_l2": float(np.exp(rng.uniform(np.log(1e-3), np.log(10.0)))),
+    }
+
+
+def inner_holdout(X, y, envs, groups, feature_name, categorical_feature, holdout, seed):
+    """Split a fold's training rows into fit and holdout rows, grouped by ``groups``."""
+    splitter = GroupShuffleSplit(n_splits=1, test_size=holdout, random_state=seed)
+    fit, hold = next(splitter.split(X, groups=groups))
+    return {
+        "X_fit": X[fit], "y_fit": y[fit],
+        "X_hold": X[hold], "y_hold": y[hold], "env_hold": envs[hold],
+        "feature_name": feature_name, "categorical_feature": categorical_feature,
+    }
+
+
+def _init_worker(data):
+    _data.update(data)
+
+
+def _datasets(fold):
+    d = _data[fold]
+    if "train_set" not in d:
+        d["train_set"] = lgbm.Dataset(
+            d["X_fit"], label=d["y_fit"], feature_name=d["feature_name"],
+            categorical_feature=d["categorical_feature"], params=TUNING_BIN_PARAMS,
+        ).construct()
+        d["valid_set"] = lgbm.Dataset(
+            d["X_hold"], label=d["y_hold"], feature_name=d["feature_name"],
+            categorical_feature=d["categorical_feature"], reference=d["train_set"],
+        ).construct()
+    return d
+
+
+def run_trial(params: dict, rounds: int, fold: int, early_stopping=True):
+    """Train ``rounds`` at most, early stopped on the holdout; score is the mean RMSE per Env."""
+    d = _datasets(fold)
+    start = time.perf_counter()
+    callbacks = [lgbm.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)] if early_stopping else []
+    booster = lgbm.train(
+        {**params, **TUNING_BIN_PARAMS}, d["train_set"], num_boost_round=rounds,
+        valid_sets=[d["valid_set"]], callbacks=callbacks,
+    )
+    best_iteration = booster.best_iteration if booster.best_iteration > 0 else booster.current_iteration()
+    df_eval = pd.DataFrame({
+        "Env": d["env_hold"], "ytrue": d["y_hold"],
+        "ypred": booster.predict(d["X_hold"], num_iteration=best_iteration),
+    })
+    return {
+        "fold": fold,
+        "rounds": rounds,
+        "best_iteration": best_iteration,
+        "stopped_early": booster.current_iteration() < rounds,
+        "score": avg_rmse(df_eval, verbose=False),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+class Search:
+    def __init__(self, pool, folds, params, log_path):
+        self.pool = pool
+        self.folds = folds
+        self.params = params  # fixed parameters (seed, threads) of every trial
+        self.log_path = log_path
+        self.last = {}  # (config id, fold) -> last result, reused once a trial stopped early
+
+    def evaluate(self, configs: dict, rounds: int, bracket: int):
+        """Mean holdout score of every configuration over the folds at ``rounds``."""
+        futures = {}
+        results = {}
+        for config_id, config in configs.items():
+            for fold in self.folds:
+                last = self.last.get((config_id, fold))
+                if last is not None and last["stopped_early"]:
+                    results[config_id, fold] = last  # more rounds would not change it
+                else:
+                    futures[config_id, fold] = self.pool.submit(run_trial, {**config, **self.params}, rounds, fold)
+        with open(self.log_path, "a") as log:
+            for key, future in futures.items():
+                results[key] = self.last[key] = future.result()
+                log.write(json.dumps({"bracket": bracket, "config_id": key[0], "params": configs[key[0]],
+                                      **results[key]}) + "\n")
+        return {
+            config_id: (
+                np.mean([results[config_id, fold]["score"] for fold in self.folds]),
+                np.mean([results[config_id, fold]["best_iteration"] for fold in self.folds]),
+            )
+            for config_id in configs
+        }
+
+    def successive_halving(self, configs: dict, rounds: int, max_rounds: int, eta: int, bracket: int):
+        while True:
+            scores = self.evaluate(configs, rounds, bracket)
+            ranked = sorted(configs, key=lambda c: scores[c][0])
+            print(f"[bracket {bracket}] {len(configs)} configs x {rounds} rounds, "
+                  f"best score {scores[ranked[0]][0]:.4f} (config {ranked[0]})")
+            if rounds >= max_rounds or len(configs) <= 1:
+                return ranked[0], scores[ranked[0]]
+            configs = {c: configs[c] for c in ranked[:max(1, len(configs) // eta)]}
+            rounds = min(max_rounds, rounds * eta)
+
+    def hyperband(self, rng, min_rounds: int, max_rounds: int, eta: int, brackets: int = None):
+        s_max = int(math.log(max_rounds / min_rounds, eta) + 1e-9)
+        best = None
+        config_id = 0
+        for s in list(range(s_max, -1, -1))[:brackets]:
+            n = math.ceil((s_max + 1) / (s + 1) * eta ** s)
+            configs = {config_id + i: sample_config(rng) for i in range(n)}
+            config_id += n
+            winner, (score, best_iteration) = self.successive_halving(
+                configs, max(1, round(max_rounds * eta ** -s)), max_rounds, eta, bracket=s
+            )
+            if best is None or score < best[1]:
+                best = (configs[winner], score, best_iteration)
+        return best
+
+
+def load_folds(args):
+    """Inner holdout data of every fold, and the name of the tuned model."""
+    data = {}
+    for fold in args.fold:
+        if args.model == "E":
+            xtrain, _, ytrain, _ = read_e_fold(args.cv, fold, args.seed)
+            X, categories = frame_to_array(xtrain)
+            feature_name = xtrain.columns.tolist()
+            keys = xtrain.index
+            y = ytrain.to_numpy()
+            name = f"tuning_cv{args.cv}_e_model"
+        else:
+            xtrain, _, suffix = g_or_gxe_designs(
+                args.cv, fold, args.seed, args.model, A=args.A, D=args.D, E=args.E,
+                lag_features=args.lag_features, svd=args.svd, n_components=args.n_components,
+            )
+            X, y, keys, feature_name = xtrain.X, xtrain.y, xtrain.index, xtrain.columns
+            categories = ["Field_Location"]
+            name = f"tuning_cv{args.cv}_{args.model.lower()}_model{suffix}"
+        envs = keys.get_level_values("Env").to_numpy()
+        groups = keys.get_level_values(args.holdout_group).to_numpy()
+        data[fold] = inner_holdout(X, y, envs, groups, feature_name, list(categories), args.holdout, args.seed)
+    return data, name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices={"E", "G", "GxE"}, required=True)
+    parser.add_argument("--cv", type=int, choices={0, 1, 2}, required=True)
+    parser.add_argument("--fold", type=int, choices={0, 1, 2, 3, 4}, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--A", action="store_true", default=False)
+    parser.add_argument("--D", action="store_true", default=False)
+    parser.add_argument("--E", action="store_true", default=False)
+    parser.add_argument("--svd", action="store_true", default=False)
+    parser.add_argument("--n_components", type=int, default=100)
+    parser.add_argument("--lag_features", action="store_true", default=False)
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of training groups held out")
+    parser.add_argument("--holdout_group", choices={"Hybrid", "Env"}, default="Hybrid")
+    parser.add_argument("--min_rounds", type=int, default=30)
+    parser.add_argument("--max_rounds", type=int, default=1000)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--brackets", type=int, default=None, help="run only the first (most exploratory) brackets")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="total core budget")
+    parser.add_argument("--n_jobs", type=int, default=1, help="LightGBM threads per trial")
+    args = parser.parse_args()
+
+    data, name = load_folds(args)
+    log_path = Path(f"{name}_trials.jsonl")
+    rng = np.random.default_rng(args.seed)
+    params = model_params(args.seed, args.n_jobs)
+    del params["max_depth"]  # tuned
+
+    with ProcessPoolExecutor(max(1, args.cores // args.n_jobs), initializer=_init_worker, initargs=(data,)) as pool:
+        search = Search(pool, args.fold, params, log_path)
+
+        # current runner configuration, for reference
+        baseline = [pool.submit(run_trial, {**MODEL_PARAMS, **params}, NUM_BOOST_ROUND, fold, False) for fold in args.fold]
+        baseline_score = np.mean([future.result()["score"] for future in baseline])
+        print(f"Baseline ({NUM_BOOST_ROUND} rounds, max_depth={MODEL_PARAMS['max_depth']}): {baseline_score:.4f}")
+
+        config, score, best_iteration = search.hyperband(rng, args.min_rounds, args.max_rounds, args.eta, args.brackets)
+
+    print(f"Best: {score:.4f} after {best_iteration:.0f} rounds (baseline {baseline_score:.4f})")
+    print(json.dumps(config, indent=2))
+    outfile = f"{name}_params.json"
+    with open(outfile, "w") as f:
+        json.dump({"params": config, "num_boost_round": int(round(best_iteration)), "score": score,
+                   "baseline_score": baseline_score}, f, indent=2)
+    print("Writing:", outfile)
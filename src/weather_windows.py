@@ -0,0 +1,152 @@
+"""
+Weather features over the phenology windows of an Env, from one sort and one prefix sum.
+
+The windows (``weather_windows.json`` next to this module, or ``--weather_windows`` of
+``create_datasets.py``) are day ranges ``[start, end)`` counted from the planting date of the
+Env (``"anchor": "planting"``, the median ``Date_Planted`` of its plots) or from January 1
+(``"anchor": "calendar"``). Their default names follow the EC periods (``pGerEme`` ...
+``pMatHar``), with day offsets of a typical Corn Belt season since the EC files give no
+per-Env stage dates. A feature is a daily variable (a column of the weather file or the
+derived ``GDD``) and a statistic: ``sum``, ``mean``, ``std``, ``count`` (days with data) or
+``count_above``/``count_below`` a threshold.
+
+The daily rows are sorted once by Env and day and every term the statistics need (values,
+squares, threshold indicators, valid days) is summed cumulatively in one pass, so each
+window of each Env is two binary searches and one difference of prefix sums, whatever
+the number and length of the windows. Windows without a day of data (two for ``std``) are NaN.
+
+Example:
+    config = read_config()
+    planting = planting_dates(pd.read_csv("1_Training_Trait_Data_2014_2021.csv"))
+    feats = window_features(pd.read_csv("4_Training_Weather_Data_2014_2021.csv"), planting, config)
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+CONFIG_PATH = Path(__file__).resolve().with_name("weather_windows.json")
+STATS = {"sum", "mean", "std", "count", "count_above", "count_below"}
+DAY_BITS = 32  # keys are env code << DAY_BITS | day number
+
+
+def read_config(path: Path = None):
+    config = json.loads(Path(path or CONFIG_PATH).read_text())
+    if config.get("anchor", "planting") not in {"planting", "calendar"}:
+        raise Exception(f'Unknown anchor {config["anchor"]}, one of planting, calendar.')
+    for window, (start, end) in config["windows"].items():
+        if end <= start:
+            raise Exception(f"Window {window} ends before it starts: [{start}, {end}).")
+    for feature in config["features"]:
+        if feature["stat"] not in STATS:
+            raise Exception(f'Unknown statistic {feature["stat"]}, one of {", ".join(sorted(STATS))}.')
+        if feature["stat"].startswith("count_") and "threshold" not in feature:
+            raise Exception(f'{feature["variable"]} {feature["stat"]} needs a threshold.')
+    return config
+
+
+def feature_name(feature: dict, window: str):
+    threshold = f'_{feature["threshold"]:g}' if "threshold" in feature else ""
+    return f'{feature["variable"]}_{feature["stat"]}{threshold}_{window}'
+
+
+def planting_dates(trait: pd.DataFrame, envs=None):
+    """
+    Planting date of every Env: the median ``Date_Planted`` of its plots, else the median
+    planting day of year of its Field_Location, else of all Envs (e.g. the test Envs).
+    """
+    dates = pd.to_datetime(trait["Date_Planted"], format="%m/%d/%y", errors="coerce")
+    planted = dates.groupby(trait["Env"]).median().dropna()
+    envs = pd.Index(sorted(set(planted.index) | set(envs if envs is not None else [])), name="Env")
+
+    doy = planted.dt.dayofyear
+    locations = pd.Series(envs.str.replace("(_).*", "", regex=True), index=envs)
+    location_doy = doy.groupby(locations.reindex(doy.index)).median()
+    fallback = locations.map(location_doy).fillna(doy.median() if len(doy) else 1)
+    years = pd.to_datetime(envs.str[-4:] + "-01-01", format="%Y-%m-%d", errors="coerce")
+    estimated = pd.Series(years + pd.to_timedelta(fallback.to_numpy().round() - 1, unit="D"), index=envs)
+    return planted.reindex(envs).fillna(estimated).dt.floor("D").rename("Date_Planted")
+
+
+def daily_values(weather: pd.DataFrame, variable: str, config: dict):
+    if variable == "GDD":  # growing degree days, temperatures clipped to [base, cap]
+        base, cap = config["gdd"]["base"], config["gdd"]["cap"]
+        tmax = weather["T2M_MAX"].to_numpy(float).clip(base, cap)
+        tmin = weather["T2M_MIN"].to_numpy(float).clip(base, cap)
+        return (tmax + tmin) / 2 - base
+    return weather[variable].to_numpy(float)
+
+
+def window_features(weather: pd.DataFrame, planting: pd.Series, config: dict):
+    """Features of every window of every Env of ``weather``, one row per Env."""
+    dates = weather["Date"]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates.astype(str), format="%Y%m%d")
+    codes, envs = pd.factorize(weather["Env"], sort=True)
+    days = dates.to_numpy("datetime64[D]").astype(np.int64)
+    order = np.lexsort((days, codes))
+    keys = (codes[order].astype(np.int64) << DAY_BITS) | days[order]
+
+    # the terms summed cumulatively, one column each
+    terms = {}  # key -> (column, daily values)
+
+    def term(key, values):
+        return terms.setdefault(key, (len(terms), values))[0]
+
+    values = {}
+    columns = []  # (feature, sum term, square term, count term)
+    for feature in config["features"]:
+        variable = feature["variable"]
+        if variable not in values:
+            values[variable] = daily_values(weather, variable, config)[order]
+        x = values[variable]
+        valid = term(("valid", variable), ~np.isnan(x))
+        stat = feature["stat"]
+        if stat == "count_above":
+            main = term(("above", variable, feature["threshold"]), x > feature["threshold"])
+        elif stat == "count_below":
+            main = term(("below", variable, feature["threshold"]), x < feature["threshold"])
+        else:
+            main = term(("sum", variable), np.nan_to_num(x))
+        square = term(("square", variable), np.nan_to_num(x) ** 2) if stat == "std" else None
+        columns.append((feature, main, square, valid))
+
+    prefix = np.zeros((len(keys) + 1, len(terms)))
+    for i, x in terms.values():
+        np.cumsum(x, out=prefix[1:, i])
+
+    # window boundaries of every Env, [lo, hi) rows of the sorted days
+    if config.get("anchor", "planting") == "planting":
+        anchor = pd.to_datetime(planting.reindex(envs)).to_numpy("datetime64[D]")
+    else:
+        anchor = pd.to_datetime(envs.str[-4:] + "-01-01", format="%Y-%m-%d", errors="coerce").to_numpy("datetime64[D]")
+    known = ~np.isnat(anchor)
+    anchor = np.where(known, anchor, np.datetime64(0, "D")).astype(np.int64)
+    base = np.arange(len(envs), dtype=np.int64) << DAY_BITS
+    windows = config["windows"]
+    starts = np.array([start for start, _ in windows.values()], dtype=np.int64)
+    ends = np.array([end for _, end in windows.values()], dtype=np.int64)
+    lo = np.searchsorted(keys, (base + anchor)[:, None] + starts[None, :])
+    hi = np.searchsorted(keys, (base + anchor)[:, None] + ends[None, :])
+    sums = prefix[hi] - prefix[lo]  # env x window x term
+
+    out = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for feature, main, square, valid in columns:
+            n = sums[:, :, valid]
+            s = sums[:, :, main]
+            stat = feature["stat"]
+            if stat == "mean":
+                x = s / n
+            elif stat == "std":
+                x = np.sqrt(np.maximum(sums[:, :, square] - s ** 2 / n, 0) / (n - 1))
+            elif stat == "count":
+                x = n
+            else:  # sum and counts
+                x = s
+            x = np.where((n > (stat == "std")) & known[:, None], x, np.nan)  # std needs two days
+            for j, window in enumerate(windows):
+                out[feature_name(feature, window)] = x[:, j]
+    return pd.DataFrame(out, index=pd.Index(envs, name="Env"))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Warm worker for the Python tasks of the pipeline, and the thin client that sends it jobs.
+
+``serve`` imports the runners (``create_datasets.py``, ``run_e_model.py`` and
+``run_g_or_gxe_model.py``, with pandas, LightGBM and scikit-learn) once and listens on a Unix
+socket. A job is the command line of a runner with the working directory and environment of
+the client: the worker parses the kinship files it reads (``--A``/``--D``) into its
+kinship cache unless they are there already, then forks a child that runs the runner's
+``main`` with the output sent back to the client. Children start with every import done and
+share the parsed kinships copy-on-write, so a job pays neither the interpreter startup nor
+the imports nor the kinship parsing, and a failing job cannot leave state behind in the
+worker. Up to ``--jobs`` children run at the same time.
+
+``run`` is the client: ``worker.py run run_e_model.py --cv=0 ...`` prints the output of the
+job and exits with its exit code, like ``python3 -u run_e_model.py --cv=0 ...``, and runs the
+job itself when no worker is listening. ``run_local.py --worker`` sends its tasks this way.
+The worker keeps the code it imported at start: restart it after editing the runners.
+
+Example:
+    python3 -u worker.py serve --jobs 4 &
+    python3 -u worker.py run run_g_or_gxe_model.py --cv=0 --fold=0 --seed=1 --model=G --A --svd
+    python3 -u worker.py stop
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import argparse
+import importlib
+import traceback
+from pathlib import Path
+
+
+RUNNERS = {
+    "create_datasets.py": "create_datasets",
+    "run_e_model.py": "run_e_model",
+    "run_g_or_gxe_model.py": "run_g_or_gxe_model",
+}
+KINSHIP_FLAGS = {"--A": "kinship_additive.txt", "--D": "kinship_dominant.txt"}
+SOCKET_PATH = Path(os.environ.get("WORKER_SOCKET", f"/tmp/maize_gxe_worker_{os.getuid()}.sock"))
+EXIT_MARKER = b"\0"  # followed by the 4-byte exit code, the last bytes sent for a job
+
+
+def read_request(conn: socket.socket):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(1 << 16)
+        if not chunk:
+            return None
+        data += chunk
+    return json.loads(data)
+
+
+def send_exit(conn: socket.socket, code: int):
+    try:
+        conn.sendall(EXIT_MARKER + code.to_bytes(4, "big", signed=True))
+    except OSError:
+        pass  # the client is gone
+    conn.close()
+
+
+def warm(request: dict):
+    """Parse the kinship files of a job into the cache the children inherit."""
+    from assembly import kinship_table
+    for flag, name in KINSHIP_FLAGS.items():
+        path = Path(request["cwd"]) / name
+        if flag in request["argv"] and path.exists():
+            try:
+                kinship_table(path)
+            except Exception:
+                pass  # the job reads it again and reports the error
+
+
+def run_job(modules: dict, request: dict, conn: socket.socket):
+    """Run a job in this (forked) process with its output on ``conn``, return the exit code."""
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    for fd in (1, 2):
+        os.dup2(conn.fileno(), fd)
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.argv = [request["script"], *request["argv"]]
+    code = 0
+    try:
+        module = modules[request["script"]]
+        module.parser.prog = request["script"]  # usage messages name the script, not the worker
+        module.main(module.parser.parse_args(request["argv"]))
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    atexit._run_exitfuncs()  # os._exit skips them: the instrumentation log of the job
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+
+def serve(path: Path, jobs: int):
+    import assembly
+    modules = {script: importlib.import_module(name) for script, name in RUNNERS.items()}
+    assembly.KINSHIP_CACHE = {}
+
+    path.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen(64)
+    server.settimeout(0.1)
+    print(f"Worker {os.getpid()} listening on {path}, {jobs} jobs at a time")
+
+    running = {}  # child pid -> (connection, job)
+    stopping = False
+    while running or not stopping:
+        # finished jobs: send their exit code
+        while running:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            conn, job = running.pop(pid)
+            code = os.waitstatus_to_exitcode(status)
+            send_exit(conn, code)
+            print(f"[done] {job} (exit code {code})")
+        if stopping or len(running) >= jobs:
+            time.sleep(0.05)
+            continue
+
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            continue
+        conn.settimeout(None)
+        request = read_request(conn)
+        if request is None:
+            conn.close()
+            continue
+        if request.get("stop"):
+            print("Stopping after", len(running), "running jobs")
+            stopping = True
+            conn.close()
+            continue
+        if request["script"] not in modules:
+            conn.sendall(f"Unknown runner {request['script']}, one of {', '.join(RUNNERS)}\n".encode())
+            send_exit(conn, 2)
+            continue
+
+        job = " ".join([request["script"], *request["argv"]])
+        warm(request)
+        pid = os.fork()
+        if pid == 0:
+            server.close()
+            os._exit(run_job(modules, request, conn))
+        running[pid] = (conn, job)
+        print(f"[start] {job}")
+
+    server.close()
+    path.unlink(missing_ok=True)
+
+
+def run(path: Path, script: str, argv: list):
+    """Send a job to the worker, print its output and return its exit code (run it here without a worker)."""
+    script = Path(script).name
+    if script not in RUNNERS:
+        raise Exception(f"{script} is not a worker runner, one of {', '.join(RUNNERS)}.")
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        conn.close()
+        module = importlib.import_module(RUNNERS[script])
+        sys.argv = [script, *argv]
+        module.main(module.parser.parse_args(argv))
+        return 0
+
+    request = {"script": script, "argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+    conn.sendall(json.dumps(request).encode() + b"\n")
+    tail = b""
+    out = sys.stdout.buffer
+    while True:
+        chunk = conn.recv(1 << 16)
+        if not chunk:
+            break
+        tail += chunk
+        if len(tail) > 5:  # hold back what may be the exit code
+            out.write(tail[:-5])
+            out.flush()
+            tail = tail[-5:]
+    conn.close()
+    if len(tail) == 5 and tail[:1] == EXIT_MARKER:
+        return int.from_bytes(tail[1:], "big", signed=True)
+    out.write(tail)
+    print("The worker closed the connection before the job finished", file=sys.stderr)
+    return 1
+
+
+def stop(path: Path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(str(path))
+    conn.sendall(json.dumps({"stop": True}).encode() + b"\n")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", type=Path, default=SOCKET_PATH, help="Unix socket of the worker (env WORKER_SOCKET)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="start a worker")
+    serve_parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="jobs run at the same time")
+    run_parser = commands.add_parser("run", help="run a job on the worker")
+    run_parser.add_argument("script", choices=list(RUNNERS))
+    run_parser.add_argument("argv", nargs=argparse.REMAINDER, help="arguments of the script")
+    commands.add_parser("stop", help="stop the worker after its running jobs")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket, args.jobs)
+    elif args.command == "run":
+        sys.exit(run(args.socket, args.script, args.argv))
+    else:
+        stop(args.socket)
@@ -1,14 +1,362 @@
 #!/usr/bin/env python3
 import os
+import re
+import ast
+import json
 import logging
 from pathlib import Path
+from typing import NamedTuple
+from functools import lru_cache
 from argparse import ArgumentParser
 from urllib.parse import quote
 
 logging.basicConfig(level=logging.DEBUG)
 
 # --- Import Pegasus API ------------------------------------------------------
-from Pegasus.api import *
+try:
+    from Pegasus.api import *
+except ImportError:  # the stage graph below is also used by run_local.py
+    pass
+
+
+# --- Stage graph -------------------------------------------------------------
+# Every stage (job script) is a list of tasks, one per command of the script.
+# Dependencies follow from the files: a task depends on the tasks producing its inputs.
+CVS = range(3)
+FOLDS = range(5)
+SEEDS = range(1, 11)
+KINSHIPS = ("additive", "dominant")
+G_VARIANTS = (("A",), ("A", "E"), ("D",), ("D", "E"))
+GBLUP_KINSHIPS = ("A", "D")  # also the kernel GxE models
+GXE_VARIANTS = (("A",), ("D",))
+N_COMPONENTS = 100
+
+TRAINING_FILES = [
+    "1_Training_Trait_Data_2014_2021.csv",
+    "2_Training_Meta_Data_2014_2021.csv",
+    "3_Training_Soil_Data_2015_2021.csv",
+    "4_Training_Weather_Data_2014_2021.csv",
+    "6_Training_EC_Data_2014_2021.csv",
+    "All_hybrid_names_info.csv",
+]
+TESTING_FILES = [
+    "1_Submission_Template_2022.csv",
+    "2_Testing_Meta_Data_2022.csv",
+    "3_Testing_Soil_Data_2022.csv",
+    "4_Testing_Weather_Data_2022.csv",
+    "6_Testing_EC_Data_2022.csv",
+]
+VCF_FILE = "5_Genotype_Data_All_2014_2025_Hybrids.vcf"
+
+
+class Task(NamedTuple):
+    name: str
+    command: list  # run in the working directory, where the scripts are staged
+    inputs: list
+    outputs: list
+    code: list  # the script the command runs first, then other scripts it runs
+    memory: str = "1024 MB"
+
+
+class Stage(NamedTuple):
+    name: str  # job script
+    tasks: list
+
+    @property
+    def inputs(self):
+        produced = {f for task in self.tasks for f in task.outputs}
+        return list(dict.fromkeys(f for task in self.tasks for f in task.inputs if f not in produced))
+
+    @property
+    def outputs(self):
+        return list(dict.fromkeys(f for task in self.tasks for f in task.outputs))
+
+
+def datasets(cv, fold, seed):
+    return [f"cv{cv}_{d}_fold{fold}_seed{seed}.csv" for d in ("xtrain", "xval", "ytrain", "yval")]
+
+
+def targets(cv, fold, seed):
+    return [f"cv{cv}_{d}_fold{fold}_seed{seed}.csv" for d in ("ytrain", "yval")]
+
+
+def predictions(cv, model, fold, seed, suffix="", feat_imp=True):
+    kinds = ("feat_imp", "oof", "pred_train") if feat_imp else ("oof", "pred_train")
+    return [f"cv{cv}_{kind}_{model}_model_fold{fold}_seed{seed}{suffix}.csv" for kind in kinds]
+
+
+def runs(cvs, folds, seeds):
+    return [(cv, fold, seed) for cv in cvs for fold in folds for seed in seeds]
+
+
+def task_family(name):
+    """Task name without its cv, fold and seed: the tasks sharing a memory request."""
+    return re.sub(r"_?(cv\d+|fold\d+|seed\d+)", "", name)
+
+
+def stage_graph(cvs=CVS, folds=FOLDS, seeds=SEEDS, feature_store=None):
+    """
+    Stages of the pipeline with the tasks of every (cv, fold, seed), as run by the job scripts.
+    With a ``feature_store`` (``ingest.py``), the datasets read its per-Env features and the
+    Kronecker rows of unchanged Envs are copied from the last build (``kronecker.py``).
+    """
+    store = [] if feature_store is None else [f"--feature_store={feature_store}"]
+    blues = Stage(
+        "1-job_blues.sh",
+        [
+            Task(
+                "blues",
+                ["python3", "-u", "blues.py"],
+                ["1_Training_Trait_Data_2014_2021.csv"],
+                ["blues.csv", "cvs_h2s.csv"],
+                ["blues.py"],
+            )
+        ],
+    )
+
+    job_datasets = Stage(
+        "2-job_datasets.sh",
+        [
+            Task(
+                f"datasets_cv{cv}_fold{fold}_seed{seed}",
+                ["python3", "-u", "create_datasets.py", f"--cv={cv}", f"--fold={fold}", f"--seed={seed}", *store],
+                ["blues.csv", *TRAINING_FILES, *TESTING_FILES],
+                [*datasets(cv, fold, seed), f"cv{cv}_xtest_fold{fold}_seed{seed}.csv"],
+                ["create_datasets.py"],
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+        ],
+    )
+
+    # create_individuals.py reads the targets of every cv and fold of seeds 1 to 10
+    genomics = Stage(
+        "3-job_genomics.sh",
+        [
+            Task(
+                "genomics",
+                ["bash", "3-job_genomics.sh"],
+                [*(f for run in runs(CVS, FOLDS, SEEDS) for f in targets(*run)), VCF_FILE],
+                [
+                    "individuals.txt",
+                    "individuals.csv",
+                    "maize_indiv.recode.vcf",
+                    "maize_maf001.recode.vcf",
+                    "maize_pruned.prune.in",
+                    "maize_pruned.prune.out",
+                    "maize_pruned.nosex",
+                    "maize_pruned.vcf",
+                    "kinship_additive.txt",
+                    "kinship_dominant.txt",
+                    "maize_pruned.log",
+                    "kinships.txt",
+                ],
+                ["3-job_genomics.sh", "create_individuals.py", "kinship.R"],
+            )
+        ],
+    )
+
+    # kronecker.R reads the datasets of every fold and seed of a cv
+    kroneckers = Stage(
+        "4-job_kroneckers.sh",
+        [
+            Task(
+                f"kronecker_{kinship}_cv{cv}",
+                ["Rscript", "kronecker.R", str(cv), "FALSE", kinship] if feature_store is None else [
+                    "python3", "-u", "kronecker.py", f"--cv={cv}", f"--kinship={kinship}",
+                    f"--cache={Path(feature_store) / 'kronecker'}",
+                ],
+                [*(f for run in runs([cv], FOLDS, SEEDS) for f in datasets(*run)), f"kinship_{kinship}.txt"],
+                [f"cv{cv}_kronecker_{kinship}.arrow"],
+                ["kronecker.R" if feature_store is None else "kronecker.py"],
+                memory="4096 MB",
+            )
+            for cv in cvs
+            for kinship in KINSHIPS
+        ],
+    )
+
+    e = Stage(
+        "5-job_e.sh",
+        [
+            Task(
+                f"e_model_cv{cv}_fold{fold}_seed{seed}",
+                ["python3", "-u", "run_e_model.py", f"--cv={cv}", f"--fold={fold}", f"--seed={seed}"],
+                datasets(cv, fold, seed),
+                predictions(cv, "e", fold, seed),
+                ["run_e_model.py"],
+                memory="2048 MB",
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+        ],
+    )
+
+    g = Stage(
+        "6-job_g.sh",
+        [
+            Task(
+                f"g_model_{'_'.join(variant)}_svd_cv{cv}_fold{fold}_seed{seed}_lag_features",
+                [
+                    "python3", "-u", "run_g_or_gxe_model.py", f"--cv={cv}", f"--fold={fold}", f"--seed={seed}",
+                    "--model=G", *(f"--{x}" for x in variant), "--svd", "--lag_features",
+                ],
+                [*datasets(cv, fold, seed), f"kinship_{'additive' if 'A' in variant else 'dominant'}.txt"],
+                predictions(cv, "g", fold, seed, f"_{'_'.join(variant)}_lag_features_svd{N_COMPONENTS}comps"),
+                ["run_g_or_gxe_model.py"],
+                memory="6144 MB" if "E" in variant else "4096 MB",  # the E features add a dense block
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+            for variant in G_VARIANTS
+        ]
+        + [
+            Task(
+                f"gblup_{kinship}_cv{cv}_fold{fold}_seed{seed}",
+                [
+                    "python3", "-u", "run_g_or_gxe_model.py", f"--cv={cv}", f"--fold={fold}", f"--seed={seed}",
+                    "--model=GBLUP", f"--{kinship}",
+                ],
+                [*targets(cv, fold, seed), f"kinship_{'additive' if kinship == 'A' else 'dominant'}.txt"],
+                predictions(cv, "gblup", fold, seed, f"_{kinship}", feat_imp=False),
+                ["run_g_or_gxe_model.py"],
+                memory="2048 MB",
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+            for kinship in GBLUP_KINSHIPS
+        ],
+    )
+
+    gxe = Stage(
+        "7-job_gxe.sh",
+        [
+            Task(
+                f"gxe_model_{'_'.join(variant)}_svd_cv{cv}_fold{fold}_seed{seed}_lag_features",
+                [
+                    "python3", "-u", "run_g_or_gxe_model.py", f"--cv={cv}", f"--fold={fold}", f"--seed={seed}",
+                    "--model=GxE", *(f"--{x}" for x in variant), "--svd", "--lag_features",
+                ],
+                [*datasets(cv, fold, seed), f"cv{cv}_kronecker_{'additive' if 'A' in variant else 'dominant'}.arrow"],
+                predictions(cv, "gxe", fold, seed, f"_{'_'.join(variant)}_lag_features_svd{N_COMPONENTS}comps"),
+                ["run_g_or_gxe_model.py"],
+                memory="8192 MB",  # rows of the Kronecker file of the cv
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+            for variant in GXE_VARIANTS
+        ]
+        + [
+            Task(
+                f"kgxe_{kinship}_cv{cv}_fold{fold}_seed{seed}",
+                [
+                    "python3", "-u", "run_g_or_gxe_model.py", f"--cv={cv}", f"--fold={fold}", f"--seed={seed}",
+                    "--model=KGxE", f"--{kinship}", "--eigen_cache=eigen_cache",
+                ],
+                [*datasets(cv, fold, seed), f"kinship_{'additive' if kinship == 'A' else 'dominant'}.txt"],
+                predictions(cv, "kgxe", fold, seed, f"_{kinship}", feat_imp=False),
+                ["run_g_or_gxe_model.py"],
+                memory="4096 MB",  # Env x Hybrid grid and the kinship factor
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+            for kinship in GBLUP_KINSHIPS
+        ],
+    )
+
+    fa = Stage(
+        "8-job_fa.sh",
+        [
+            Task(
+                f"fa_cv{cv}_fold{fold}_seed{seed}",
+                ["Rscript", "fa.R", str(cv), str(fold), str(seed), "FALSE", "FALSE"],
+                [*targets(cv, fold, seed), "kinship_additive.txt"],
+                predictions(cv, "fa", fold, seed, feat_imp=False),
+                ["fa.R"],
+                memory="4096 MB",
+            )
+            for cv, fold, seed in runs(cvs, folds, seeds)
+        ],
+    )
+
+    return [blues, job_datasets, genomics, kroneckers, e, g, gxe, fa]
+
+
+def replicas(data_dir):
+    """Input files of the pipeline: the training data directory and the sibling Testing_Data."""
+    files = {}
+    for directory in (Path(data_dir), Path(data_dir).parent / "Testing_Data"):
+        for file in directory.iterdir():
+            files[file.name] = file.resolve()
+    return files
+
+
+def code_path(name):
+    """Path of a script or module: job scripts are in the repository root, the others in src."""
+    root = Path(__file__).parent
+    return (root / name) if (root / name).exists() else (root / "src" / name)
+
+
+@lru_cache(maxsize=None)
+def local_imports(name):
+    """Modules of src imported by a Python script, directly or through other modules."""
+    found = []
+    for node in ast.walk(ast.parse(code_path(name).read_text())):
+        if isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules = [node.module]
+        elif isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        else:
+            continue
+        for module in modules:
+            if code_path(f"{module}.py").exists():
+                for file in (f"{module}.py", *local_imports(f"{module}.py")):
+                    if file not in found:
+                        found.append(file)
+    return tuple(found)
+
+
+def requirements(task):
+    """Files staged with the script of a task: the other scripts it runs and their local imports."""
+    files = list(task.code[1:])
+    for script in task.code:
+        if script.endswith(".py"):
+            files.extend(local_imports(script))
+    return list(dict.fromkeys(f for f in files if f != task.code[0]))
+
+
+def check_graph(tasks, available=()):
+    """
+    Problems of a task graph: files produced by more than one task, inputs that no task
+    produces and are not ``available``, missing scripts and dependency cycles.
+    """
+    problems = []
+    producer = {}
+    for task in tasks:
+        for f in task.outputs:
+            if f in producer:
+                problems.append(f"{f} is produced by {producer[f]} and {task.name}")
+            producer[f] = task.name
+        for f in task.code:
+            if not code_path(f).exists():
+                problems.append(f"{task.name} runs missing script {f}")
+    available = set(available)
+    for task in tasks:
+        for f in task.inputs:
+            if f not in producer and f not in available:
+                problems.append(f"{task.name} reads {f}, which no task produces")
+
+    # Kahn's algorithm: tasks left over are on a cycle
+    deps = {t.name: {producer[f] for f in t.inputs if f in producer} for t in tasks}
+    dependents = {t.name: [] for t in tasks}
+    for name, ds in deps.items():
+        for d in ds:
+            dependents[d].append(name)
+    ready = [name for name, ds in deps.items() if not ds]
+    left = {name: len(ds) for name, ds in deps.items()}
+    while ready:
+        for name in dependents[ready.pop()]:
+            left[name] -= 1
+            if left[name] == 0:
+                ready.append(name)
+    cycle = [name for name, n in left.items() if n > 0]
+    if cycle:
+        problems.append(f"dependency cycle through {', '.join(cycle[:5])}")
+    return problems
 
 
 class MaizeGxEWorkflow:
@@ -20,6 +368,7 @@ class MaizeGxEWorkflow:
     dagfile = None
     wf_name = None
     wf_dir = None
+    memory = {}  # task family -> memory request, overriding the stage graph (memory_report.py)
 
     # --- Init ----------------------------------------------------------------
     def __init__(self, dagfile="workflow.yml"):
@@ -79,7 +428,12 @@ class MaizeGxEWorkflow:
         self.sc.add_sites(local, exec_site)
 
     # --- Transformation Catalog (Executables and Containers) -----------------
-    def create_transformation_catalog(self, exec_site_name="condorpool"):
+    def create_transformation_catalog(self, exec_site_name="condorpool", cluster_size=1):
+        """
+        One transformation per script that a task runs, in the container, staged with the
+        modules it imports. Tasks of the same script at the same level of the workflow are
+        clustered ``cluster_size`` per job with ``pegasus-plan --cluster horizontal``.
+        """
         self.tc = TransformationCatalog()
         maize_gxe = Container(
             "maize-gxe", Container.SINGULARITY, "docker://willtheg/maize:v1.2.4"
@@ -87,324 +441,68 @@ class MaizeGxEWorkflow:
         self.tc.add_containers(maize_gxe)
 
         transforms = {}
-        for file in Path.cwd().glob("*.sh"):
+        for task in (task for stage in stage_graph() for task in stage.tasks):
+            script = task.code[0]
+            if script in transforms:
+                continue
             tc = Transformation(
-                file.name,
+                script,
                 site="local",
-                pfn=file.resolve(),
+                pfn=code_path(script).resolve(),
                 is_stageable=True,
                 container=maize_gxe,
             )
-            transforms[file.name] = tc
+            tc.add_env(PYTHONUNBUFFERED="1")
+            if cluster_size > 1:
+                tc.add_pegasus_profile(clusters_size=cluster_size)
+            transforms[script] = tc
             self.tc.add_transformations(tc)
 
-        tc = Transformation(
-            "blues.R",
-            site="local",
-            pfn=(file.parent / "src/blues.R").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["1-job_blues.sh"].add_requirement(tc).add_pegasus_profile(
-            memory="1024 MB"
-        )
-
-        tc = Transformation(
-            "create_datasets.py",
-            site="local",
-            pfn=(file.parent / "src/create_datasets.py").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["2-job_datasets.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "preprocessing.py",
-            site="local",
-            pfn=(file.parent / "src/preprocessing.py").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["2-job_datasets.sh"].add_requirement(tc)
-        transforms["5-job_e.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "create_individuals.py",
-            site="local",
-            pfn=(file.parent / "src/create_individuals.py").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["3-job_genomics.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "kinship.R",
-            site="local",
-            pfn=(file.parent / "src/kinship.R").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["3-job_genomics.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "kronecker.R",
-            site="local",
-            pfn=(file.parent / "src/kronecker.R").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["4-job_kroneckers.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "run_e_model.py",
-            site="local",
-            pfn=(file.parent / "src/run_e_model.py").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["5-job_e.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "evaluate.py",
-            site="local",
-            pfn=(file.parent / "src/evaluate.py").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["5-job_e.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "run_g_or_gxe_model.py",
-            site="local",
-            pfn=(file.parent / "src/run_g_or_gxe_model.py").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["6-job_g.sh"].add_requirement(tc)
-        transforms["7-job_gxe.sh"].add_requirement(tc)
-
-        tc = Transformation(
-            "fa.R",
-            site="local",
-            pfn=(file.parent / "src/fa.R").resolve(),
-            is_stageable=True,
-        )
-        self.tc.add_transformations(tc)
-        transforms["8-job_fa.sh"].add_requirement(tc)
+        for task in (task for stage in stage_graph() for task in stage.tasks):
+            tc = transforms[task.code[0]]
+            for file in requirements(task):
+                if file not in transforms:
+                    transforms[file] = Transformation(
+                        file,
+                        site="local",
+                        pfn=code_path(file).resolve(),
+                        is_stageable=True,
+                    )
+                    self.tc.add_transformations(transforms[file])
+                if file not in tc.requires:
+                    tc.add_requirement(transforms[file])
 
     # --- Replica Catalog (Executables and Containers) ------------------------
     def create_replica_catalog(self, data_dir):
         self.rc = ReplicaCatalog()
 
-        for file in Path(data_dir).iterdir():
-            self.rc.add_replica("local", file.name, file.resolve())
-        for file in (Path(data_dir).parent / "Testing_Data").iterdir():
-            self.rc.add_replica("local", file.name, file.resolve())
+        for name, path in replicas(data_dir).items():
+            self.rc.add_replica("local", name, path)
 
     # --- Create Workflow -----------------------------------------------------
     def create_workflow(self):
         self.wf = Workflow(self.wf_name, infer_dependencies=True)
 
-        job_blues = (
-            Job("1-job_blues.sh")
-            .add_inputs("1_Training_Trait_Data_2014_2021.csv")
-            # .add_outputs("logs/blues.txt", stage_out=True, register_replica=False)
-            .add_outputs("blues.csv", stage_out=True, register_replica=False)
-            .add_outputs("cvs_h2s.csv", stage_out=True, register_replica=False)
-        )
-
-        # logs = []
-        xtrain = set()
-        xval = set()
-        ytrain = set()
-        yval = set()
-        feat_imp_e_model_fold = set()
-        oof_e_model_fold = set()
-        pred_train_e_model_fold = set()
-        oof_g_model_fold = set()
-        oof_gxe_model_fold = set()
-        oof_fa_model_fold = set()
-        pred_train_fa_model_fold = set()
-        # logs_e_model_cv = set()
-        for cv in range(3):
-            for fold in range(5):
-                for seed in range(1, 11):
-                    xtrain.add(f"cv{cv}_xtrain_fold{fold}_seed{seed}.csv")
-                    xval.add(f"cv{cv}_xval_fold{fold}_seed{seed}.csv")
-                    ytrain.add(f"cv{cv}_ytrain_fold{fold}_seed{seed}.csv")
-                    yval.add(f"cv{cv}_yval_fold{fold}_seed{seed}.csv")
-                    # logs.append(f"logs/datasets_cv${cv}_fold${fold}_seed${seed}.txt")
-
-                    feat_imp_e_model_fold.add(
-                        f"cv{cv}_feat_imp_e_model_fold{fold}_seed{seed}.csv"
-                    )
-                    oof_e_model_fold.add(
-                        f"cv{cv}_oof_e_model_fold{fold}_seed{seed}.csv"
-                    )
-                    pred_train_e_model_fold.add(
-                        f"cv{cv}_pred_train_e_model_fold{fold}_seed{seed}.csv"
-                    )
-                    # oof_g_model_fold.add(
-                    #     f"cv{cv}_oof_g_model_fold{fold}_seed{seed}.csv"
-                    # )
-                    # oof_gxe_model_fold.add(
-                    #     f"cv{cv}_oof_gxe_model_fold{fold}_seed{seed}.csv"
-                    # )
-                    oof_fa_model_fold.add(
-                        f"cv{cv}_oof_fa_model_fold{fold}_seed{seed}.csv"
-                    )
-                    pred_train_fa_model_fold.add(
-                        f"cv{cv}_pred_train_fa_model_fold{fold}_seed{seed}.csv"
-                    )
-                    # logs_e_model_cv.add(
-                    #     f"logs/e_model_cv{cv}_fold{fold}_seed{seed}.txt"
-                    # )
-
-        job_datasets = (
-            Job("2-job_datasets.sh")
-            .add_inputs("blues.csv")
-            .add_inputs("1_Training_Trait_Data_2014_2021.csv")
-            .add_inputs("2_Training_Meta_Data_2014_2021.csv")
-            .add_inputs("3_Training_Soil_Data_2015_2021.csv")
-            .add_inputs("4_Training_Weather_Data_2014_2021.csv")
-            .add_inputs("6_Training_EC_Data_2014_2021.csv")
-            .add_inputs("All_hybrid_names_info.csv")
-            .add_inputs("1_Submission_Template_2022.csv")
-            .add_inputs("2_Testing_Meta_Data_2022.csv")
-            .add_inputs("3_Testing_Soil_Data_2022.csv")
-            .add_inputs("4_Testing_Weather_Data_2022.csv")
-            .add_inputs("6_Testing_EC_Data_2022.csv")
-            .add_outputs(*xtrain, stage_out=True, register_replica=False)
-            .add_outputs(*xval, stage_out=True, register_replica=False)
-            .add_outputs(*ytrain, stage_out=True, register_replica=False)
-            .add_outputs(*yval, stage_out=True, register_replica=False)
-        )
-        job_datasets.add_pegasus_profile(memory="1024 MB")
-
-        job_genomics = (
-            Job("3-job_genomics.sh")
-            .add_inputs(*ytrain)
-            .add_inputs(*yval)
-            .add_inputs("5_Genotype_Data_All_2014_2025_Hybrids.vcf")
-            .add_outputs("individuals.txt", stage_out=True, register_replica=False)
-            .add_outputs("individuals.csv", stage_out=True, register_replica=False)
-            .add_outputs(
-                "maize_indiv.recode.vcf", stage_out=True, register_replica=False
-            )
-            .add_outputs(
-                "maize_maf001.recode.vcf", stage_out=True, register_replica=False
-            )
-            .add_outputs(
-                "maize_pruned.prune.in", stage_out=True, register_replica=False
-            )
-            .add_outputs(
-                "maize_pruned.prune.out", stage_out=True, register_replica=False
-            )
-            .add_outputs("maize_pruned.nosex", stage_out=True, register_replica=False)
-            .add_outputs("maize_pruned.vcf", stage_out=True, register_replica=False)
-            .add_outputs("kinship_additive.txt", stage_out=True, register_replica=False)
-            .add_outputs("kinship_dominant.txt", stage_out=True, register_replica=False)
-            .add_outputs("maize_pruned.log", stage_out=True, register_replica=False)
-            .add_outputs("kinships.txt", stage_out=True, register_replica=False)
-        )
-        job_genomics.add_pegasus_profile(memory="1024 MB")
-
-        job_kroneckers = (
-            Job("4-job_kroneckers.sh")
-            .add_inputs(*xtrain)
-            .add_inputs(*xval)
-            .add_inputs(*ytrain)
-            .add_inputs(*yval)
-            .add_inputs(
-                *[f"kinship_{kinship}.txt" for kinship in ("additive", "dominant")]
-            )
-            .add_outputs(
-                *[
-                    f"kronecker_{kinship}_cv{cv}.txt"
-                    for cv in range(3)
-                    for kinship in ("additive", "dominant")
-                ],
-                stage_out=True,
-                register_replica=False,
-            )
-            .add_outputs(
-                *[
-                    f"cv{cv}_kronecker_{kinship}.arrow"
-                    for cv in range(3)
-                    for kinship in ("additive", "dominant")
-                ],
-                stage_out=True,
-                register_replica=False,
-            )
-        )
-        job_kroneckers.add_pegasus_profile(memory="4096 MB")
-
-        job_e = (
-            Job("5-job_e.sh")
-            .add_inputs(*xtrain)
-            .add_inputs(*xval)
-            .add_inputs(*ytrain)
-            .add_inputs(*yval)
-            .add_inputs(
-                "1_Training_Trait_Data_2014_2021.csv",
-                "1_Submission_Template_2022.csv",
-                "2_Training_Meta_Data_2014_2021.csv",
-                "2_Testing_Meta_Data_2022.csv",
-            )
-            # .add_outputs(*logs_e_model_cv, stage_out=True, register_replica=False)
-            .add_outputs(*feat_imp_e_model_fold, stage_out=True, register_replica=False)
-            .add_outputs(*oof_e_model_fold, stage_out=True, register_replica=False)
-            .add_outputs(
-                *pred_train_e_model_fold, stage_out=True, register_replica=False
-            )
-        )
-        job_e.add_pegasus_profile(memory="2048 MB")
-
-        job_g = (
-            Job("6-job_g.sh")
-            .add_inputs(*xtrain)
-            .add_inputs(*xval)
-            .add_inputs(*ytrain)
-            .add_inputs(*yval)
-            .add_inputs(
-                *[f"kinship_{kinship}.txt" for kinship in ("additive", "dominant")]
-            )
-            # .add_outputs(*feat_imp_e_model_fold, stage_out=True, register_replica=False)
-        )
-
-        job_gxe = (
-            Job("7-job_gxe.sh")
-            .add_inputs(*xtrain)
-            .add_inputs(*xval)
-            .add_inputs(*ytrain)
-            .add_inputs(*yval)
-            .add_inputs(
-                *[f"kronecker_{kinship}.arrow" for kinship in ("additive", "dominant")]
-            )
-            # .add_outputs(*feat_imp_e_model_fold, stage_out=True, register_replica=False)
-        )
-
-        job_fa = (
-            Job("8-job_fa.sh")
-            .add_inputs(*ytrain)
-            .add_inputs(*yval)
-            .add_inputs("kinship_additive.txt")
-            .add_outputs(*oof_fa_model_fold, stage_out=True, register_replica=False)
-            .add_outputs(
-                *pred_train_fa_model_fold, stage_out=True, register_replica=False
-            )
-        )
-
-        self.wf.add_jobs(
-            job_blues,
-            job_datasets,
-            job_genomics,
-            job_kroneckers,
-            job_e,
-            job_g,
-            job_gxe,
-            job_fa,
-        )
+        # one job per task, the scripts' loops over cv, fold and seed are unrolled
+        for stage in stage_graph():
+            for task in stage.tasks:
+                script = task.code[0]
+                job = (
+                    Job(script, _id=task.name, node_label=task.name)
+                    .add_args(*task.command[task.command.index(script) + 1:])
+                    .add_inputs(*task.inputs)
+                    .add_outputs(*task.outputs, stage_out=True, register_replica=False)
+                    .add_pegasus_profile(memory=self.memory.get(task_family(task.name), task.memory))
+                )
+                self.wf.add_jobs(job)
+
+    # --- Validate (no Pegasus or HTCondor needed) ----------------------------
+    def validate(self, data_dir):
+        tasks = [task for stage in stage_graph() for task in stage.tasks]
+        problems = check_graph(tasks, replicas(data_dir))
+        for problem in problems:
+            logging.error(problem)
+        return not problems
 
 
 if __name__ == "__main__":
@@ -437,10 +535,40 @@ if __name__ == "__main__":
         default="workflow.yml",
         help="Output file (default: workflow.yml)",
     )
+    parser.add_argument(
+        "-c",
+        "--cluster_size",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="Tasks per clustered job with pegasus-plan --cluster horizontal (default: 1, no clustering)",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory_requests",
+        metavar="STR",
+        type=str,
+        default=None,
+        help="JSON of memory requests per task family, written by memory_report.py (default: the stage graph's)",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Only check the task graph against the input data",
+    )
 
     args = parser.parse_args()
 
     workflow = MaizeGxEWorkflow(args.output)
+    if args.memory_requests is not None:
+        with open(args.memory_requests) as f:
+            workflow.memory = json.load(f)
+
+    print("Validating task graph...")
+    if not workflow.validate(args.data):
+        raise SystemExit("Invalid task graph")
+    if args.validate:
+        raise SystemExit(0)
 
     if not args.skip_sites_catalog:
         print("Creating execution sites...")
@@ -450,7 +578,7 @@ if __name__ == "__main__":
     workflow.create_pegasus_properties()
 
     print("Creating transformation catalog...")
-    workflow.create_transformation_catalog(args.execution_site_name)
+    workflow.create_transformation_catalog(args.execution_site_name, args.cluster_size)
 
     print("Creating replica catalog...")
     workflow.create_replica_catalog(args.data)